@@ -0,0 +1,105 @@
+"""
+Measure deployments of a synthetic site with the mirroring backends of
+velican2.core.deploy: a full deployment into an empty target and then a
+deployment of a small change (a few changed, added and removed files).
+
+    python benchmarks/deploy.py [--files 5000] [--size 8192] [--change 20]
+
+The ssh backend runs against a local stand-in (this script called with
+--ssh HOST COMMAND) which executes the remote command locally, so no ssh
+server is needed.
+"""
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+from types import SimpleNamespace
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def standin(host: str, command: str):
+    """ssh stand-in: run `command` on 'host' which is this machine"""
+    sys.exit(subprocess.call(command, shell=True))
+
+
+def generate(output: Path, files: int, size: int):
+    for number in range(files):
+        path = output / f"{number % 50:02d}" / f"page-{number}.html"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size // 2).hex().encode())
+
+
+def change(output: Path, count: int):
+    pages = sorted(output.rglob("page-*.html"))
+    for path in pages[:count]:
+        path.write_text(path.read_text()[::-1])
+    for path in pages[-count // 2:]:
+        path.unlink()
+    (output / "new").mkdir(exist_ok=True)
+    for number in range(count // 2):
+        (output / "new" / f"added-{number}.html").write_text("added")
+
+
+class Site(SimpleNamespace):
+    __str__ = lambda self: "benchmark"
+
+
+def deploy(backend: str, target: str, output: Path) -> float:
+    from velican2.core import deploy
+    site = Site(deploy_target=target, get_deploy=lambda: deploy.get(backend))
+    publish = SimpleNamespace(site=site, progress=lambda **kwargs: None)
+    started = time.perf_counter()
+    deploy.run(publish, output)
+    return time.perf_counter() - started
+
+
+def compare(source: Path, target: Path):
+    expected = {path.relative_to(source).as_posix(): path.read_bytes() for path in source.rglob("*")
+                if path.is_file() and ".velican" not in path.parts}
+    actual = {path.relative_to(target).as_posix(): path.read_bytes() for path in target.rglob("*") if path.is_file()}
+    if expected != actual:
+        sys.exit(f"{target} differs from {source}")
+
+
+def main():
+    if sys.argv[1:2] == ["--ssh"]:
+        return standin(*sys.argv[-2:])
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--size", type=int, default=8192)
+    parser.add_argument("--change", type=int, default=20, help="Number of changed files (half as many are added and removed)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "velican2.settings")
+    os.environ["VELICAN_DEPLOY_SSH"] = f"{sys.executable} {Path(__file__).resolve()} --ssh"
+    sys.path.insert(0, str(BASE_DIR))
+    import django
+    from django.conf import settings
+    settings.SUBCOMMAND = "check"
+    django.setup()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        generate(tmp / "output", args.files, args.size)
+        for backend in ("local", "ssh"):
+            output = tmp / f"output-{backend}"
+            shutil.copytree(tmp / "output", output)
+            target = tmp / f"target-{backend}"
+            address = str(target) if backend == "local" else f"localhost:{target}"
+            full = deploy(backend, address, output)
+            compare(output, target)
+            change(output, args.change)
+            small = deploy(backend, address, output)
+            compare(output, target)
+            print(f"{backend}: full deployment of {args.files} files {full * 1000:.0f} ms, "
+                  f"deployment of {args.change * 2} changes {small * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Measure the access log ingestion (velican2.caddy.logs) on a synthetic caddy
+JSON log of existing sites: lines per second of reading and rolling up the
+log on one core, and the time of writing the rollups.
+
+    python benchmarks/ingest.py [--lines 500000] [--paths 2000]
+
+Everything runs in a transaction that is rolled back, so the database is
+left as it was.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+HEADERS = {
+    "Accept": ["text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"],
+    "Accept-Encoding": ["gzip, deflate, br"],
+    "Accept-Language": ["en-US,en;q=0.5"],
+    "User-Agent": ["Mozilla/5.0 (X11; Linux x86_64; rv:128.0) Gecko/20100101 Firefox/128.0"],
+}
+
+
+def generate(path: Path, hosts: list, lines: int, paths: int):
+    started = time.time() - lines / 1000
+    with path.open("w") as file:
+        for number in range(lines):
+            file.write(json.dumps({
+                "level": "info", "ts": started + number / 1000, "logger": "http.log.access.log0",
+                "msg": "handled request",
+                "request": {
+                    "remote_ip": "203.0.113.7", "remote_port": "51234", "client_ip": "203.0.113.7",
+                    "proto": "HTTP/2.0", "method": "GET", "host": random.choice(hosts),
+                    "uri": f"/posts/post-{random.randrange(paths)}.html?utm_source=feed",
+                    "headers": HEADERS, "tls": {"resumed": False, "version": 772, "server_name": hosts[0]},
+                },
+                "bytes_read": 0, "user_id": "", "duration": 0.00123, "size": random.randrange(500, 50000),
+                "status": random.choice((200, 200, 200, 200, 304, 404)),
+                "resp_headers": {"Content-Type": ["text/html; charset=utf-8"], "Server": ["Caddy"]},
+            }))
+            file.write("\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", type=int, default=500000)
+    parser.add_argument("--paths", type=int, default=2000, help="Distinct paths per site")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "velican2.settings")
+    import django
+    from django.conf import settings
+    settings.SUBCOMMAND = "check"
+    django.setup()
+    from django.db import transaction
+    from velican2.caddy import logs
+    from velican2.core.models import Site
+
+    hosts = list(Site.objects.values_list("domain", flat=True)[:20]) + ["unknown.example.com"]
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "access.log"
+        generate(path, hosts, args.lines, args.paths)
+        size = path.stat().st_size
+        with transaction.atomic():
+            ingester = logs.Ingester("benchmark")
+            started = time.perf_counter()
+            ingester.consume(logs.read(path, 0), path.stat().st_ino)
+            reading = time.perf_counter() - started
+            rows = len(ingester.rollups)
+            started = time.perf_counter()
+            ingester.flush()
+            flushing = time.perf_counter() - started
+            transaction.set_rollback(True)
+    print(f"{ingester.lines} lines ({size / 2**20:.0f} MiB) rolled up in {reading:.2f}s: "
+          f"{ingester.lines / reading:.0f} lines/s, {size / 2**20 / reading:.0f} MiB/s, {ingester.skipped} skipped")
+    print(f"{rows} rollups written in {flushing * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Measure writing the output of a large synthetic site by one and by several
+processes (velican2.pelican.parallel) and check the outputs are the same.
+
+    python benchmarks/render.py [--articles 5000] [--processes 1 2 4] [--theme notmyidea]
+
+Articles are generated into a temporary content directory; every build
+writes into its own output directory which is compared with the output of
+the first build.
+"""
+import argparse
+import filecmp
+import os
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+ARTICLE = """Title: Article {n}
+Date: {date}
+Category: category-{category}
+Author: author-{author}
+Tags: tag-{tag}, common
+Slug: article-{n}
+
+{body}
+"""
+
+
+def generate(content: Path, articles: int):
+    (content / "content").mkdir(parents=True)
+    (content / "pages").mkdir()
+    for n in range(articles):
+        body = "\n\n".join(f"Paragraph {p} of article {n} with *some* text and a [link](https://example.com/{p})."
+                           for p in range(10))
+        date = f"{2000 + n % 25}-{n % 12 + 1:02}-{n % 28 + 1:02} 10:{n % 60:02}"
+        (content / "content" / f"article-{n}.md").write_text(
+            ARTICLE.format(n=n, date=date, category=n % 20, author=n % 7, tag=n % 50, body=body))
+
+
+def differences(left: Path, right: Path) -> list:
+    comparison = filecmp.dircmp(left, right)
+    found = [*comparison.left_only, *comparison.right_only, *comparison.diff_files]
+    for name in comparison.common_dirs:
+        found.extend(f"{name}/{path}" for path in differences(left / name, right / name))
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--theme", default="notmyidea")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BASE_DIR))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "velican2.settings")
+    import django
+    from django.conf import settings
+    settings.SUBCOMMAND = "check"
+    django.setup()
+    import pelican.settings
+    from velican2.pelican import parallel
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        generate(directory / "site", args.articles)
+        settings.VELICAN_RENDER_PARALLEL_FROM = 0
+        first = None
+        for processes in args.processes:
+            settings.VELICAN_RENDER_PROCESSES = processes
+            output = directory / f"output-{processes}"
+            conf = pelican.settings.read_settings(override={
+                "PATH": str(directory / "site"), "OUTPUT_PATH": str(output), "THEME": args.theme,
+                "PAGE_PATHS": ["pages"], "ARTICLE_PATHS": ["content"], "SITEURL": "https://example.com",
+                "CACHE_CONTENT": False, "FEED_ALL_ATOM": None, "CATEGORY_FEED_ATOM": None,
+                "AUTHOR_FEED_ATOM": None, "AUTHOR_FEED_RSS": None, "TRANSLATION_FEED_ATOM": None,
+            })
+            started = time.perf_counter()
+            parallel.Pelican(conf).run()
+            elapsed = time.perf_counter() - started
+            files = sum(len(names) for _, _, names in os.walk(output))
+            print(f"{processes} process(es): {elapsed:.2f} s, {files} files")
+            if first is None:
+                first = output
+            else:
+                changed = differences(first, output)
+                if changed:
+                    sys.exit(f"output of {processes} processes differs: {', '.join(changed[:10])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measure how long it takes to start a velican process - django.setup()
+including AppConfig.ready of all applications - in fresh interpreters.
+
+    python benchmarks/startup.py [--runs 10] [--caddy-delay 0.5]
+
+By default a local stand-in for caddy's admin API is started which answers
+every request after --caddy-delay seconds, so the impact of a slow caddy on
+the start of every worker, management command and test run is visible.
+Use --caddy URL to measure against a real caddy or --caddy "" to disable it.
+"""
+import argparse
+import http.server
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+# SUBCOMMAND is what manage.py sets before the setup
+SETUP = """
+import time
+started = time.perf_counter()
+import django
+from django.conf import settings
+settings.SUBCOMMAND = "check"
+django.setup()
+print(time.perf_counter() - started)
+"""
+
+
+class SlowCaddy(http.server.BaseHTTPRequestHandler):
+    delay = 0.0
+
+    def respond(self):
+        time.sleep(self.delay)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"[]")
+
+    do_GET = do_POST = do_PUT = do_PATCH = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+def measure(env: dict) -> float:
+    proc = subprocess.run([sys.executable, "-c", SETUP], cwd=BASE_DIR, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        print(f"process failed: {proc.stderr.strip().splitlines()[-1]}", file=sys.stderr)
+        return float("nan")
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--caddy", help="Caddy admin URL (empty to disable caddy, default is a local stand-in)")
+    parser.add_argument("--caddy-delay", type=float, default=0.5, help="Response delay of the stand-in caddy")
+    args = parser.parse_args()
+
+    caddy = args.caddy
+    if caddy is None:
+        SlowCaddy.delay = args.caddy_delay
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), SlowCaddy)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        caddy = f"http://127.0.0.1:{server.server_port}"
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="velican2.settings", VELICAN_CADDY=caddy)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (str(BASE_DIR), env.get("PYTHONPATH"))))
+    times = [measure(env) for _ in range(args.runs)]
+    print(f"django.setup() with caddy at {caddy or '(disabled)'}: median {statistics.median(times) * 1000:.0f} ms, "
+          f"min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms ({args.runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Measure how long a Pelican build of an existing site spends compiling theme
+templates without and with the Jinja bytecode cache (velican2.pelican.bytecode).
+
+    python benchmarks/templates.py example.com [--runs 3]
+
+Every build runs in a fresh interpreter like a publish of a new worker does.
+The cache of the site's theme is dropped first so the first cached build
+shows the cost of filling it and the following ones the cost of loading it.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+BUILD = """
+import sys, time
+import django
+from django.conf import settings
+settings.SUBCOMMAND = "check"
+django.setup()
+import pelican
+from velican2.core.models import Site
+engine = Site.objects.get(domain=sys.argv[1]).get_engine()
+cache = engine.conf['JINJA_ENVIRONMENT']['bytecode_cache']
+started = time.perf_counter()
+pelican.Pelican(engine.conf).run()
+print(time.perf_counter() - started, cache.compiling, cache.compiled, cache.loaded)
+"""
+
+DROP = """
+import sys
+import django
+from django.conf import settings
+settings.SUBCOMMAND = "check"
+django.setup()
+from velican2.core.models import Site
+from velican2.pelican import bytecode
+bytecode.invalidate(Site.objects.get(domain=sys.argv[1]).get_engine().theme.name)
+"""
+
+
+def run(script: str, domain: str, env: dict) -> list:
+    proc = subprocess.run([sys.executable, "-c", script, domain], cwd=BASE_DIR, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        sys.exit(f"process failed: {proc.stderr.strip().splitlines()[-1]}")
+    lines = proc.stdout.strip().splitlines()
+    return [float(value) for value in lines[-1].split()] if lines else []
+
+
+def report(label: str, results: list):
+    total = statistics.median(result[0] for result in results)
+    compiling = statistics.median(result[1] for result in results)
+    print(f"{label}: build median {total * 1000:.0f} ms, compiling templates {compiling * 1000:.0f} ms "
+          f"({int(results[-1][2])} compiled, {int(results[-1][3])} loaded, {len(results)} runs)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("domain", help="Domain of an existing pelican site")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE="velican2.settings")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, (str(BASE_DIR), env.get("PYTHONPATH"))))
+    report("without cache", [run(BUILD, args.domain, dict(env, VELICAN_TEMPLATE_CACHE="false"))
+                             for _ in range(args.runs)])
+    env["VELICAN_TEMPLATE_CACHE"] = "true"
+    run(DROP, args.domain, env)
+    report("first build with cache", [run(BUILD, args.domain, env)])
+    report("with cache", [run(BUILD, args.domain, env) for _ in range(args.runs)])
+
+
+if __name__ == "__main__":
+    main()
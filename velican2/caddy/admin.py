@@ -1,8 +1,28 @@
 from django.contrib import admin
-from .models import Settings
+from .models import LogCheckpoint, Settings, Traffic
 
 class CaddySettings(admin.ModelAdmin):
     readonly_fields = ("admin_url")
 
 # Register your models here.
-admin.register(Settings, CaddySettings)
\ No newline at end of file
+admin.register(Settings, CaddySettings)
+
+
+@admin.register(Traffic)
+class TrafficAdmin(admin.ModelAdmin):
+    list_display = ("hour", "site", "path", "hits", "bytes", "status_2xx", "status_3xx", "status_4xx", "status_5xx")
+    list_filter = ("site", )
+    date_hierarchy = "hour"
+    search_fields = ("path", )
+    list_select_related = ("site", )
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(LogCheckpoint)
+class LogCheckpointAdmin(admin.ModelAdmin):
+    list_display = ("name", "inode", "offset", "ts", "updated")
@@ -1,34 +1,138 @@
+import threading
+
 import requests
-import urllib3.exceptions
 
 from velican2.caddy import logger
 from django.apps import apps, AppConfig
 from django.conf import settings
 from django.db.models.signals import post_save
 
+SERVER = "/config/apps/http/servers/velican/"
+# fingerprinted assets (velican2.core.stages.fingerprint) never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# the velican server config is ensured once per process (on first use)
+_server_lock = threading.Lock()
+_server_ready = False
+
+
+def caddy(method: str, path: str, **kwargs) -> requests.Response:
+    """Call caddy's admin API. Every call has a timeout so a slow caddy cannot hang us"""
+    return requests.request(method, settings.CADDY_URL + path, timeout=settings.CADDY_TIMEOUT, **kwargs)
+
+
+def ensure_server():
+    """Make sure there is a caddy server with velican server config"""
+    global _server_ready
+    with _server_lock:
+        if _server_ready:
+            return
+        if caddy("GET", SERVER).status_code != 200:
+            caddy("POST", "/config/",
+                  json={"apps": {"http": {"servers": {"velican": {"listen": [":80", ":443"], "routes": []}}}}}
+                  ).raise_for_status()
+        _server_ready = True
+
+
+def get_routes() -> list:
+    routes = caddy("GET", SERVER + "routes/").json()
+    if isinstance(routes, dict) and "error" in routes:
+        raise requests.RequestException(routes["error"])
+    return routes or []
+
+
+def get_hosts(routes: list) -> set:
+    return {host for route in routes for match in route.get("match", []) for host in match.get("host", [])}
+
+
+def cache_control(value: str) -> dict:
+    return {"handler": "headers", "response": {"set": {"Cache-Control": [value]}}}
+
+
+def get_route(site, engine=None) -> dict:  # site: core.Site
+    from velican2.core import stages
+    engine = engine or site.get_engine()
+    routes = [{
+        # file_server answers with an ETag so expired pages are revalidated cheaply
+        "match": [{"path": ["*.html", "*/"]}],
+        "handle": [cache_control(f"public, max-age={settings.CADDY_HTML_MAX_AGE}, must-revalidate")],
+    }]
+    if stages.enabled("fingerprint"):
+        from velican2.core.stages import fingerprint
+        routes.insert(0, {
+            "match": [{"path_regexp": {"pattern": fingerprint.FINGERPRINTED.pattern}}],
+            "handle": [cache_control(IMMUTABLE)],
+        })
+    routes.append({
+        "handle": [{
+            "handler": "file_server",
+            "root": str(engine.get_publish_path())
+        }]
+    })
+    return {
+        "match": [{"host": [site.domain, ]}],
+        "handle": [{"handler": "subroute", "routes": routes}],
+    }
+
+
+def register(site, routes: list = None) -> bool:  # site: core.Site
+    """Add a route for the site or replace its outdated one. Return True when caddy was changed"""
+    ensure_server()
+    routes = get_routes() if routes is None else routes
+    route = get_route(site)
+    for index, existing in enumerate(routes):
+        if site.domain in get_hosts([existing]):
+            if existing == route:
+                logger.debug(f"Site {site.domain} already in caddy routes")
+                return False
+            caddy("PATCH", f"{SERVER}routes/{index}", json=route).raise_for_status()
+            routes[index] = route
+            return True
+    caddy("POST", SERVER + "routes/", json=route).raise_for_status()
+    routes.append(route)
+    return True
+
+
+def reconcile(engines: list) -> int:
+    """Add or replace routes of the sites of `engines` (their pelican Settings) in one update of
+    caddy's config, keeping other routes. Return the number of added or replaced routes.
+    The update is conditional (If-Match) so a route added by someone else meanwhile is never lost"""
+    ensure_server()
+    wanted = {}
+    for engine in engines:
+        wanted.setdefault(engine.site.domain, get_route(engine.site, engine))
+    response = caddy("GET", SERVER + "routes/")
+    routes = response.json() or []
+    if isinstance(routes, dict) and "error" in routes:
+        raise requests.RequestException(routes["error"])
+    reconciled, changed = [], 0
+    for route in routes:
+        domain = next((host for host in get_hosts([route]) if host in wanted), None)
+        if domain is None:
+            reconciled.append(route)
+            continue
+        replacement = wanted.pop(domain)
+        changed += replacement != route
+        reconciled.append(replacement)
+    reconciled.extend(wanted.values())
+    changed += len(wanted)
+    if changed:
+        headers = {"If-Match": response.headers["Etag"]} if "Etag" in response.headers else {}
+        caddy("PATCH", SERVER + "routes/", json=reconciled, headers=headers).raise_for_status()
+    return changed
+
 
 def on_site_save(instance, **kwargs):
     """Register a new handler for the site/domain"""
+    if not settings.CADDY_URL:
+        return  # disabled after the start (tests, see velican2.testing)
     if instance.deployment != "caddy":
         logger.debug(f"Site {instance.domain} is not handled by caddy")
         return
-
-    routes = requests.get(settings.CADDY_URL + "/config/apps/http/servers/velican/handlers/").json()
-    if not routes or "error" in routes:
-        logger.error("Error asking caddy for existing routes. " + (routes or dict()).get("error", "Empty response"))
-        return
-    if instance.domain in list(map(lambda h: h['match'][0]['host'], routes)):
-        logger.debug(f"Site {instance.domain} already in caddy handlers")
-        return
-    requests.post(
-        settings.CADDY_URL + "/config/apps/http/servers/velican/routes/",
-        json={
-            "match": [{"host":[instance.domain,]}],
-            "handle": [{
-                "handler": "file_server",
-                "root": str(instance.get_engine().get_publish_path())
-            }]
-        })
+    try:
+        register(instance)
+    except requests.RequestException as e:
+        logger.error(f"Cannot register {instance.domain} in caddy: {e}")
 
 
 class CaddyConfig(AppConfig):
@@ -37,21 +141,8 @@ class CaddyConfig(AppConfig):
 
     def ready(self):
         if not settings.CADDY_URL:
-            logger.warn(f"Caddy deployment disabled because of missing CADDY_URL settings")
+            logger.warning("Caddy deployment disabled because of missing CADDY_URL settings")
             return
-
-        try:
-            # check whether caddy is running (throws an exception if point is unreachable)
-            requests.get(settings.CADDY_URL, timeout=1)
-
-            post_save.connect(on_site_save, sender=apps.get_model("core", "Site"))
-
-            # make sure there is a caddy server with velican server config
-            if requests.get(settings.CADDY_URL + "/config/apps/http/servers/velican/").status_code != 200:
-                requests.post(settings.CADDY_URL + "/config/",
-                            json={"apps":{ "http": { "servers": { "velican": { "listen": [ ":80", ":443" ], "routes": []}}}}}
-                            )
-        except requests.ConnectTimeout as cto:
-            logger.error("Caddy initial connection timed out. Not allowing caddy deploy")
-        except urllib3.exceptions.NewConnectionError as nco:
-            logger.error("Cannot connect to caddy's admin interface")
\ No newline at end of file
+        # caddy is contacted lazily when a site is saved (or by `manage.py velican_sync_caddy`)
+        # so a slow or unreachable caddy does not block the start of every process
+        post_save.connect(on_site_save, sender=apps.get_model("core", "Site"))
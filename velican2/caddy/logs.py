@@ -0,0 +1,224 @@
+'''
+Ingestion of caddy's JSON access logs into hourly traffic rollups.
+
+    manage.py velican_ingest_logs /var/log/caddy/access-*.log.gz /var/log/caddy/access.log --follow
+
+Log files are read as streams of lines - memory mapped when they are plain
+files, decompressed on the fly when they are gzipped by the rotation. Every
+access line is mapped to a `core.Site` by its host (and the longest matching
+site path) and counted into `Traffic` of (site, hour, path): hits, bytes and
+status classes. Rollups are kept in memory and written every
+VELICAN_LOG_FLUSH seconds by bulk upserts that add to the stored counts.
+
+The position in the log (inode, offset and time of the last line) is stored
+in a `LogCheckpoint` in the same transaction as the rollups, so a restarted
+ingestion resumes exactly where the previous one committed - in the same
+file even when it was rotated (renamed) meanwhile. Files without the
+checkpoint's inode (e.g. compressed by the rotation) are skipped up to the
+checkpoint's time. The checkpoint is advanced by a conditional update, so
+two ingestions of the same log fail instead of counting lines twice.
+'''
+import gzip
+import json
+import mmap
+import os
+import threading
+import time
+
+from datetime import datetime, timezone
+from pathlib import Path
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+from velican2.caddy import logger
+from velican2.caddy.models import LogCheckpoint, Traffic
+from velican2.core.models import Site
+
+HOUR = 3600
+# upserted rows per statement
+BATCH = 1000
+# seconds between checks of a followed log that has no new lines
+POLL = 1.0
+# lines between checks whether the rollups should be flushed
+CHECK = 10000
+COUNTERS = ("hits", "bytes", "status_2xx", "status_3xx", "status_4xx", "status_5xx")
+
+
+class LogError(Exception):
+    pass
+
+
+class Sites:
+    """Site ids by host and path prefix (the longest prefix first)"""
+
+    def __init__(self):
+        self.hosts = {}
+        for id, domain, path in Site.objects.values_list("id", "domain", "path"):
+            self.hosts.setdefault(domain.lower(), []).append((path.rstrip("/"), id))
+        for prefixes in self.hosts.values():
+            prefixes.sort(key=lambda prefix: -len(prefix[0]))
+
+    def match(self, host: str, path: str):
+        prefixes = self.hosts.get(host)
+        if prefixes is None:
+            host = host.rsplit(":", 1)[0].lower()  # with a port or in upper case
+            prefixes = self.hosts.get(host, ())
+        for prefix, id in prefixes:
+            if not prefix or path == prefix or path.startswith(prefix + "/"):
+                return id
+        return None
+
+
+def read(path: Path, offset: int):
+    """Complete lines of the file at `path` from `offset` as (line, offset after the line)"""
+    if path.suffix == ".gz":
+        with gzip.open(path, "rb") as file:
+            file.seek(offset)
+            for line in file:
+                if not line.endswith(b"\n"):
+                    return
+                offset += len(line)
+                yield line, offset
+        return
+    with path.open("rb") as file:
+        yield from read_mapped(file, offset)
+
+
+def read_mapped(file, offset: int):
+    if os.fstat(file.fileno()).st_size <= offset:
+        return
+    with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        find = data.find
+        while (end := find(b"\n", offset)) >= 0:
+            yield data[offset:end], end + 1
+            offset = end + 1
+
+
+class Ingester:
+
+    def __init__(self, name: str):
+        self.checkpoint, _ = LogCheckpoint.objects.get_or_create(name=name)
+        self.sites = Sites()
+        self.rollups = {}
+        self.inode = self.checkpoint.inode
+        self.offset = self.checkpoint.offset
+        self.ts = self.checkpoint.ts
+        self.lines = 0
+        self.skipped = 0
+        self.flushed = time.monotonic()
+
+    def consume(self, lines, inode: int, skip_until: float = 0.0):
+        """Count access lines (from `read`) of the file `inode` into the rollups. Lines
+        logged before `skip_until` were counted already (from another file)"""
+        rollups, match, loads = self.rollups, self.sites.match, json.loads
+        count, offset, ts = 0, None, self.ts
+        for line, offset in lines:
+            count += 1
+            try:
+                entry = loads(line)
+                request = entry["request"]
+                moment = entry["ts"]
+                if moment <= skip_until:
+                    continue
+                skip_until, ts = 0.0, moment
+                path = request["uri"].split("?", 1)[0][:512]
+                site = match(request["host"], path)
+                if site is None:
+                    self.skipped += 1
+                    continue
+                key = (site, int(moment) // HOUR * HOUR, path)
+                counters = rollups.get(key)
+                if counters is None:
+                    counters = rollups[key] = [0, 0, 0, 0, 0, 0]
+                status = entry["status"] // 100
+                counters[0] += 1
+                counters[1] += entry.get("size", 0)
+                if 2 <= status <= 5:
+                    counters[status] += 1
+            except (ValueError, KeyError, TypeError, AttributeError):
+                self.skipped += 1  # not an access log line
+            if count % CHECK == 0 and time.monotonic() - self.flushed >= settings.VELICAN_LOG_FLUSH:
+                self.inode, self.offset, self.ts = inode, offset, ts
+                self.flush()
+                rollups, match = self.rollups, self.sites.match
+        if offset is not None:
+            self.inode, self.offset, self.ts = inode, offset, ts
+        self.lines += count
+
+    def flush(self):
+        """Write the rollups and move the checkpoint to the current position (one transaction)"""
+        if not self.rollups and (self.inode, self.offset) == (self.checkpoint.inode, self.checkpoint.offset):
+            return
+        rows = [(site, datetime.fromtimestamp(hour, tz=timezone.utc), path, *counters)
+                for (site, hour, path), counters in self.rollups.items()]
+        with transaction.atomic():
+            moved = LogCheckpoint.objects.filter(
+                id=self.checkpoint.id, inode=self.checkpoint.inode, offset=self.checkpoint.offset,
+            ).update(inode=self.inode, offset=self.offset, ts=self.ts, updated=datetime.now(tz=timezone.utc))
+            if not moved:
+                raise LogError(f"Checkpoint of {self.checkpoint.name} was moved by another ingestion")
+            upsert(rows)
+        self.checkpoint.inode, self.checkpoint.offset, self.checkpoint.ts = self.inode, self.offset, self.ts
+        self.rollups = {}
+        self.flushed = time.monotonic()
+        self.sites = Sites()  # sites added meanwhile
+        logger.debug(f"{len(rows)} rollup(s) of {self.checkpoint.name} written, offset {self.offset}")
+
+    def ingest(self, path: Path):
+        """Read the whole file at `path` (resuming at the checkpoint)"""
+        stat = path.stat()
+        if stat.st_ino == self.checkpoint.inode:
+            self.consume(read(path, self.offset), stat.st_ino)
+        elif stat.st_mtime > self.ts:
+            # another file than the checkpoint's one - lines up to its time were counted already
+            self.consume(read(path, 0), stat.st_ino, skip_until=self.ts)
+        self.flush()
+
+    def follow(self, path: Path, stop: threading.Event):
+        """Read new lines of the live log at `path` until `stop` is set (survives rotation)"""
+        while not stop.is_set():
+            try:
+                file = path.open("rb")
+            except FileNotFoundError:
+                stop.wait(POLL)  # rotated and not created again yet
+                continue
+            with file:
+                inode = os.fstat(file.fileno()).st_ino
+                offset = self.offset if inode == self.checkpoint.inode else 0
+                skip_until = 0.0 if inode == self.checkpoint.inode else self.ts
+                while not stop.is_set():
+                    self.consume(read_mapped(file, offset), inode, skip_until)
+                    if self.inode == inode:
+                        offset, skip_until = self.offset, 0.0
+                    if time.monotonic() - self.flushed >= settings.VELICAN_LOG_FLUSH:
+                        close_old_connections()
+                        self.flush()
+                    if rotated(path, inode, offset):
+                        self.consume(read_mapped(file, offset), inode, skip_until)  # written before the rename
+                        break
+                    stop.wait(POLL)
+        self.flush()
+
+
+def rotated(path: Path, inode: int, offset: int) -> bool:
+    """The live log is another file now (renamed) or it was truncated"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return True
+    return stat.st_ino != inode or stat.st_size < offset
+
+
+def upsert(rows: list):
+    """Add counters of `rows` to the stored rollups. Django cannot express `hits = hits + excluded.hits`
+    with bulk_create(update_conflicts=True) so it is one INSERT .. ON CONFLICT (PostgreSQL and SQLite)"""
+    table = connection.ops.quote_name(Traffic._meta.db_table)
+    columns = ["site_id", "hour", "path", *COUNTERS]
+    sql = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+           f"ON CONFLICT (site_id, hour, path) DO UPDATE SET "
+           + ", ".join(f"{name} = {table}.{name} + excluded.{name}" for name in COUNTERS))
+    hour = Traffic._meta.get_field("hour")
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH):
+            cursor.executemany(sql, [(site, hour.get_db_prep_value(moment, connection), path, *counters)
+                                     for site, moment, path, *counters in rows[start:start + BATCH]])
@@ -0,0 +1,41 @@
+import threading
+import time
+
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+
+from velican2.caddy import logs
+
+
+class Command(BaseCommand):
+    help = "Roll caddy's JSON access logs up into hourly traffic of sites (resumes at the last checkpoint)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("files", nargs="+", type=Path,
+                            help="Log files oldest first (rotated ones, then the live log)")
+        parser.add_argument("--follow", action="store_true",
+                            help="Keep reading new lines of the last file (until interrupted)")
+        parser.add_argument("--name", help="Name of the checkpoint (defaults to the path of the last file)")
+
+    def handle(self, files, follow, name, **options):
+        missing = [str(path) for path in files[:-1 if follow else None] if not path.is_file()]
+        if missing:
+            raise CommandError(f"No such file(s): {', '.join(missing)}")
+        ingester = logs.Ingester(name or str(files[-1].resolve()))
+        started = time.monotonic()
+        try:
+            for path in files[:-1] if follow else files:
+                ingester.ingest(path)
+                self.report(ingester, started)
+            if follow:
+                ingester.follow(files[-1], threading.Event())
+        except KeyboardInterrupt:
+            ingester.flush()
+        except logs.LogError as e:
+            raise CommandError(str(e))
+        self.report(ingester, started)
+
+    def report(self, ingester: logs.Ingester, started: float):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{ingester.lines} line(s) in {elapsed:.1f}s ({ingester.lines / max(elapsed, 1e-6):.0f} lines/s), "
+                          f"{ingester.skipped} skipped, offset {ingester.offset}")
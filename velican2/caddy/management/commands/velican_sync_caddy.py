@@ -0,0 +1,22 @@
+import requests
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from velican2.caddy.apps import ensure_server, get_routes, register
+from velican2.core.models import Site
+
+
+class Command(BaseCommand):
+    help = "Make sure caddy has the velican server and an up-to-date route for every site deployed by caddy (idempotent)"
+
+    def handle(self, **options):
+        if not settings.CADDY_URL:
+            raise CommandError("Caddy deployment is disabled (missing CADDY_URL settings)")
+        try:
+            ensure_server()
+            routes = get_routes()
+            added = sum(register(site, routes) for site in Site.objects.filter(deployment="caddy"))
+        except requests.RequestException as e:
+            raise CommandError(f"Cannot synchronize caddy: {e}")
+        self.stdout.write(f"{added} route(s) added or updated in caddy")
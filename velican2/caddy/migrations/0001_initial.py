@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('core', '0006_api_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='Path of the live log', max_length=255, unique=True)),
+                ('inode', models.PositiveBigIntegerField(default=0)),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('ts', models.FloatField(default=0.0)),
+                ('updated', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Settings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Traffic',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('path', models.CharField(max_length=512)),
+                ('hits', models.PositiveBigIntegerField(default=0)),
+                ('bytes', models.PositiveBigIntegerField(default=0)),
+                ('status_2xx', models.PositiveBigIntegerField(default=0)),
+                ('status_3xx', models.PositiveBigIntegerField(default=0)),
+                ('status_4xx', models.PositiveBigIntegerField(default=0)),
+                ('status_5xx', models.PositiveBigIntegerField(default=0)),
+                ('site', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.site')),
+            ],
+            options={
+                'verbose_name': 'Traffic',
+                'verbose_name_plural': 'Traffic',
+                'unique_together': {('site', 'hour', 'path')},
+            },
+        ),
+    ]
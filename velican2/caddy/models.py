@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils.translation import gettext as _
 
 
 
@@ -7,4 +8,36 @@ class Settings(models.Model):
 
     @property
     def admin_url(self):
-        return
\ No newline at end of file
+        return
+
+
+class Traffic(models.Model):
+    """Requests of one path of a site within one hour (rolled up from caddy's access logs)"""
+    site = models.ForeignKey("core.Site", on_delete=models.CASCADE)
+    hour = models.DateTimeField()
+    path = models.CharField(max_length=512)
+    hits = models.PositiveBigIntegerField(default=0)
+    bytes = models.PositiveBigIntegerField(default=0)
+    status_2xx = models.PositiveBigIntegerField(default=0)
+    status_3xx = models.PositiveBigIntegerField(default=0)
+    status_4xx = models.PositiveBigIntegerField(default=0)
+    status_5xx = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = _("Traffic")
+        verbose_name_plural = _("Traffic")
+        # the conflict target of the rollup upserts (velican2.caddy.logs)
+        unique_together = (("site", "hour", "path"), )
+
+    __str__ = lambda self: f"{self.site_id} {self.hour:%Y-%m-%d %H}h {self.path}"
+
+
+class LogCheckpoint(models.Model):
+    """How far an access log was ingested: the file (inode), the offset in it and the time of its last line"""
+    name = models.CharField(max_length=255, unique=True, help_text="Path of the live log")
+    inode = models.PositiveBigIntegerField(default=0)
+    offset = models.PositiveBigIntegerField(default=0)
+    ts = models.FloatField(default=0.0)
+    updated = models.DateTimeField(auto_now=True)
+
+    __str__ = lambda self: f"{self.name} @ {self.offset}"
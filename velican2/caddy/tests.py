@@ -1,3 +1,149 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import http.server
+import json
+import shutil
+import tempfile
+import threading
 
-# Create your tests here.
+from pathlib import Path
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+
+from velican2.caddy import logs
+from velican2.caddy.apps import get_route, reconcile
+from velican2.caddy.models import Traffic
+from velican2.core.models import Site
+from velican2.pelican.models import Theme
+
+
+def line(host: str, uri: str, ts: float, status: int = 200, size: int = 100) -> str:
+    return json.dumps({"level": "info", "ts": ts, "logger": "http.log.access", "msg": "handled request",
+                       "request": {"host": host, "uri": uri, "method": "GET"}, "status": status, "size": size}) + "\n"
+
+
+class IngestTest(TestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.root = Site.objects.create(domain="logs.example.com", lang="en_US", title="Root")
+        self.blog = Site.objects.create(domain="logs.example.com", path="/blog", lang="en_US", title="Blog")
+        self.directory = Path(tempfile.mkdtemp())
+        self.log = self.directory / "access.log"
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path: Path, *lines: str):
+        with path.open("a") as file:
+            file.writelines(lines)
+
+    def hits(self, site: Site) -> int:
+        return Traffic.objects.filter(site=site).aggregate(hits=Sum("hits"))["hits"] or 0
+
+    def test_rollups_per_site_hour_and_path(self):
+        self.write(self.log,
+                   line("logs.example.com", "/index.html?utm=1", 7200.5, size=10),
+                   line("LOGS.example.com:443", "/index.html", 7300, status=404, size=5),
+                   line("logs.example.com", "/blog/post.html", 10900),
+                   line("logs.example.com", "/blogpost.html", 10900, status=301),
+                   line("unknown.example.com", "/", 10900),
+                   "not json\n",
+                   line("logs.example.com", "/partial", 11000).rstrip("\n"))
+        ingester = logs.Ingester(str(self.log))
+        ingester.ingest(self.log)
+        index = Traffic.objects.get(site=self.root, path="/index.html")
+        self.assertEqual((index.hour.hour, index.hits, index.bytes, index.status_2xx, index.status_4xx), (2, 2, 15, 1, 1))
+        self.assertEqual(Traffic.objects.get(site=self.blog).path, "/blog/post.html")
+        self.assertEqual(Traffic.objects.get(site=self.root, path="/blogpost.html").status_3xx, 1)
+        self.assertEqual((ingester.lines, ingester.skipped), (6, 2))  # the partial line waits for its end
+
+    def test_resume_after_rotation(self):
+        self.write(self.log, *(line("logs.example.com", "/", 3600 + n) for n in range(3)))
+        logs.Ingester(str(self.log)).ingest(self.log)
+        # lines written before the rotation renamed the log, then lines of the new log
+        self.write(self.log, *(line("logs.example.com", "/", 3610 + n) for n in range(2)))
+        rotated = self.directory / "access-1.log"
+        self.log.rename(rotated)
+        self.write(self.log, line("logs.example.com", "/", 3620))
+        ingester = logs.Ingester(str(self.log))  # a restart
+        for path in (rotated, self.log):
+            ingester.ingest(path)
+        self.assertEqual(self.hits(self.root), 6)
+        # the rotated log compressed (another inode) is skipped up to the checkpoint
+        with rotated.open("rb") as source, gzip.open(rotated.with_suffix(".log.gz"), "wb") as target:
+            shutil.copyfileobj(source, target)
+        rotated.unlink()
+        ingester = logs.Ingester(str(self.log))
+        for path in (rotated.with_suffix(".log.gz"), self.log):
+            ingester.ingest(path)
+        self.assertEqual(self.hits(self.root), 6)
+
+    def test_concurrent_ingestion_fails(self):
+        self.write(self.log, line("logs.example.com", "/", 3600))
+        first, second = logs.Ingester(str(self.log)), logs.Ingester(str(self.log))
+        first.ingest(self.log)
+        with self.assertRaises(logs.LogError):
+            second.ingest(self.log)
+        self.assertEqual(self.hits(self.root), 1)
+
+
+class FakeCaddy(http.server.BaseHTTPRequestHandler):
+    """Routes of the velican server behind caddy's admin API (with Etag and If-Match)"""
+    routes = []
+    patches = 0
+
+    def etag(self) -> str:
+        return '"' + hashlib.sha1(json.dumps(FakeCaddy.routes).encode()).hexdigest() + '"'
+
+    def answer(self, status: int, data=None):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Etag", self.etag())
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.answer(200, FakeCaddy.routes if self.path.endswith("/routes/") else {"routes": FakeCaddy.routes})
+
+    def do_PATCH(self):
+        routes = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.headers.get("If-Match", self.etag()) != self.etag():
+            return self.answer(412, {"error": "precondition failed"})
+        FakeCaddy.routes = routes
+        FakeCaddy.patches += 1
+        self.answer(200)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ReconcileTest(TestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeCaddy)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        # created before caddy is enabled - the routes are pushed by the tests
+        self.sites = [Site.objects.create(domain=f"site{n}.example.com", lang="en_US", title="Site") for n in range(3)]
+        self.settings = override_settings(CADDY_URL=f"http://127.0.0.1:{self.server.server_port}")
+        self.settings.enable()
+        self.other = {"match": [{"host": ["other.example.com"]}], "handle": []}
+        FakeCaddy.routes = [self.other, {"match": [{"host": ["site0.example.com"]}], "handle": []},
+                            get_route(self.sites[1])]
+        FakeCaddy.patches = 0
+
+    def tearDown(self):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_routes_are_pushed_in_one_update(self):
+        engines = [site.get_engine() for site in self.sites]
+        self.assertEqual(reconcile(engines), 2)
+        self.assertEqual(FakeCaddy.patches, 1)
+        self.assertEqual(FakeCaddy.routes, [self.other, *(get_route(site) for site in self.sites)])
+        self.assertEqual(reconcile(engines), 0)
+        self.assertEqual(FakeCaddy.patches, 1)
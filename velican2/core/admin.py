@@ -1,13 +1,35 @@
-from django.contrib import admin
-from .models import Category, Site, Page, Post, Publish
+from django import forms
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from .models import Category, OutdatedException, Outbox, Site, Page, Post, Publish
 
 class PublishAdmin(admin.ModelAdmin):
-    list_display = ("site", "preview", "success", "message")
-    readonly_fields = ('started', 'finished', 'success', 'message')
+    list_display = ("site", "preview", "phase", "success", "message")
+    readonly_fields = ('started', 'finished', 'success', 'message', 'phase', 'log', 'peak_memory', 'allocations')
+
+class OutboxAdmin(admin.ModelAdmin):
+    list_display = ("post", "destination", "status", "attempts", "next_attempt", "message")
+    list_filter = ("destination", "status")
+    readonly_fields = ("key", "remote_id", "created", "updated")
+
+class ContentAdmin(admin.ModelAdmin):
+
+    def get_form(self, request, obj=None, **kwargs):
+        # the edited version goes back with the form so a save over a newer version fails
+        kwargs["widgets"] = {"version": forms.HiddenInput, **kwargs.get("widgets", {})}
+        return super().get_form(request, obj, **kwargs)
+
+    def changeform_view(self, request, object_id=None, form_url="", extra_context=None):
+        try:
+            return super().changeform_view(request, object_id, form_url, extra_context)
+        except OutdatedException as e:
+            self.message_user(request, f"{e} - reload the page and apply your changes again", messages.ERROR)
+            return HttpResponseRedirect(request.get_full_path())
 
 # Register your models here.
 admin.site.register(Site, admin.ModelAdmin)
 admin.site.register(Category, admin.ModelAdmin)
-admin.site.register(Page, admin.ModelAdmin)
-admin.site.register(Post, admin.ModelAdmin)
-admin.site.register(Publish, PublishAdmin)
\ No newline at end of file
+admin.site.register(Page, ContentAdmin)
+admin.site.register(Post, ContentAdmin)
+admin.site.register(Publish, PublishAdmin)
+admin.site.register(Outbox, OutboxAdmin)
\ No newline at end of file
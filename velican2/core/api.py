@@ -0,0 +1,252 @@
+'''
+Read API of posts, pages and categories of a site for headless clients and
+synchronisation jobs (staff of the site only).
+
+    GET /api/<domain>/posts/?fields=id,slug,updated&limit=500
+    GET /api/<domain>/posts/?updated_since=2024-01-01T00:00:00%2B00:00
+    GET /api/<domain>/posts/?order=-created&draft=false
+    GET /api/<domain>/pages/    GET /api/<domain>/categories/
+
+    GET /api/<domain>/posts/<id>/revisions/             versions of a post (or a page)
+    GET /api/<domain>/posts/<id>/revisions/<version>/   the post at a version
+    GET /api/<domain>/posts/<id>/revisions/<old>/diff/<new>/
+    POST /api/<domain>/posts/<id>/revisions/<version>/restore/
+
+Lists are paginated by a cursor (keyset) - `next` is the URL of the next page
+or null - so every page costs one index range scan no matter how deep the
+client is. `fields` selects a sparse fieldset (`content` is only returned
+when asked for). `updated_since` returns rows changed after the given time
+ordered by `updated` for delta synchronisation. First pages carry a weak
+ETag derived from the number and the last change of matching rows, checked
+before the page itself is loaded (clients poll the first page; following
+pages are loaded once so they are not charged with the aggregate).
+'''
+import base64
+import hashlib
+import json
+
+from datetime import datetime
+from django import http
+from django.db.models import Count, F, Max, Q
+from django.utils.dateparse import parse_datetime
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_POST, require_safe
+
+from velican2.core import db, revisions
+from velican2.core.archive import Encoder
+from velican2.core.models import Category, OutdatedException, Page, Post, Revision
+from velican2.core.views import get_site
+
+LIMIT = 100
+MAX_LIMIT = 1000
+
+
+class Resource:
+    """Fields and orderings of one listed model"""
+
+    def __init__(self, model, fields: dict, default: tuple, orders: tuple, filters: dict = None):
+        self.model = model
+        self.fields = fields  # name -> field name or expression
+        self.default = default
+        self.orders = orders  # first is the default
+        self.filters = filters or {}
+
+
+RESOURCES = {
+    "posts": Resource(
+        Post,
+        fields={
+            "id": "id", "slug": "slug", "title": "title", "lang": "lang", "description": "description",
+            "punchline": "punchline", "draft": "draft", "created": "created", "updated": "updated",
+            "publish_at": "publish_at", "content": "content",
+            "category": F("category__slug"), "author": F("author__username"),
+        },
+        default=("id", "slug", "title", "lang", "description", "draft", "created", "updated", "publish_at",
+                 "category", "author"),
+        orders=("updated", "-created"),
+        filters={"draft": "draft"}),
+    "pages": Resource(
+        Page,
+        fields={
+            "id": "id", "slug": "slug", "title": "title", "lang": "lang", "created": "created",
+            "updated": "updated", "publish_at": "publish_at", "content": "content",
+        },
+        default=("id", "slug", "title", "lang", "created", "updated", "publish_at"),
+        orders=("updated", "-created")),
+    "categories": Resource(
+        Category,
+        fields={"id": "id", "slug": "slug", "name": "name"},
+        default=("id", "slug", "name"),
+        orders=("id", )),
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def encode_cursor(values: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(values, cls=Encoder).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list:
+    """[value, id] of the last row of the previous page"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2 or type(values[1]) is not int:
+        raise BadRequest("Invalid cursor")
+    return values
+
+
+def to_datetime(value: str, name: str) -> datetime:
+    try:
+        parsed = parse_datetime(value) if isinstance(value, str) else None
+    except ValueError:
+        parsed = None  # well formatted but out of range
+    if parsed is None or parsed.tzinfo is None:
+        raise BadRequest(f"{name} must be an ISO datetime with a timezone")
+    return parsed
+
+
+def after(order: str, cursor: list) -> Q:
+    """Keyset condition of rows following `cursor` ([value, id]) in `order`"""
+    field = order.lstrip("-")
+    value, id = cursor
+    if field == "id":
+        return Q(id__lt=id) if order.startswith("-") else Q(id__gt=id)
+    value = to_datetime(value, "cursor")
+    if order.startswith("-"):
+        return Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": id})
+    return Q(**{f"{field}__gt": value}) | Q(**{field: value, "id__gt": id})
+
+
+def parse(resource: Resource, params) -> dict:
+    fields = params.get("fields")
+    fields = tuple(fields.split(",")) if fields else resource.default
+    unknown = set(fields) - set(resource.fields)
+    if unknown:
+        raise BadRequest(f"Unknown field(s) {', '.join(sorted(unknown))}")
+    order = params.get("order", resource.orders[0])
+    if order not in resource.orders:
+        raise BadRequest(f"order must be one of {', '.join(resource.orders)}")
+    filters = {}
+    if params.get("updated_since"):
+        if "updated" not in resource.fields:
+            raise BadRequest("updated_since is not supported")
+        filters["updated__gt"] = to_datetime(params["updated_since"], "updated_since")
+        order = "updated"
+    for name, field in resource.filters.items():
+        if name in params:
+            filters[field] = params[name].lower() in ("1", "true", "yes")
+    try:
+        limit = min(max(int(params.get("limit", LIMIT)), 1), MAX_LIMIT)
+    except ValueError:
+        raise BadRequest("limit must be a number")
+    return {"fields": fields, "order": order, "filters": filters, "limit": limit, "cursor": params.get("cursor")}
+
+
+def etag(resource: Resource, queryset, query: dict) -> str:
+    """Changes whenever a matching row is added, changed or removed (categories have no
+    change time so their ids, slugs and names are hashed - there are only a few of them)"""
+    if "updated" in resource.fields:
+        state = queryset.aggregate(count=Count("id"), last=Max("updated"))
+    else:
+        state = list(queryset.order_by("id").values_list("id", "slug", "name"))
+    digest = hashlib.sha1(json.dumps([state, query], cls=Encoder, sort_keys=True).encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+@require_safe
+def listing(request: http.HttpRequest, domain: str, resource: str):
+    site = get_site(request, domain)
+    resource = RESOURCES[resource]
+    with db.replica():
+        return respond(request, site, resource)
+
+
+def respond(request: http.HttpRequest, site, resource: Resource):
+    try:
+        query = parse(resource, request.GET)
+        queryset = resource.model.objects.filter(site=site, **query["filters"])
+        tag = None if query["cursor"] else etag(resource, queryset, query)
+        if tag and tag in request.headers.get("If-None-Match", ""):
+            response = http.HttpResponseNotModified()
+            response["ETag"] = tag
+            return response
+        order = query["order"]
+        if query["cursor"]:
+            queryset = queryset.filter(after(order, decode_cursor(query["cursor"])))
+    except BadRequest as e:
+        return http.JsonResponse({"error": str(e)}, status=400)
+
+    key = order.lstrip("-")
+    ordering = (order, "-id" if order.startswith("-") else "id") if key != "id" else (order, )
+    plain = [resource.fields[name] for name in query["fields"] if isinstance(resource.fields[name], str)]
+    # expressions are aliased - they may be named like a relation of the model (category)
+    expressions = {f"_{name}": resource.fields[name] for name in query["fields"] if not isinstance(resource.fields[name], str)}
+    # the ordering columns are always loaded to build the cursor
+    rows = list(queryset.order_by(*ordering).values(*{*plain, key, "id"}, **expressions)[:query["limit"] + 1])
+    more = len(rows) > query["limit"]
+    rows = rows[:query["limit"]]
+    next = None
+    if more:
+        params = request.GET.copy()
+        params["cursor"] = encode_cursor([rows[-1][key], rows[-1]["id"]])
+        next = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+    response = http.JsonResponse({
+        "items": [{name: row[resource.fields[name] if isinstance(resource.fields[name], str) else f"_{name}"]
+                   for name in query["fields"]} for row in rows],
+        "next": next,
+    }, encoder=Encoder)
+    if tag:
+        response["ETag"] = tag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def get_content(request: http.HttpRequest, domain: str, resource: str, id: int):
+    return get_object_or_404(RESOURCES[resource].model, site=get_site(request, domain), id=id)
+
+
+@require_safe
+def history(request: http.HttpRequest, domain: str, resource: str, id: int):
+    item = get_content(request, domain, resource, id)
+    rows = item.revisions.order_by("-version").values("version", "base", "created", author_name=F("author__username"))
+    return http.JsonResponse({"items": [{
+        "version": row["version"], "snapshot": row["version"] == row["base"],
+        "author": row["author_name"], "created": row["created"],
+    } for row in rows], "version": item.version}, encoder=Encoder)
+
+
+@require_safe
+def revision(request: http.HttpRequest, domain: str, resource: str, id: int, version: int):
+    item = get_content(request, domain, resource, id)
+    try:
+        return http.JsonResponse({"version": version, **revisions.load(item, version)}, encoder=Encoder)
+    except Revision.DoesNotExist:
+        raise http.Http404(f"Version {version} is not kept")
+
+
+@require_safe
+def diff(request: http.HttpRequest, domain: str, resource: str, id: int, old: int, new: int):
+    item = get_content(request, domain, resource, id)
+    try:
+        return http.JsonResponse(revisions.diff(item, old, new), encoder=Encoder)
+    except Revision.DoesNotExist:
+        raise http.Http404("Version is not kept")
+
+
+@require_POST
+def restore(request: http.HttpRequest, domain: str, resource: str, id: int, version: int):
+    item = get_content(request, domain, resource, id)
+    try:
+        revisions.restore(item, version, user=request.user)
+    except Revision.DoesNotExist:
+        raise http.Http404(f"Version {version} is not kept")
+    except PermissionError as e:
+        return http.JsonResponse({"error": str(e)}, status=403)
+    except OutdatedException as e:
+        return http.JsonResponse({"error": str(e)}, status=409)
+    return http.JsonResponse({"version": item.version})
@@ -0,0 +1,300 @@
+'''
+Site archive is a single (compressed) tar stream with everything that belongs
+to one site so that it can be backed up or moved to another node.
+
+    manifest.json            format version and what the archive contains
+    site.json                the Site row with usernames of its staff
+    engine.json              row of the engine settings (e.g. pelican.Settings)
+    categories/000000.jsonl  rows of categories, posts, pages, revisions of posts
+    posts/000000.jsonl       and pages and publishes in chunks of CHUNK rows
+    pages/...
+    revisions/...
+    publishes/...
+    media/...                site logo (relative to MEDIA_ROOT, restored into the
+                             media directory of the restored site)
+    content/...              content directory of the engine
+    output/...               output directory of the engine or, if the output was
+    output/000000.jsonl      skipped, only a listing of its files
+
+Rows and files are streamed so memory usage does not depend on the size of
+the site. Restore reads the archive as a stream as well and inserts rows in
+bulk (no signals are fired) remapping all primary and foreign keys.
+'''
+import base64
+import io
+import itertools
+import json
+import os
+import shutil
+import tarfile
+import time
+
+from datetime import datetime
+from pathlib import Path
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import models as auth
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.signals import post_save
+
+from velican2.core import db, logger
+from velican2.core.importers import bulk_create
+from velican2.core.models import Category, Page, Post, Publish, Revision, Site, site_logo_upload
+
+VERSION = 1
+CHUNK = 1000
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class Encoder(DjangoJSONEncoder):
+    """Keeps microseconds of datetimes (DjangoJSONEncoder rounds them to milliseconds)"""
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def add_bytes(tar: tarfile.TarFile, name: str, data: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def add_json(tar: tarfile.TarFile, name: str, data):
+    add_bytes(tar, name, json.dumps(data, cls=Encoder).encode("utf-8"))
+
+
+def add_rows(tar: tarfile.TarFile, directory: str, rows) -> int:
+    """Write dictionaries from `rows` iterator as JSON lines in chunks of CHUNK rows"""
+    count = 0
+    rows = iter(rows)
+    for number in itertools.count():
+        chunk = list(itertools.islice(rows, CHUNK))
+        if not chunk:
+            break
+        add_bytes(tar, f"{directory}/{number:06d}.jsonl",
+                  "".join(json.dumps(row, cls=Encoder) + "\n" for row in chunk).encode("utf-8"))
+        count += len(chunk)
+    return count
+
+
+def walk(root: Path):
+    """Yield regular files under `root` (symlinks are skipped - publish recreates them)"""
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = Path(directory) / filename
+            if not path.is_symlink():
+                yield path
+
+
+def add_tree(tar: tarfile.TarFile, arcname: str, root: Path) -> int:
+    count = 0
+    if root.is_dir():
+        for path in walk(root):
+            tar.add(str(path), arcname=f"{arcname}/{path.relative_to(root)}", recursive=False)
+            count += 1
+    return count
+
+
+def export(site: Site, fileobj, compression: str = "gz", output: bool = True) -> dict:
+    """Stream the whole `site` into `fileobj`. Return counts of exported rows and files"""
+    engine = site.get_engine()
+    counts = {}
+    with db.snapshot(site), tarfile.open(fileobj=fileobj, mode=f"w|{compression}") as tar:
+        add_json(tar, "manifest.json", {
+            "version": VERSION,
+            "site": str(site),
+            "engine": engine._meta.label,
+            "output": output,
+        })
+        row = Site.objects.filter(id=site.id).values().get()
+        row["staff"] = list(site.staff.values_list("username", flat=True))
+        add_json(tar, "site.json", row)
+        add_json(tar, "engine.json", type(engine).objects.filter(id=engine.id).values().get())
+        counts["categories"] = add_rows(tar, "categories", Category.objects.filter(site=site).values().iterator())
+        counts["posts"] = add_rows(tar, "posts", Post.objects.filter(site=site).annotate(
+            author_username=F("author__username")).values().iterator(chunk_size=CHUNK))
+        counts["pages"] = add_rows(tar, "pages", Page.objects.filter(site=site).values().iterator(chunk_size=CHUNK))
+        counts["revisions"] = add_rows(tar, "revisions", (
+            {**row, "data": base64.b64encode(row["data"]).decode("ascii")}
+            for model in (Post, Page) for row in Revision.objects.filter(**{f"{model._meta.model_name}__site": site})
+            .values("version", "base", "digest", "data", "created", author_username=F("author__username"),
+                    slug=F(f"{model._meta.model_name}__slug"), lang=F(f"{model._meta.model_name}__lang"),
+                    kind=Value(model._meta.model_name)).iterator(chunk_size=CHUNK)))
+        counts["publishes"] = add_rows(tar, "publishes", Publish.objects.filter(site=site).values().iterator())
+        if site.logo and Path(site.logo.path).is_file():
+            tar.add(site.logo.path, arcname=f"media/{Path(site.logo.path).relative_to(settings.MEDIA_ROOT)}")
+        counts["content"] = add_tree(tar, "content", engine.get_content_path())
+        if output:
+            counts["output"] = add_tree(tar, "output", engine.get_publish_path())
+        else:
+            root = engine.get_publish_path()
+            counts["output"] = add_rows(tar, "output", (
+                {"path": str(path.relative_to(root)), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+                for path in walk(root) for stat in (path.stat(), )))
+    return counts
+
+
+class Restore:
+    """Consumes members of an archive in the order they were written by `export`"""
+
+    def __init__(self, domain: str = None, path: str = None):
+        self.domain = domain
+        self.path = path
+        self.manifest = None
+        self.site = None
+        self.categories = {}  # old id -> new id
+        self.users = {}  # username -> id
+        self.counts = {}
+
+    def rows(self, tar: tarfile.TarFile, member: tarfile.TarInfo):
+        return [json.loads(line) for line in tar.extractfile(member)]
+
+    def user(self, username):
+        if username and username not in self.users:
+            self.users[username] = auth.User.objects.filter(username=username).values_list("id", flat=True).first()
+        return self.users.get(username)
+
+    def member(self, tar: tarfile.TarFile, member: tarfile.TarInfo):
+        directory, _, name = member.name.partition("/")
+        if member.name == "manifest.json":
+            self.manifest = json.load(tar.extractfile(member))
+            if self.manifest.get("version") != VERSION:
+                raise ArchiveError(f"Unsupported archive version {self.manifest.get('version')}")
+            return
+        if self.manifest is None:
+            raise ArchiveError("Archive does not start with a manifest")
+        if member.name == "site.json":
+            return self.restore_site(json.load(tar.extractfile(member)))
+        if member.name == "engine.json":
+            return self.restore_engine(json.load(tar.extractfile(member)))
+        if directory in ("categories", "posts", "pages", "revisions", "publishes"):
+            rows = self.rows(tar, member)
+            getattr(self, f"restore_{directory}")(rows)
+            self.counts[directory] = self.counts.get(directory, 0) + len(rows)
+            return
+        if directory == "output" and not self.manifest["output"]:
+            return  # listing of the output that was not archived
+        if directory == "media" and member.isfile():
+            return self.restore_media(tar, member)
+        if directory in ("content", "output") and member.isfile():
+            engine = self.site.get_engine()
+            root = {
+                "content": engine.get_content_path(),
+                "output": engine.get_publish_path(),
+            }[directory]
+            member.name = name
+            tar.extract(member, path=root, filter="data")
+            self.counts[directory] = self.counts.get(directory, 0) + 1
+
+    def restore_site(self, row: dict):
+        row.pop("id")
+        staff = row.pop("staff")
+        if self.domain:
+            row["domain"] = self.domain
+        if self.path is not None:
+            row["path"] = self.path
+        site = Site(**row)
+        site.domain = site.domain.strip(".")
+        site.path = "/" + site.path.strip("/") if site.path.strip("/") else ""
+        if Site.objects.filter(domain=site.domain, path=site.path).exists():
+            raise ArchiveError(f"Site {site} already exists")
+        Site.objects.bulk_create([site])
+        self.site = Site.objects.get(domain=site.domain, path=site.path)
+        Site.staff.through.objects.bulk_create([
+            Site.staff.through(site_id=self.site.id, user_id=user_id)
+            for user_id in auth.User.objects.filter(username__in=staff).values_list("id", flat=True)
+        ])
+
+    def restore_engine(self, row: dict):
+        model = apps.get_model(self.manifest["engine"])
+        row.pop("id")
+        row["site_id"] = self.site.id
+        for field in model._meta.concrete_fields:
+            if field.is_relation and field.name != "site" and row.get(field.attname) is not None:
+                related = field.related_model.objects
+                if not related.filter(pk=row[field.attname]).exists():
+                    fallback = related.first()
+                    logger.warning(f"{field.related_model.__name__} {row[field.attname]} does not exist, using {fallback}")
+                    row[field.attname] = fallback.pk if fallback else None
+        model.objects.bulk_create([model(**row)])
+
+    def restore_categories(self, rows: list):
+        slugs = {row["slug"]: row["id"] for row in rows}
+        Category.objects.bulk_create([Category(site=self.site, slug=row["slug"], name=row["name"]) for row in rows])
+        for slug, new_id in Category.objects.filter(site=self.site, slug__in=slugs).values_list("slug", "id"):
+            self.categories[slugs[slug]] = new_id
+
+    def restore_posts(self, rows: list):
+        posts = []
+        for row in rows:
+            row.pop("id")
+            row["site_id"] = self.site.id
+            row["author_id"] = self.user(row.pop("author_username"))
+            row["category_id"] = self.categories.get(row["category_id"])
+            posts.append(Post(**row))
+        bulk_create(Post, posts)
+
+    def restore_pages(self, rows: list):
+        for row in rows:
+            row.pop("id")
+            row["site_id"] = self.site.id
+        bulk_create(Page, [Page(**row) for row in rows])
+
+    def restore_revisions(self, rows: list):
+        owners = {}  # (kind, slug, lang) -> id of the restored post or page
+        for model in (Post, Page):
+            kind = model._meta.model_name
+            slugs = {row["slug"] for row in rows if row["kind"] == kind}
+            for id, slug, lang in model.objects.filter(site=self.site, slug__in=slugs).values_list("id", "slug", "lang"):
+                owners[kind, slug, lang] = id
+        revisions = []
+        for row in rows:
+            owner = owners.get((row["kind"], row["slug"], row["lang"]))
+            if owner is None:
+                continue  # should not happen - revisions are exported with their posts and pages
+            revisions.append(Revision(
+                **{f"{row['kind']}_id": owner}, version=row["version"], base=row["base"], digest=row["digest"],
+                data=base64.b64decode(row["data"]), author_id=self.user(row["author_username"]),
+                created=row["created"]))
+        bulk_create(Revision, revisions)
+
+    def restore_media(self, tar: tarfile.TarFile, member: tarfile.TarInfo):
+        """The logo is stored where an upload to the restored site would be, never over files of another site"""
+        target = Path(site_logo_upload(self.site, Path(member.name).name))
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with tar.extractfile(member) as source, target.open("wb") as file:
+            shutil.copyfileobj(source, file)
+        Site.objects.filter(id=self.site.id).update(logo=target.relative_to(settings.MEDIA_ROOT).as_posix())
+        self.counts["media"] = self.counts.get("media", 0) + 1
+
+    def restore_publishes(self, rows: list):
+        for row in rows:
+            row.pop("id")
+            row["site_id"] = self.site.id
+        bulk_create(Publish, [Publish(**row) for row in rows])
+
+
+def restore(fileobj, domain: str = None, path: str = None) -> tuple:
+    """Restore a site from an archive stream, optionally under a different domain/path.
+    Return the new site and counts of restored rows and files"""
+    state = Restore(domain, path)
+    with transaction.atomic():
+        with tarfile.open(fileobj=fileobj, mode="r|*") as tar:
+            for member in tar:
+                state.member(tar, member)
+        if state.site is None:
+            raise ArchiveError("Archive does not contain any site")
+    # let other applications (e.g. caddy) register the site as if it was created
+    post_save.send(sender=Site, instance=state.site, created=True, raw=False,
+                   using=state.site._state.db, update_fields=None)
+    return state.site, state.counts
@@ -0,0 +1,68 @@
+'''
+PostgreSQL backend with an optional client-side connection pool.
+
+    "ENGINE": "velican2.core.backends.postgresql",
+    "OPTIONS": {"pool": {"max_size": 8, "timeout": 10}},
+
+Without `pool` it is the stock Django backend. With it, every thread of the
+process borrows its connection from a psycopg_pool.ConnectionPool per alias
+and database (options are passed to the pool) and `close()` - at the end of
+a request or of a background job - puts it back instead of disconnecting.
+`max_size` is the limit of connections one worker process opens per alias;
+a thread waiting longer than `timeout` for one fails with OperationalError.
+Pooling needs psycopg 3 and psycopg_pool.
+'''
+import threading
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.postgresql import base
+
+try:
+    from psycopg_pool import ConnectionPool
+except ImportError:
+    ConnectionPool = None
+
+_pools = {}
+_lock = threading.Lock()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("pool", None)
+        return params
+
+    def get_pool(self, conn_params: dict):
+        options = self.settings_dict["OPTIONS"].get("pool")
+        if not options:
+            return None
+        if ConnectionPool is None or not base.is_psycopg3:
+            raise ImproperlyConfigured("Connection pooling needs psycopg 3 and psycopg_pool")
+        # test databases are created with the same alias but another name
+        key = (self.alias, conn_params.get("dbname"))
+        with _lock:
+            if key not in _pools:
+                _pools[key] = ConnectionPool(kwargs=conn_params, name=f"velican-{self.alias}", open=True,
+                                             **{"min_size": 1, **options})
+            return _pools[key]
+
+    def get_new_connection(self, conn_params):
+        pool = self.get_pool(conn_params)
+        if pool is None:
+            return super().get_new_connection(conn_params)
+        self._pool = pool
+        isolation_level = self.settings_dict["OPTIONS"].get("isolation_level")
+        self.isolation_level = base.IsolationLevel(isolation_level or base.IsolationLevel.READ_COMMITTED)
+        connection = pool.getconn()
+        if isolation_level is not None:
+            connection.isolation_level = self.isolation_level
+        return connection
+
+    def _close(self):
+        pool = getattr(self, "_pool", None)
+        if pool is None or self.connection is None:
+            return super()._close()
+        with self.wrap_database_errors:
+            # the pool rolls back what the connection left open
+            pool.putconn(self.connection)
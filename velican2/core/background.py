@@ -0,0 +1,60 @@
+'''
+Background jobs of the web process (builds of publishes).
+
+Threads outside of the request cycle never get their database connections
+closed by Django, so every job run here opens connections lazily, drops
+connections that are too old or broken before it starts and closes all
+connections of its thread (default, snapshot, replicas) when it ends - even
+when the thread stays alive in the pool. Jobs run in a process-wide pool of
+VELICAN_PUBLISH_WORKERS threads, so one worker process never holds more than
+that many connections per database alias for jobs, however many publishes
+are queued. With the pooled PostgreSQL backend (velican2.core.backends)
+closing returns the connections to the pool.
+'''
+import functools
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connections
+
+from velican2.core import logger
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.VELICAN_PUBLISH_WORKERS, thread_name_prefix="velican-publish")
+    return _executor
+
+
+def closing(func):
+    """Run `func` with fresh database connections and close them afterwards"""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            connections.close_all()
+
+    return wrapper
+
+
+def logged(func, *args):
+    try:
+        return func(*args)
+    except Exception:
+        # the failure is recorded on the Publish; this is for the process log
+        logger.exception(f"Background job {getattr(func, '__qualname__', func)} failed")
+        raise
+
+
+def submit(func, *args) -> Future:
+    """Queue `func(*args)` into the pool of background workers"""
+    return executor().submit(closing(logged), func, *args)
@@ -0,0 +1,138 @@
+'''
+Publishes built in their own processes under a memory budget.
+
+A build holds the whole content of its site in memory, so building inside
+the web worker could get the worker killed by the OOM killer along with all
+requests it serves. With VELICAN_PUBLISH_MEMORY set the background job
+(`spawn`) only starts `manage.py velican_build <publish>` and waits for it.
+The build process limits its address space to the budget (RLIMIT_AS, also
+split among its render processes - see velican2.pelican.parallel), so an
+overrun is a MemoryError recorded as a failed Publish. A build killed anyway
+is marked as failed by the job.
+
+Every build records its peak RSS (of itself and its render processes) and,
+with VELICAN_PUBLISH_TRACEMALLOC, the top allocating lines at the moment the
+traced memory peaked into `Publish.peak_memory` and `Publish.allocations`.
+'''
+import resource
+import subprocess
+import sys
+import threading
+import tracemalloc
+
+from django.conf import settings
+from django.utils import timezone
+
+from velican2.core import logger
+from velican2.core.models import Publish
+
+MB = 1024 * 1024
+# seconds between samples of the traced memory
+SAMPLE = 0.5
+# growth of the traced memory (over the largest snapshot so far) that takes a new snapshot
+GROWTH = 1.1
+# part of the budget from which allocations are not traced (tracing needs memory of its own)
+TRACED = 0.9
+
+
+def spawn(publish_id: int) -> int:
+    """Build the publish in a new process and wait for it. Return the exit code of the process"""
+    process = subprocess.run(
+        [sys.executable, "-m", "django", "velican_build", str(publish_id), "--memory", str(settings.VELICAN_PUBLISH_MEMORY)],
+        cwd=settings.BASE_DIR)
+    if process.returncode != 0:
+        reason = f"killed by signal {-process.returncode}" if process.returncode < 0 else f"exit code {process.returncode}"
+        # the build records its own failures - unless it could not
+        if Publish.objects.filter(id=publish_id, finished=None).update(
+                success=False, phase="failed", finished=timezone.now(), message=f"Build process failed ({reason})"):
+            logger.error(f"Build of publish {publish_id} failed ({reason})")
+    return process.returncode
+
+
+class Sampler(threading.Thread):
+    """Keeps the top allocating lines of the largest traced memory seen. Stops tracing
+    when the process gets close to its `budget` (MB)"""
+
+    def __init__(self, top: int, budget: int = 0):
+        super().__init__(name="velican-tracemalloc", daemon=True)
+        self.top = top
+        self.budget = budget
+        self.largest = 0
+        self.statistics = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(SAMPLE):
+            self.sample()
+
+    def sample(self):
+        if not tracemalloc.is_tracing():
+            return
+        if self.budget and address_space() > self.budget * MB * TRACED:
+            tracemalloc.stop()
+            return
+        current, _ = tracemalloc.get_traced_memory()
+        if current > self.largest * GROWTH:
+            try:
+                self.statistics = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+                self.largest = current
+            except MemoryError:
+                pass  # the budget is reached - the last snapshot has to do
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+    def report(self) -> str:
+        return "\n".join(f"{stat.size / MB:.1f} MB in {stat.count} blocks: {stat.traceback}" for stat in self.statistics)
+
+
+def address_space() -> int:
+    """Size (bytes) of the address space of this process - what RLIMIT_AS limits"""
+    with open("/proc/self/statm") as file:
+        return int(file.read().split()[0]) * resource.getpagesize()
+
+
+def limit(budget: int):
+    """Limit the address space of this process (and processes it starts) to `budget` MB"""
+    resource.setrlimit(resource.RLIMIT_AS, (budget * MB, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+def peak_rss() -> int:
+    """Largest resident set (bytes) of this process or one of its finished children"""
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+
+def fail(publish: Publish, message: str):
+    Publish.objects.filter(id=publish.id).update(success=False, phase="failed", finished=timezone.now(), message=message)
+    logger.error(f"Build of {publish.site} failed: {message}")
+
+
+def build(publish: Publish, budget: int = 0, top: int = 0):
+    """Run the publish in this process within `budget` MB (0 - unlimited) and record its memory use"""
+    sampler = None
+    if top:
+        tracemalloc.start()
+        sampler = Sampler(top, budget)
+        sampler.sample()
+        sampler.start()
+    try:
+        if budget:
+            used = address_space()
+            if used >= budget * MB:
+                # allocations of a process over its limit may never fail cleanly
+                return fail(publish, f"Memory budget of {budget} MB is below the {used // MB} MB the build starts with")
+            limit(budget)
+        publish.run()
+    except MemoryError:
+        # the engine marked the publish as failed already; the frames of the build are released now
+        fail(publish, f"Build exceeded its memory budget of {budget} MB")
+    finally:
+        fields = {"peak_memory": peak_rss()}
+        if sampler is not None:
+            sampler.stop()
+            tracemalloc.stop()
+            fields["allocations"] = sampler.report()
+        Publish.objects.filter(id=publish.id).update(**fields)
@@ -0,0 +1,131 @@
+'''
+Routing of reads to read replicas and consistent snapshots of builds.
+
+Replicas are the `replica<n>` databases of DATABASES (VELICAN_DB_REPLICAS).
+Writes and ordinary reads always go to `default`; only reads inside
+`replica()` (the read API) or `snapshot()` (build stages, the site export)
+are sent to a random replica. Reads stay on `default` while their result
+could miss a recent write:
+
+ * a site changed in the last VELICAN_REPLICA_LAG seconds is built from the
+   primary (the build started right after a save sees the save),
+ * a client is pinned to the primary for the same time after every unsafe
+   request (`StickyMiddleware`) so editors read their own writes.
+
+`snapshot()` runs all reads of the stages of a build (feeds, sitemap,
+search - see velican2.core.stages) or of a site export in one REPEATABLE
+READ, read only transaction so they never mix content from before and after
+an edit saved meanwhile. Pelican itself renders the content files written by
+every save, not the database, so an edit saved while a site is rendered may
+or may not be in that build's output. Without replicas the snapshot is read
+over the `snapshot` connection to the primary, so the progress written by
+the build (on `default`) is still committed immediately. SQLite databases
+are switched to WAL mode where readers keep their snapshot without
+blocking writers.
+'''
+import contextlib
+import contextvars
+import random
+import time
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.utils import timezone
+
+# alias reads are routed to (None - default)
+reading = contextvars.ContextVar("reading", default=None)
+# the client wrote recently (see StickyMiddleware)
+pinned = contextvars.ContextVar("pinned", default=False)
+
+COOKIE = "velican_written"
+
+
+def replicas() -> list:
+    return [alias for alias in settings.DATABASES if alias.startswith("replica")]
+
+
+def recent(site) -> bool:  # site: core.Site
+    """Content of `site` changed within VELICAN_REPLICA_LAG (replicas may not have it yet)"""
+    from velican2.core.models import Page, Post
+    since = timezone.now() - timedelta(seconds=settings.VELICAN_REPLICA_LAG)
+    return any(model.objects.using("default").filter(site=site, updated__gt=since).exists() for model in (Post, Page))
+
+
+def choose(site=None, fallback: str = "default") -> str:
+    aliases = replicas()
+    if not aliases or pinned.get() or (site is not None and recent(site)):
+        return fallback
+    return random.choice(aliases)
+
+
+@contextlib.contextmanager
+def replica(site=None):
+    """Route reads of the current thread to a replica (when it is safe to)"""
+    token = reading.set(choose(site))
+    try:
+        yield reading.get()
+    finally:
+        reading.reset(token)
+
+
+@contextlib.contextmanager
+def snapshot(site=None):
+    """Route reads of the current thread to one consistent snapshot of a replica or of the primary"""
+    alias = choose(site, fallback="snapshot")
+    token = reading.set(alias)
+    try:
+        with transaction.atomic(using=alias):
+            connection = connections[alias]
+            if connection.vendor == "postgresql":
+                with connection.cursor() as cursor:
+                    cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
+            yield alias
+    finally:
+        reading.reset(token)
+
+
+class Router:
+
+    def db_for_read(self, model, **hints):
+        # never the database of a related instance - it may come from a finished snapshot
+        return reading.get() or "default"
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == "default"
+
+
+class StickyMiddleware:
+    """Pin clients to the primary database for VELICAN_REPLICA_LAG seconds after they wrote"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        written = request.COOKIES.get(COOKIE, "")
+        token = pinned.set(written.isdigit() and time.time() - int(written) < settings.VELICAN_REPLICA_LAG)
+        try:
+            response = self.get_response(request)
+        finally:
+            pinned.reset(token)
+        if request.method not in ("GET", "HEAD", "OPTIONS", "TRACE") and replicas():
+            response.set_cookie(COOKIE, str(int(time.time())), max_age=int(settings.VELICAN_REPLICA_LAG) + 1,
+                                httponly=True, samesite="Lax")
+        return response
+
+
+def on_connection_created(connection, **kwargs):
+    if connection.vendor == "sqlite" and not connection.is_in_memory_db():
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode=WAL")
+
+
+# this module is imported with the router (DATABASE_ROUTERS) before the first connection is opened
+connection_created.connect(on_connection_created)
@@ -0,0 +1,123 @@
+'''
+Deployment moves a rendered site from the output directory of its engine to
+where it is served. Every backend is a module in this package with a `name`;
+`Site.deployment` selects it and `Site.deploy_target` tells it where to.
+
+- `caddy` serves the output directory in place, nothing is transferred.
+- `local` mirrors the output into another directory (e.g. a shared volume).
+- `ssh` mirrors the output to `[user@]host:/path` streaming tar over ssh.
+
+Mirroring backends implement `transfer(target, output, paths)` and
+`delete(target, paths, directories)`. `run` compares a manifest (size, mtime
+and content hash of every file) of the new build with the manifest of the
+last successful deployment to the same target, transfers only changed files
+in VELICAN_DEPLOY_WORKERS parallel batches and deletes removed ones, so the
+time of a deployment depends on the size of the change, not of the site.
+'''
+import hashlib
+import importlib
+import os
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from django.conf import settings
+
+from velican2.core import logger
+from velican2.core.stages import read_json, write_json
+
+# state of stages and deployments inside of the output directory is never deployed
+EXCLUDE = (".velican", )
+
+
+class DeployError(Exception):
+    pass
+
+
+def get(name: str):
+    return importlib.import_module(f"velican2.core.deploy.{name}")
+
+
+def digest(path: Path) -> str:
+    hash = hashlib.sha1()
+    with path.open("rb") as file:
+        while chunk := file.read(1 << 20):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def scan(output: Path, previous: dict) -> dict:
+    """Manifest {relative path: [size, mtime_ns, sha1]} of `output`.
+    Files with the same size and mtime as in `previous` are not hashed again"""
+    manifest = {}
+    for directory, dirnames, filenames in os.walk(output, followlinks=True):
+        if directory == str(output):
+            dirnames[:] = [name for name in dirnames if name not in EXCLUDE]
+        dirnames.sort()
+        for filename in sorted(filenames):
+            path = Path(directory) / filename
+            name = path.relative_to(output).as_posix()
+            if filename.endswith(".tmp"):
+                continue
+            try:
+                stat = path.stat()  # of the target of (static) symlinks
+            except FileNotFoundError:
+                continue  # dangling symlink
+            known = previous.get(name)
+            if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+                manifest[name] = known
+            else:
+                manifest[name] = [stat.st_size, stat.st_mtime_ns, digest(path)]
+    return manifest
+
+
+def diff(previous: dict, current: dict) -> tuple:
+    """Return (changed, removed) paths; a file is changed when its content differs"""
+    changed = [name for name, entry in current.items() if name not in previous or previous[name][2] != entry[2]]
+    removed = [name for name in previous if name not in current]
+    return changed, removed
+
+
+def batches(paths: list, manifest: dict, count: int) -> list:
+    """Split `paths` into at most `count` batches of similar total size"""
+    buckets = [[0, []] for _ in range(max(1, min(count, len(paths))))]
+    for name in sorted(paths, key=lambda name: manifest[name][0], reverse=True):
+        bucket = min(buckets, key=lambda bucket: bucket[0])
+        bucket[0] += manifest[name][0]
+        bucket[1].append(name)
+    return [names for _, names in buckets if names]
+
+
+def emptied(removed: list, current: dict) -> list:
+    """Directories of removed files without any file left, deepest first"""
+    kept = {parent.as_posix() for name in current for parent in Path(name).parents}
+    gone = {parent.as_posix() for name in removed for parent in Path(name).parents} - kept - {"."}
+    return sorted(gone, key=lambda name: name.count("/"), reverse=True)
+
+
+def run(publish, output: Path):  # publish: core.Publish
+    site = publish.site
+    backend = site.get_deploy()
+    if not hasattr(backend, "transfer"):
+        return  # served from the output directory
+    if not site.deploy_target:
+        raise DeployError(f"Site {site} has no deploy target for {backend.name} deployment")
+    publish.progress(phase="deploy")
+    started = time.monotonic()
+    path = output / ".velican" / "deploy.json"
+    state = read_json(path, {})
+    previous = state.get("files", {}) if state.get("target") == [backend.name, site.deploy_target] else {}
+    current = scan(output, previous)
+    changed, removed = diff(previous, current)
+    if changed:
+        with ThreadPoolExecutor(max_workers=settings.VELICAN_DEPLOY_WORKERS) as pool:
+            for future in [pool.submit(backend.transfer, site.deploy_target, output, batch)
+                           for batch in batches(changed, current, settings.VELICAN_DEPLOY_WORKERS)]:
+                future.result()
+    if removed:
+        backend.delete(site.deploy_target, removed, emptied(removed, current))
+    path.parent.mkdir(exist_ok=True)
+    write_json(path, {"target": [backend.name, site.deploy_target], "files": current})
+    size = sum(current[name][0] for name in changed)
+    logger.info(f"Deployed {site} to {site.deploy_target}: {len(changed)} file(s) ({size} B) transferred, "
+                f"{len(removed)} removed, {len(current) - len(changed)} unchanged in {time.monotonic() - started:.1f}s")
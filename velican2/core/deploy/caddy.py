@@ -0,0 +1,5 @@
+'''
+Caddy on the same node serves the output directory of the engine in place
+(see `velican2.caddy`), there is nothing to transfer.
+'''
+name = "caddy"
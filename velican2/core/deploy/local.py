@@ -0,0 +1,32 @@
+'''
+Mirror of the output in another local directory (e.g. a volume shared with
+the serving node). Every file is replaced atomically so the served tree never
+contains a half-written file.
+'''
+import os
+import shutil
+
+from pathlib import Path
+
+name = "local"
+
+
+def transfer(target: str, output: Path, paths: list):
+    root = Path(target)
+    for path in paths:
+        destination = root / path
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        tmp = destination.with_name(f".{destination.name}.tmp")
+        shutil.copy2(output / path, tmp)  # follows (static) symlinks
+        os.replace(tmp, destination)
+
+
+def delete(target: str, paths: list, directories: list):
+    root = Path(target)
+    for path in paths:
+        (root / path).unlink(missing_ok=True)
+    for directory in directories:
+        try:
+            (root / directory).rmdir()
+        except OSError:
+            pass  # contains files that were not deployed by us
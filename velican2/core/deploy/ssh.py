@@ -0,0 +1,66 @@
+'''
+Mirror of the output on a remote node reachable by ssh. The target is
+`[user@]host:/path`. Every batch of changed files is streamed as one tar
+archive into `tar -x` on the remote side (one ssh connection per batch);
+removed files are deleted by a single `xargs rm`. The ssh command (and its
+options) is VELICAN_DEPLOY_SSH so a local stand-in can be used for testing.
+'''
+import shlex
+import subprocess
+import tarfile
+import tempfile
+
+from pathlib import Path
+from django.conf import settings
+
+from velican2.core.deploy import DeployError
+
+name = "ssh"
+
+
+def split(target: str) -> tuple:
+    host, sep, path = target.partition(":")
+    if not sep or not host or not path:
+        raise DeployError(f"Target {target} is not in the form [user@]host:/path")
+    return host, path
+
+
+def remote(target: str, command: str, write):
+    """Run `command` on the host of `target` feeding its stdin by `write(stdin)`"""
+    host, _ = split(target)
+    with tempfile.TemporaryFile() as output:
+        proc = subprocess.Popen(
+            shlex.split(settings.VELICAN_DEPLOY_SSH) + [host, command],
+            stdin=subprocess.PIPE, stdout=output, stderr=subprocess.STDOUT)
+        try:
+            write(proc.stdin)
+        except BrokenPipeError:
+            pass  # the remote command failed, reported below
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        if proc.wait() != 0:
+            output.seek(0)
+            raise DeployError(f"{command} on {host} failed: {output.read().decode(errors='replace').strip()}")
+
+
+def transfer(target: str, output: Path, paths: list):
+    _, path = split(target)
+
+    def write(stdin):
+        with tarfile.open(fileobj=stdin, mode="w|", dereference=True) as tar:
+            for name in paths:
+                tar.add(str(output / name), arcname=name, recursive=False)
+
+    remote(target, f"mkdir -p {shlex.quote(path)} && tar -x -f - -C {shlex.quote(path)}", write)
+
+
+def delete(target: str, paths: list, directories: list):
+    _, path = split(target)
+    remote(target, f"cd {shlex.quote(path)} && xargs -0 rm -f --",
+           lambda stdin: stdin.write("\0".join(paths).encode("utf-8")))
+    if directories:
+        remote(target, f"cd {shlex.quote(path)} && (xargs -0 rmdir -- 2>/dev/null; true)",
+               lambda stdin: stdin.write("\0".join(directories).encode("utf-8")))
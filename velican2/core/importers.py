@@ -0,0 +1,187 @@
+'''
+Streaming readers of existing blogs. Every reader is a generator of `Item`s
+so that importing a blog of any size keeps only one item in memory.
+
+- `pelican` reads a Pelican content directory with markdown files that
+  start with metadata headers (`Title: ...`). Files in a `pages` directory
+  are imported as pages.
+- `wxr` reads a WordPress eXtended RSS export with `iterparse` clearing
+  every processed element.
+'''
+import dataclasses
+import xml.etree.ElementTree as ET
+
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Iterator, Optional
+from django.db import models, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+
+from velican2.core.models import LANG_CHOICES
+
+MARKDOWN_SUFFIXES = (".md", ".markdown", ".mkd")
+
+
+@dataclasses.dataclass
+class Item:
+    kind: str  # "post" or "page"
+    slug: str
+    title: str
+    content: str
+    lang: Optional[str] = None
+    description: str = ""
+    created: Optional[datetime] = None
+    updated: Optional[datetime] = None
+    draft: bool = False
+    category: Optional[tuple] = None  # (slug, name)
+    author: Optional[str] = None  # username
+
+
+def to_lang(value: str, default: str) -> str:
+    """Map `en`, `en_US` or `en-us` into one of LANG_CHOICES"""
+    if not value:
+        return default
+    value = value.replace("-", "_").lower()
+    for code, short in LANG_CHOICES:
+        if value in (code.lower(), short):
+            return code
+    return default
+
+
+def to_datetime(value: str) -> Optional[datetime]:
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        parsed = parse_datetime(value) or datetime.fromisoformat(value)
+    except ValueError:
+        for format in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+            try:
+                parsed = datetime.strptime(value, format)
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def read_pelican_file(path: Path) -> tuple:
+    """Return (metadata, content) of a markdown file with Pelican metadata headers"""
+    metadata = {}
+    with path.open("rt", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                break
+            key, sep, value = line.partition(":")
+            if not sep or " " in key.strip():
+                # not a header - the file has no (more) metadata
+                return metadata, line + file.read()
+            metadata[key.strip().lower()] = value.strip()
+        return metadata, file.read()
+
+
+def pelican(path: Path, lang: str) -> Iterator[Item]:
+    for file in sorted(path.rglob("*")):
+        if file.suffix.lower() not in MARKDOWN_SUFFIXES or not file.is_file():
+            continue
+        metadata, content = read_pelican_file(file)
+        title = metadata.get("title") or file.stem
+        category = metadata.get("category")
+        authors = metadata.get("authors") or metadata.get("author")
+        yield Item(
+            kind="page" if "pages" in file.relative_to(path).parts[:-1] else "post",
+            slug=metadata.get("slug") or slugify(title) or slugify(file.stem),
+            title=title,
+            content=content,
+            lang=to_lang(metadata.get("lang"), lang),
+            description=metadata.get("summary", ""),
+            created=to_datetime(metadata.get("date")),
+            updated=to_datetime(metadata.get("modified") or metadata.get("date")),
+            draft=metadata.get("status", "published").lower() in ("draft", "hidden"),
+            category=(slugify(category), category) if category else None,
+            author=authors.split(",")[0].strip() if authors else None,
+        )
+
+
+def local(tag: str) -> str:
+    return tag.rpartition("}")[2]
+
+
+def wxr(path: Path, lang: str) -> Iterator[Item]:
+    default_lang = lang
+    channel = None
+    for event, element in ET.iterparse(str(path), events=("start", "end")):
+        tag = local(element.tag)
+        if event == "start":
+            if tag == "channel":
+                channel = element
+            continue
+        if tag == "language" and element.text:
+            default_lang = to_lang(element.text, lang)
+        if tag != "item":
+            continue
+        fields, category = {}, None
+        for child in element:
+            name = local(child.tag)
+            if name == "category" and child.get("domain") == "category" and category is None:
+                category = (child.get("nicename") or slugify(child.text or ""), child.text or "")
+            elif name == "encoded":
+                # content:encoded or excerpt:encoded
+                fields["excerpt" if "excerpt" in child.tag else "content"] = child.text or ""
+            else:
+                fields[name] = child.text or ""
+        element.clear()
+        if channel is not None:
+            channel.clear()  # drop references to already processed items
+
+        if fields.get("post_type") not in ("post", "page") or fields.get("status") in ("trash", "auto-draft", "inherit"):
+            continue
+        title = fields.get("title", "")
+        yield Item(
+            kind=fields["post_type"],
+            slug=fields.get("post_name") or slugify(title) or fields.get("post_id", ""),
+            title=title,
+            content=fields.get("content", ""),
+            lang=default_lang,
+            description=fields.get("excerpt", ""),
+            created=to_datetime(fields.get("post_date_gmt")) or to_datetime(fields.get("post_date")),
+            updated=to_datetime(fields.get("post_modified_gmt")) or to_datetime(fields.get("post_modified")),
+            draft=fields.get("status") != "publish",
+            category=category,
+            author=fields.get("creator") or None,
+        )
+
+
+def bulk_create(model, objects: list, **kwargs) -> list:
+    """`model.objects.bulk_create(objects, **kwargs)` keeping the dates of `objects`.
+
+    auto_now(_add) fields are set to now on insert; their values are written
+    back by a bulk_update (which leaves them alone) in the same transaction.
+    Model fields are shared by all threads, so their flags are not touched"""
+    fields = [field.attname for field in model._meta.concrete_fields
+              if isinstance(field, models.DateTimeField) and (field.auto_now or field.auto_now_add)]
+    dates = [[getattr(obj, name) for name in fields] for obj in objects]
+    with transaction.atomic():
+        model.objects.bulk_create(objects, **kwargs)
+        if objects and objects[0].pk is None:
+            # upserts do not return primary keys - rows are found by their unique fields
+            keys = [model._meta.get_field(name).attname for name in kwargs["unique_fields"]]
+            lookup = {f"{key}__in": {getattr(obj, key) for obj in objects} for key in keys}
+            ids = {tuple(row[:-1]): row[-1] for row in model.objects.filter(**lookup).values_list(*keys, "pk")}
+            for obj in objects:
+                obj.pk = ids[tuple(getattr(obj, key) for key in keys)]
+        for obj, values in zip(objects, dates):
+            for name, value in zip(fields, values):
+                setattr(obj, name, value)
+        model.objects.bulk_update(objects, fields)
+    return objects
+
+
+READERS = {
+    "pelican": pelican,
+    "wxr": wxr,
+}
@@ -0,0 +1,12 @@
+from django.core.management.base import CommandError
+
+from velican2.core.models import Site
+
+
+def get_site(domain: str, path: str = "") -> Site:
+    """Find a site the same way it is normalized in `Site.save` or fail the command"""
+    path = "/" + path.strip("/") if path.strip("/") else ""
+    try:
+        return Site.objects.get(domain=domain.strip("."), path=path)
+    except Site.DoesNotExist:
+        raise CommandError(f"Site {domain}{path} does not exist")
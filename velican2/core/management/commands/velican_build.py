@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from velican2.core import builds
+from velican2.core.models import Publish
+
+
+class Command(BaseCommand):
+    help = "Build a queued publish in this process within a memory budget (started by the web process)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("publish", type=int, help="Id of the publish")
+        parser.add_argument("--memory", type=int, help="Memory budget in MB (0 - unlimited)")
+        parser.add_argument("--top", type=int, help="Number of top allocating lines to record (0 - none)")
+
+    def handle(self, publish, memory, top, **options):
+        try:
+            publish = Publish.objects.select_related("site").get(id=publish)
+        except Publish.DoesNotExist:
+            raise CommandError(f"Publish {publish} does not exist")
+        if publish.finished:
+            raise CommandError(f"Publish {publish.id} is finished already")
+        builds.build(publish,
+                     budget=settings.VELICAN_PUBLISH_MEMORY if memory is None else memory,
+                     top=settings.VELICAN_PUBLISH_TRACEMALLOC if top is None else top)
@@ -0,0 +1,37 @@
+import sys
+import time
+
+from pathlib import Path
+from django.core.management.base import BaseCommand
+
+from velican2.core import archive
+from velican2.core.management import get_site
+
+COMPRESSIONS = {".gz": "gz", ".tgz": "gz", ".bz2": "bz2", ".xz": "xz", ".tar": ""}
+
+
+class Command(BaseCommand):
+    help = "Export a site (database rows, media, content and output) into a single tar archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("domain", help="Domain of the exported site")
+        parser.add_argument("--path", default="", help="Path of the site when it is not in the root of the domain")
+        parser.add_argument("-o", "--output", help="Archive file (defaults to <domain>.tar.gz, '-' for stdout)")
+        parser.add_argument("--skip-output", action="store_true",
+                            help="Store only a listing of the generated output (it is regenerated by publish)")
+
+    def handle(self, domain, path, output, skip_output, **options):
+        site = get_site(domain, path)
+        output = output or f"{site.domain}.tar.gz"
+        started = time.monotonic()
+        if output == "-":
+            archive.export(site, sys.stdout.buffer, "gz", output=not skip_output)
+            return
+        compression = COMPRESSIONS.get(Path(output).suffix, "gz")
+        with open(output, "wb") as file:
+            counts = archive.export(site, file, compression, output=not skip_output)
+        elapsed = time.monotonic() - started
+        size = Path(output).stat().st_size
+        self.stdout.write(
+            f"{site} exported into {output} ({size / 2**20:.1f} MiB in {elapsed:.1f}s, {size / 2**20 / max(elapsed, 1e-6):.1f} MiB/s): "
+            + ", ".join(f"{count} {name}" for name, count in counts.items()))
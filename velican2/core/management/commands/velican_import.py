@@ -0,0 +1,165 @@
+import time
+
+from pathlib import Path
+from django.contrib.auth import models as auth
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from velican2.core import importers
+from velican2.core.management import get_site
+from velican2.core.models import Category, Page, Post, Publish, Site
+
+POST_FIELDS = ("title", "content", "description", "created", "updated", "draft", "category", "author")
+PAGE_FIELDS = ("title", "content", "created", "updated")
+
+
+def truncate(model, field: str, value: str) -> str:
+    return (value or "")[:model._meta.get_field(field).max_length]
+
+
+class Importer:
+    """Collects imported items and writes them in batches using bulk_create (no signals are fired).
+    An item with the slug and language of an earlier item of the same batch replaces it - one upsert
+    cannot touch a row twice"""
+
+    def __init__(self, site: Site, batch_size: int, author: auth.User = None):
+        self.site = site
+        self.batch_size = batch_size
+        self.author = author
+        self.categories = dict(Category.objects.filter(site=site).values_list("slug", "id"))
+        self.users = {}
+        self.posts = {}  # (slug, lang) -> Post
+        self.pages = {}  # (slug, lang) -> Page
+        self.count = 0
+
+    def add(self, item: importers.Item):
+        now = timezone.now()
+        created = item.created or item.updated or now
+        if item.kind == "page":
+            page = Page(
+                site=self.site,
+                slug=truncate(Page, "slug", item.slug),
+                title=truncate(Page, "title", item.title),
+                lang=item.lang or self.site.lang,
+                content=item.content,
+                created=created,
+                updated=item.updated or created,
+            )
+            self.pages[page.slug, page.lang] = page
+        else:
+            post = Post(
+                site=self.site,
+                slug=truncate(Post, "slug", item.slug),
+                title=truncate(Post, "title", item.title),
+                lang=item.lang or self.site.lang,
+                content=item.content,
+                description=item.description,
+                created=created,
+                updated=item.updated or created,
+                draft=item.draft,
+                published=None if item.draft else created,  # imported posts are not announced
+            )
+            post._import = item
+            self.posts[post.slug, post.lang] = post
+        if len(self.posts) + len(self.pages) >= self.batch_size:
+            self.flush()
+
+    def resolve(self):
+        """Fill category and author of posts in the batch creating missing categories"""
+        missing = {}
+        usernames = set()
+        for post in self.posts.values():
+            if post._import.category:
+                slug, name = post._import.category
+                slug = truncate(Category, "slug", slug)
+                if slug not in self.categories:
+                    missing[slug] = truncate(Category, "name", name or slug)
+            if post._import.author and post._import.author not in self.users:
+                usernames.add(post._import.author)
+        if missing:
+            Category.objects.bulk_create(
+                [Category(site=self.site, slug=slug, name=name) for slug, name in missing.items()],
+                ignore_conflicts=True)
+            self.categories.update(Category.objects.filter(
+                site=self.site, slug__in=missing).values_list("slug", "id"))
+        if usernames:
+            found = dict(auth.User.objects.filter(username__in=usernames).values_list("username", "id"))
+            for username in usernames:
+                self.users[username] = found.get(username)
+        for post in self.posts.values():
+            item = post._import
+            if item.category:
+                post.category_id = self.categories.get(truncate(Category, "slug", item.category[0]))
+            post.author_id = self.users.get(item.author) or (self.author.id if self.author else None)
+
+    def flush(self):
+        if not self.posts and not self.pages:
+            return
+        with transaction.atomic():
+            self.resolve()
+            if self.posts:
+                importers.bulk_create(
+                    Post, list(self.posts.values()), update_conflicts=True, unique_fields=("site", "slug", "lang"),
+                    update_fields=POST_FIELDS)
+            if self.pages:
+                importers.bulk_create(
+                    Page, list(self.pages.values()), update_conflicts=True, unique_fields=("site", "slug", "lang"),
+                    update_fields=PAGE_FIELDS)
+        self.count += len(self.posts) + len(self.pages)
+        self.posts = {}
+        self.pages = {}
+
+
+class Command(BaseCommand):
+    help = "Import posts and pages from a Pelican content directory or a WordPress (WXR) export into a site"
+
+    def add_arguments(self, parser):
+        parser.add_argument("domain", help="Domain of an existing site")
+        parser.add_argument("source", type=Path, help="Pelican content directory or WXR file")
+        parser.add_argument("--path", default="", help="Path of the site when it is not in the root of the domain")
+        parser.add_argument("--format", choices=importers.READERS.keys(),
+                            help="Format of the source (guessed when omitted)")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--author", help="Username of the author of posts without a known author")
+        parser.add_argument("--no-publish", action="store_true", help="Do not publish the site after the import")
+
+    def handle(self, domain, source, path, format, batch_size, author, no_publish, **options):
+        site = get_site(domain, path)
+        if not source.exists():
+            raise CommandError(f"{source} does not exist")
+        format = format or ("pelican" if source.is_dir() else "wxr")
+        default_author = None
+        if author:
+            default_author = auth.User.objects.filter(username=author).first()
+            if default_author is None:
+                raise CommandError(f"User {author} does not exist")
+
+        importer = Importer(site, batch_size, default_author)
+        started = time.monotonic()
+        reported = 0
+        for item in importers.READERS[format](source, site.lang):
+            importer.add(item)
+            if importer.count > reported:
+                reported = importer.count
+                self.report(importer.count, started)
+        importer.flush()
+        self.report(importer.count, started)
+
+        site.get_engine().export()
+        self.stdout.write(f"Content of {site} exported in {time.monotonic() - started:.1f}s")
+        if no_publish:
+            return
+        publish = site.publish(default_author)
+        self.stdout.write(f"Publish #{publish.id} of {site} queued, waiting for it to finish")
+        while Publish.objects.filter(id=publish.id, finished=None).exists():
+            time.sleep(1)
+        publish.refresh_from_db()
+        if publish.success:
+            self.stdout.write(self.style.SUCCESS(f"{site} published"))
+        else:
+            self.stderr.write(f"Publish of {site} failed: {publish.message}")
+
+    def report(self, count: int, started: float):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{count} items imported in {elapsed:.1f}s ({count / max(elapsed, 1e-6):.0f} items/s)")
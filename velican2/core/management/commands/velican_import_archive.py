@@ -0,0 +1,29 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from velican2.core import archive
+
+
+class Command(BaseCommand):
+    help = "Restore a site from an archive created by velican_export"
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", help="Archive file ('-' for stdin)")
+        parser.add_argument("--domain", help="Restore the site under a different domain")
+        parser.add_argument("--path", help="Restore the site under a different path")
+
+    def handle(self, source, domain, path, **options):
+        started = time.monotonic()
+        try:
+            if source == "-":
+                site, counts = archive.restore(sys.stdin.buffer, domain, path)
+            else:
+                with open(source, "rb") as file:
+                    site, counts = archive.restore(file, domain, path)
+        except (archive.ArchiveError, OSError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"{site} restored in {time.monotonic() - started:.1f}s: "
+            + ", ".join(f"{count} {name}" for name, count in counts.items())))
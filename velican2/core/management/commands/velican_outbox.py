@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from velican2.core.outbox import Worker
+
+
+class Command(BaseCommand):
+    help = "Announce new posts on social networks from the outbox (runs until interrupted)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Send what is due now and exit")
+        parser.add_argument("--workers", type=int, help="Number of sending threads")
+
+    def handle(self, once, workers, **options):
+        worker = Worker(workers)
+        if once:
+            worker.recover()
+            self.stdout.write(f"{worker.drain()} announcement(s) processed")
+            return
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
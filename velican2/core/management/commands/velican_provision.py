@@ -0,0 +1,204 @@
+import csv
+import json
+import re
+import time
+
+import requests
+
+from pathlib import Path
+from django.conf import settings
+from django.contrib.auth import models as auth
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from velican2.core.models import Site
+from velican2.pelican.models import Settings, Theme
+
+FIELDS = ("domain", "path", "title", "subtitle", "lang", "timezone", "deployment", "deploy_target",
+          "secure", "allow_crawlers", "allow_training")
+BOOLEANS = ("secure", "allow_crawlers", "allow_training")
+# attempts to push the routes into caddy (the delay between them doubles from a second)
+CADDY_ATTEMPTS = 5
+# sites loaded by one query when the routes are collected
+CHUNK = 500
+
+
+def read(source: Path, format: str):
+    """Rows (line number, dict) of a CSV file with a header or of a JSON lines file"""
+    with source.open(newline="", encoding="utf-8") as file:
+        if format == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for number, line in enumerate(file, start=1):
+            if line.strip():
+                try:
+                    yield number, json.loads(line)
+                except ValueError as e:
+                    yield number, {"error": str(e)}
+
+
+def boolean(value) -> bool:
+    return value if isinstance(value, bool) else str(value).strip().lower() in ("1", "true", "yes", "y")
+
+
+def usernames(value) -> list:
+    if isinstance(value, list):
+        return [str(name) for name in value]
+    return [name for name in re.split(r"[\s,;]+", value or "") if name]
+
+
+class Provisioner:
+    """Creates sites of a batch with bulk queries (no signals are fired) - their pelican Settings,
+    staff links and directories included. Sites that exist already only get what they miss"""
+
+    def __init__(self, batch_size: int, lang: str, theme: Theme, staff: list):
+        self.batch_size = batch_size
+        self.lang = lang
+        self.theme = theme
+        self.staff = staff
+        self.themes = {theme.name: theme for theme in Theme.objects.all()}
+        self.users = {}
+        self.rows = {}  # (domain, path) -> (site, theme, usernames)
+        self.ids = []
+        self.created = self.existing = self.failed = 0
+        self.missing_users = set()
+
+    @property
+    def count(self) -> int:
+        return self.created + self.existing
+
+    def add(self, row: dict) -> str:
+        """Queue a row for the next batch. Return the reason it is invalid (or None)"""
+        if "error" in row:
+            self.failed += 1
+            return row["error"]
+        values = {field: row[field] for field in FIELDS if row.get(field) not in (None, "")}
+        for field in BOOLEANS:
+            if field in values:
+                values[field] = boolean(values[field])
+        site = Site(**{"lang": self.lang, "title": row.get("domain", ""), **values})
+        theme = self.themes.get(row["theme"]) if row.get("theme") else self.theme
+        try:
+            if theme is None:
+                raise ValidationError({"theme": f"Theme {row['theme']} is not installed"})
+            site.clean_fields(exclude=["logo", *(field for field in ("subtitle", ) if field not in values)])
+            site.clean()
+        except ValidationError as e:
+            self.failed += 1
+            return "; ".join(f"{field}: {' '.join(messages)}" for field, messages in e.message_dict.items())
+        site.normalize()  # as `save` would (bulk_create does not call it)
+        self.rows[site.domain, site.path] = (site, theme, [*self.staff, *usernames(row.get("staff"))])
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+        return None
+
+    def resolve(self, names: set) -> dict:
+        missing = names - self.users.keys()
+        if missing:
+            found = dict(auth.User.objects.filter(username__in=missing).values_list("username", "id"))
+            for name in missing:
+                self.users[name] = found.get(name)
+        self.missing_users.update(name for name in names if self.users[name] is None)
+        return self.users
+
+    def flush(self):
+        if not self.rows:
+            return
+        domains = {domain for domain, _ in self.rows}
+        with transaction.atomic():
+            known = {(domain, path) for domain, path in
+                     Site.objects.filter(domain__in=domains).values_list("domain", "path")}
+            new = [site for key, (site, _, _) in self.rows.items() if key not in known]
+            # conflicts are sites created by a concurrent run meanwhile
+            Site.objects.bulk_create(new, ignore_conflicts=True)
+            sites = {(site.domain, site.path): site for site in
+                     Site.objects.filter(domain__in=domains).select_related("pelican")}
+            engines, links = [], []
+            users = self.resolve({name for _, _, names in self.rows.values() for name in names})
+            for key, (_, theme, names) in self.rows.items():
+                site = sites[key]
+                if site.engine == "pelican" and not hasattr(site, "pelican"):
+                    engines.append(Settings(site=site, theme=theme, post_url_template=Settings.POST_URL_TEMPLATES[0][0]))
+                links.extend(Site.staff.through(site_id=site.id, user_id=users[name]) for name in names if users[name])
+            Settings.objects.bulk_create(engines, ignore_conflicts=True)
+            Site.staff.through.objects.bulk_create(links, ignore_conflicts=True)
+        # directories are created (again) for every site of the batch, so an interrupted run is completed
+        for engine in Settings.objects.filter(site__in=[sites[key] for key in self.rows]).select_related("site", "theme"):
+            for directory in engine.directories():
+                directory.mkdir(exist_ok=True, parents=True)
+        self.ids.extend(sites[key].id for key in self.rows)
+        self.created += len(new)
+        self.existing += len(self.rows) - len(new)
+        self.rows = {}
+
+
+class Command(BaseCommand):
+    help = ("Create many sites at once from a CSV (with a header) or JSON lines file of sites, then push their "
+            "routes into caddy in one update. Sites that exist already are completed, not duplicated, so an "
+            "interrupted run can be simply repeated")
+
+    def add_arguments(self, parser):
+        parser.add_argument("source", type=Path, help=f"File with columns/keys {', '.join(FIELDS)}, theme and staff "
+                                                      "(usernames separated by spaces, commas or semicolons)")
+        parser.add_argument("--format", choices=("csv", "jsonl"), help="Format of the source (by its suffix when omitted)")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--lang", default="en_US", help="Language of sites without one")
+        parser.add_argument("--theme", help="Theme of sites without one (the first installed theme when omitted)")
+        parser.add_argument("--staff", nargs="*", default=[], help="Usernames of staff of every site")
+        parser.add_argument("--no-caddy", action="store_true", help="Do not push routes of the sites into caddy")
+
+    def handle(self, source, format, batch_size, lang, theme, staff, no_caddy, **options):
+        if not source.exists():
+            raise CommandError(f"{source} does not exist")
+        format = format or ("csv" if source.suffix.lower() == ".csv" else "jsonl")
+        Theme.sync_installed()
+        default = Theme.objects.filter(name=theme).first() if theme else Theme.objects.all().first()
+        if default is None:
+            raise CommandError(f"Theme {theme} is not installed" if theme else "No theme is installed")
+
+        provisioner = Provisioner(batch_size, lang, default, staff)
+        started = time.monotonic()
+        reported = 0
+        for number, row in read(source, format):
+            error = provisioner.add(row)
+            if error:
+                self.stderr.write(f"{source}:{number}: {error}")
+            if provisioner.count > reported:
+                reported = provisioner.count
+                self.report(provisioner, started)
+        provisioner.flush()
+        self.report(provisioner, started)
+        if provisioner.missing_users:
+            self.stderr.write(f"Unknown staff users: {', '.join(sorted(provisioner.missing_users))}")
+
+        if settings.CADDY_URL and not no_caddy:
+            self.push(provisioner.ids)
+
+    def push(self, ids: list):
+        from velican2.caddy.apps import reconcile
+        started = time.monotonic()
+        engines = []
+        for start in range(0, len(ids), CHUNK):
+            engines.extend(Settings.objects.filter(site_id__in=ids[start:start + CHUNK], site__deployment="caddy")
+                           .select_related("site", "theme"))
+        for attempt in range(1, CADDY_ATTEMPTS + 1):
+            try:
+                changed = reconcile(engines)
+                break
+            except requests.RequestException as e:
+                # also a 412 when the routes were changed by someone else since they were read
+                if attempt == CADDY_ATTEMPTS:
+                    raise CommandError(f"Cannot push routes into caddy: {e} (run the command again)")
+                self.stderr.write(f"Pushing routes into caddy failed ({e}), retrying")
+                time.sleep(2 ** (attempt - 1))
+        self.stdout.write(f"{changed} route(s) of {len(engines)} site(s) added or updated in caddy "
+                          f"in {time.monotonic() - started:.1f}s")
+
+    def report(self, provisioner: Provisioner, started: float):
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{provisioner.count} sites provisioned ({provisioner.created} created, "
+                          f"{provisioner.existing} existing, {provisioner.failed} invalid) in {elapsed:.1f}s "
+                          f"({provisioner.count / max(elapsed, 1e-6):.0f} sites/s)")
@@ -0,0 +1,22 @@
+import http.server
+
+from django.core.management.base import BaseCommand
+
+from velican2.core.purge import StandIn
+
+
+class Command(BaseCommand):
+    help = "Run a local purge endpoint printing the purges it receives (set VELICAN_PURGE_URL to it)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=8099)
+
+    def handle(self, port, **options):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", port), StandIn)
+        self.stdout.write(f"Purge endpoint listening at http://127.0.0.1:{port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
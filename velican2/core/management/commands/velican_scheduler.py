@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from velican2.core import scheduler
+
+
+class Command(BaseCommand):
+    help = "Publish scheduled posts and pages when they are due (runs until interrupted)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Release what is due now and exit")
+
+    def handle(self, once, **options):
+        if once:
+            wake = scheduler.tick(timezone.now())
+            self.stdout.write(f"Next check at {timezone.localtime(wake)}")
+            return
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            pass
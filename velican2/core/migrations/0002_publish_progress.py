@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publish',
+            name='log',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='publish',
+            name='phase',
+            field=models.CharField(default='queued', help_text='Currently running phase of the publish', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='publish',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='author',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='category',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='core.category'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_publish_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='site',
+            name='deploy_target',
+            field=models.CharField(blank=True, default='', help_text='Directory (local) or [user@]host:/path (ssh) the site is mirrored to', max_length=256),
+        ),
+        migrations.AlterField(
+            model_name='site',
+            name='deployment',
+            field=models.CharField(choices=[('caddy', 'local Caddy server'), ('local', 'local directory'), ('ssh', 'remote server (ssh)')], default='caddy', max_length=12),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_site_deploy_target'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, help_text='Publish automatically at this time (see velican_scheduler)', null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='publish_at',
+            field=models.DateTimeField(blank=True, help_text='Publish automatically at this time (see velican_scheduler)', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(condition=models.Q(('publish_at__isnull', False)), fields=['publish_at'], name='core_page_publish_at'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(condition=models.Q(('publish_at__isnull', False)), fields=['publish_at'], name='core_post_publish_at'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_publish_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Outbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('destination', models.CharField(help_text='Name of the publisher (velican2.core.publishers)', max_length=16)),
+                ('account', models.CharField(help_text='Uid of the social account the post is sent from', max_length=191)),
+                ('key', models.CharField(help_text='Idempotency key sent with every attempt', max_length=40, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=8)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('remote_id', models.CharField(blank=True, default='', max_length=128)),
+                ('message', models.CharField(blank=True, default='', max_length=512)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox', to='core.post')),
+            ],
+            options={
+                'verbose_name': 'Outbox',
+                'verbose_name_plural': 'Outbox',
+                'indexes': [models.Index(fields=['status', 'next_attempt'], name='core_outbox_due')],
+                'unique_together': {('post', 'destination')},
+            },
+        ),
+    ]
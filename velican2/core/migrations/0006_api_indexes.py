@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_outbox'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='page',
+            index=models.Index(fields=['site', 'updated', 'id'], name='core_page_site_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['site', 'updated', 'id'], name='core_post_site_updated'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['site', 'draft', 'created', 'id'], name='core_post_site_draft_created'),
+        ),
+    ]
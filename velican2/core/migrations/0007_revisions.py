@@ -0,0 +1,45 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:41
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0006_api_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Increased by every save - a save of an older version fails'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='version',
+            field=models.PositiveIntegerField(default=0, help_text='Increased by every save - a save of an older version fails'),
+        ),
+        migrations.CreateModel(
+            name='Revision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField()),
+                ('base', models.PositiveIntegerField(help_text='Version of the snapshot the delta chain of this revision starts at')),
+                ('digest', models.CharField(help_text='SHA1 of the stored state', max_length=40)),
+                ('data', models.BinaryField()),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('author', models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('page', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='core.page')),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='core.post')),
+            ],
+            options={
+                'verbose_name': 'Revision',
+                'verbose_name_plural': 'Revisions',
+                'unique_together': {('page', 'version'), ('post', 'version')},
+            },
+        ),
+    ]
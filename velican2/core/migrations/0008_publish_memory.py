@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_revisions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='publish',
+            name='allocations',
+            field=models.TextField(blank=True, default='', help_text='Lines that allocated the most memory when the build peaked'),
+        ),
+        migrations.AddField(
+            model_name='publish',
+            name='peak_memory',
+            field=models.PositiveBigIntegerField(blank=True, help_text='Peak RSS (bytes) of the build process', null=True),
+        ),
+    ]
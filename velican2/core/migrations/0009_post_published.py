@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 17:21
+
+from django.db import migrations, models
+
+
+def backfill(apps, schema_editor):
+    """Public posts were announced already"""
+    Post = apps.get_model("core", "Post")
+    Post.objects.filter(draft=False).update(published=models.F("created"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_publish_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='published',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the post became public for the first time (it is announced then)', null=True),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -1,16 +1,26 @@
 from datetime import datetime, timedelta
 
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib import auth
 from django.contrib.auth import models as auth
 from django.core.exceptions import ValidationError
 from django.core.validators import validate_unicode_slug, RegexValidator
+from django.db.models import F, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
 from django.utils.translation import gettext as _
 
 class UpdateException(Exception):
     pass
 
+
+class OutdatedException(UpdateException):
+    """The edited post or page was saved by someone else meanwhile"""
+
+    def __init__(self, message=_("You are editing an outdated version")):
+        super().__init__(message)
+
 LANG_CHOICES = (
     ("cs_CZ", "cs"),
     ("en_US", "en"),
@@ -38,7 +48,9 @@ class Site(models.Model):
         choices=(("pelican", "Pelican"), ), default="pelican")
 
     deployment = models.CharField(max_length=12, null=False,
-        choices=(("caddy", "local Caddy server"), ), default="caddy")
+        choices=(("caddy", "local Caddy server"), ("local", "local directory"), ("ssh", "remote server (ssh)")), default="caddy")
+    deploy_target = models.CharField(max_length=256, blank=True, default="",
+        help_text="Directory (local) or [user@]host:/path (ssh) the site is mirrored to")
 
     secure = models.BooleanField(default=True, help_text="The site is served via secured connection https")
 
@@ -54,20 +66,38 @@ class Site(models.Model):
             from velican2.pelican.models import Settings
             return Settings.objects.get(site=self)
 
+    def get_deploy(self):
+        from velican2.core import deploy
+        return deploy.get(self.deployment)
+
     def publish(self, user: auth.User, preview=False):
-        return Publish.get_running() or Publish.objects.create(
+        return Publish.get_running(self, preview) or Publish.objects.create(
             site=self,
-            user=user,
+            preview=preview,
         )
 
-    def save(self, **kwargs):
+    def can_publish(self, user: auth.User):
+        return user.is_authenticated and (user.is_superuser or self.staff.contains(user))
+
+    def clean(self):
+        if self.deployment != "caddy" and not self.deploy_target:
+            raise ValidationError({"deploy_target": _("Deployment to %s needs a target") % self.deployment})
+
+    def normalize(self):
+        """Normalize domain and path the way they are stored (also done by `save`)"""
         self.domain = self.domain.strip(".")
         if self.path.strip("/"):
             self.path = "/" + self.path.strip("/")
+
+    def save(self, **kwargs):
+        self.normalize()
         super().save(**kwargs)
 
     def absolutize(self, path):
-        return ("https://" if self.secure else "http://") + self.domain + self.path
+        url = ("https://" if self.secure else "http://") + self.domain + self.path
+        if path.strip("/"):
+            url += "/" + path.lstrip("/")
+        return url
 
 
 class Category(models.Model):
@@ -91,6 +121,11 @@ class Publish(models.Model):
     finished = models.DateTimeField(null=True)
     success =  models.BooleanField(null=True)
     message = models.CharField(max_length=512)
+    phase = models.CharField(max_length=32, default="queued", help_text="Currently running phase of the publish")
+    log = models.TextField(blank=True, default="")
+    updated = models.DateTimeField(auto_now=True)
+    peak_memory = models.PositiveBigIntegerField(null=True, blank=True, help_text="Peak RSS (bytes) of the build process")
+    allocations = models.TextField(blank=True, default="", help_text="Lines that allocated the most memory when the build peaked")
 
     class Meta:
         verbose_name = _("Publish")
@@ -107,17 +142,50 @@ class Publish(models.Model):
         except Publish.DoesNotExist:
             return None
 
+    def progress(self, phase: str = None, line: str = None):
+        """Record progress of the running publish without touching other fields"""
+        fields = {"updated": timezone.now()}
+        if phase:
+            fields["phase"] = self.phase = phase
+        if line:
+            fields["log"] = Concat("log", Value(line + "\n"), output_field=models.TextField())
+            self.log += line + "\n"
+        Publish.objects.filter(id=self.id).update(**fields)
+
     def run(self):
-        self.site.get_engine().render()
-        self.site.get_deploy().deploy()
+        """Render the site and deploy it (see `velican2.core.deploy`), purge changed URLs from
+        the caching proxy (see `velican2.core.purge`) and queue new posts for social networks
+        (see `velican2.core.outbox`)"""
+        self.site.get_engine().publish(self)
+        if not self.preview:
+            from velican2.core import outbox, purge
+            purge.run(self)
+            outbox.enqueue(self)
 
     def save(self, **kwargs):
         if not self.id:  # new record
-            if Publish.get_running(self.site) is not None:
-                raise UpdateException("Publish is already running")
+            # previews are built aside of the production output - they do not wait for publishes
+            if Publish.get_running(self.site, self.preview) is not None:
+                raise UpdateException(_("Preview is already running") if self.preview else _("Publish is already running"))
         super().save(**kwargs)
 
 
+class ContentQuerySet(models.QuerySet):
+
+    def public(self):
+        """Content that is visible on the site (not scheduled into the future)"""
+        return self.exclude(publish_at__gt=timezone.now())
+
+    def scheduled(self):
+        return self.filter(publish_at__isnull=False)
+
+
+class PostQuerySet(ContentQuerySet):
+
+    def public(self):
+        return super().public().filter(draft=False)
+
+
 class Content(models.Model):
     site = models.ForeignKey(Site, on_delete=models.CASCADE)
     slug = models.CharField(max_length=64, validators=(validate_unicode_slug,))
@@ -126,23 +194,54 @@ class Content(models.Model):
     content = models.TextField()
     created = models.DateTimeField(auto_now_add=datetime.utcnow)
     updated = models.DateTimeField(auto_now=datetime.utcnow)
+    publish_at = models.DateTimeField(null=True, blank=True, help_text="Publish automatically at this time (see velican_scheduler)")
+    version = models.PositiveIntegerField(default=0, help_text="Increased by every save - a save of an older version fails")
+
+    objects = ContentQuerySet.as_manager()
+
+    # fields kept in revisions besides content (see velican2.core.revisions)
+    HISTORY = ("title", "slug", "lang", "publish_at")
 
     class Meta:
         abstract = True
 
-    def clean(self):
-        if self.id: # model aready exists
-            prev = Post.objects.get(id=self.id)
-            if prev.updated > self.updated:
-                raise ValidationError("You are editing an outdated version")
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields():
+            # the state the next save overwrites - its revision is stored as a delta against it
+            instance._loaded = {"content": instance.content, **{name: getattr(instance, name) for name in cls.HISTORY}}
+        return instance
+
+    @property
+    def is_scheduled(self):
+        return self.publish_at is not None and self.publish_at > timezone.now()
 
     def can_edit(self, user: auth.User):
-        return self.site.staff.contains(user)
+        return self.site.can_publish(user)
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        if update_fields is not None and "version" not in update_fields:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        # UPDATE .. SET version = version + 1 WHERE id = .. AND version = <the edited version>
+        version = self._meta.get_field("version")
+        values = [value for value in values if value[0] is not version] + [(version, None, F("version") + 1)]
+        if super()._do_update(base_qs.filter(version=self.version), using, pk_val, values, update_fields, forced_update):
+            self.version += 1
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise OutdatedException()
+        return False
 
     def save(self, user=None, **kwargs):
         if user and not self.can_edit(user):
             raise PermissionError("You don't have edit rights on this")
-        super().save(**kwargs)
+        from velican2.core import revisions
+        created = self._state.adding and self.pk is None
+        with transaction.atomic():
+            super().save(**kwargs)
+            if kwargs.get("update_fields") is None or "version" in kwargs["update_fields"]:
+                revisions.record(self, user, created=created)
 
 
 class Page(Content):
@@ -150,6 +249,12 @@ class Page(Content):
         verbose_name = _("Page")
         verbose_name_plural = _("Pages")
         unique_together = (('site', 'slug', 'lang'), )
+        # only scheduled pages are indexed so the scheduler's queries stay cheap
+        indexes = [
+            models.Index(fields=["publish_at"], condition=models.Q(publish_at__isnull=False), name="core_page_publish_at"),
+            # keyset pagination of the API (velican2.core.api)
+            models.Index(fields=["site", "updated", "id"], name="core_page_site_updated"),
+        ]
 
     def get_url(self):
         return self.site.get_engine().get_page_url(self.site, self)
@@ -161,18 +266,82 @@ class Post(Content):
     description = models.TextField()
     punchline = models.TextField(blank=True, help_text="Punchline for social media. Defaults to description.")
     draft = models.BooleanField(default=True)
+    published = models.DateTimeField(null=True, blank=True, editable=False,
+                                     help_text="When the post became public for the first time (it is announced then)")
+
+    objects = PostQuerySet.as_manager()
+
+    HISTORY = Content.HISTORY + ("description", "punchline", "draft", "category_id")
 
     class Meta:
         verbose_name = _("Post")
         verbose_name_plural = _("Posts")
         unique_together = (('site', 'slug', 'lang'), )
+        indexes = [
+            models.Index(fields=["publish_at"], condition=models.Q(publish_at__isnull=False), name="core_post_publish_at"),
+            # keyset pagination of the API (velican2.core.api)
+            models.Index(fields=["site", "updated", "id"], name="core_post_site_updated"),
+            models.Index(fields=["site", "draft", "created", "id"], name="core_post_site_draft_created"),
+        ]
 
     __str__ = lambda self: self.title
 
     def save(self, user=None, **kwargs):
         if user and not self.author:
             self.author = user
+        if self.published is None and not self.draft and not self.is_scheduled:
+            self.published = timezone.now()
+            if kwargs.get("update_fields") is not None:
+                kwargs["update_fields"] = [*kwargs["update_fields"], "published"]
         super().save(user=user, **kwargs)
 
     def get_url(self):
         return self.site.get_engine().get_post_url(self.site, self)
+
+
+class Revision(models.Model):
+    """A version of a post or a page - a compressed snapshot or delta (see velican2.core.revisions)"""
+    post = models.ForeignKey(Post, null=True, blank=True, on_delete=models.CASCADE, related_name="revisions")
+    page = models.ForeignKey(Page, null=True, blank=True, on_delete=models.CASCADE, related_name="revisions")
+    version = models.PositiveIntegerField()
+    base = models.PositiveIntegerField(help_text="Version of the snapshot the delta chain of this revision starts at")
+    digest = models.CharField(max_length=40, help_text="SHA1 of the stored state")
+    data = models.BinaryField()
+    author = models.ForeignKey(auth.User, null=True, blank=True, on_delete=models.SET_NULL, db_index=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Revision")
+        verbose_name_plural = _("Revisions")
+        unique_together = [['post', 'version'], ['page', 'version']]
+
+    __str__ = lambda self: f"{self.post_id or self.page_id} v{self.version}"
+
+
+class Outbox(models.Model):
+    """A post waiting to be (or already) announced on a social network by a publisher"""
+    STATUS_CHOICES = (
+        ("pending", _("Pending")),
+        ("sending", _("Sending")),
+        ("sent", _("Sent")),
+        ("failed", _("Failed")),
+    )
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="outbox")
+    destination = models.CharField(max_length=16, help_text="Name of the publisher (velican2.core.publishers)")
+    account = models.CharField(max_length=191, help_text="Uid of the social account the post is sent from")
+    key = models.CharField(max_length=40, unique=True, help_text="Idempotency key sent with every attempt")
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    remote_id = models.CharField(max_length=128, blank=True, default="")
+    message = models.CharField(max_length=512, blank=True, default="")
+
+    class Meta:
+        verbose_name = _("Outbox")
+        verbose_name_plural = _("Outbox")
+        unique_together = [['post', 'destination']]
+        indexes = [models.Index(fields=["status", "next_attempt"], name="core_outbox_due")]
+
+    __str__ = lambda self: f"{self.destination}: {self.post_id}"
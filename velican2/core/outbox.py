@@ -0,0 +1,199 @@
+'''
+Outbox of posts announced on social networks.
+
+A successful publish only queues `Outbox` rows - one per new post and
+publisher whose provider the author has a social account (and token) of -
+so builds never wait for third-party APIs. The worker (`manage.py
+velican_outbox`) drains due rows with VELICAN_OUTBOX_WORKERS threads sharing
+one pooled HTTP session per publisher. It respects per-account rate limits
+of publishers and Retry-After of the APIs, retries failures with an
+exponential backoff and sends the same idempotency key with every attempt
+of a row so an API can drop duplicates of a retried post.
+'''
+import collections
+import hashlib
+import random
+import requests
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from allauth.socialaccount.models import SocialAccount, SocialToken
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from velican2.core import logger, publishers
+from velican2.core.models import Outbox, Post, Publish
+
+# posts older than this are not announced even when they were never sent
+MAX_AGE = timedelta(days=7)
+# longest delay between two attempts (seconds)
+MAX_BACKOFF = 6 * 3600
+# longest sleep (seconds) of the worker before it looks for newly queued rows
+RECHECK = 60
+BATCH = 100
+
+
+def key(destination: str, account: str, post_id: int) -> str:
+    return hashlib.sha1(f"{destination}:{account}:{post_id}".encode("utf-8")).hexdigest()
+
+
+def enqueue(publish: Publish) -> int:
+    """Queue posts that became public since the previous successful publish of the site.
+    The first publish of a site is the baseline - nothing is queued for it"""
+    previous = (Publish.objects.filter(site=publish.site_id, preview=False, success=True, id__lt=publish.id)
+                .order_by("-id").first())
+    if previous is None:
+        return 0
+    since = max(previous.started, timezone.now() - MAX_AGE)
+    # only posts published for the first time - edits of public posts are not announced again
+    posts = list(Post.objects.public().filter(site=publish.site_id, published__gte=since, author__isnull=False)
+                 .values_list("id", "author_id"))
+    if not posts:
+        return 0
+    modules = [publishers.get(name) for name in settings.VELICAN_PUBLISHERS]
+    accounts = {
+        (user_id, provider): uid for user_id, provider, uid in SocialAccount.objects.filter(
+            user__in={author for _, author in posts},
+            provider__in=[module.provider for module in modules],
+            socialtoken__isnull=False,
+        ).values_list("user_id", "provider", "uid")
+    }
+    entries = [
+        Outbox(post_id=post, destination=module.name, account=accounts[author, module.provider],
+               key=key(module.name, accounts[author, module.provider], post))
+        for post, author in posts for module in modules if (author, module.provider) in accounts
+    ]
+    Outbox.objects.bulk_create(entries, ignore_conflicts=True)
+    if entries:
+        logger.info(f"{len(entries)} announcement(s) of posts of {publish.site} queued")
+    return len(entries)
+
+
+class Limiter:
+    """Sliding window of sends per (destination, account) in this process"""
+
+    def __init__(self):
+        self.sent = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+
+    def acquire(self, name: str, rate: tuple) -> float:
+        """Record a send and return 0 or return seconds to wait when the limit is reached"""
+        count, seconds = rate
+        now = time.monotonic()
+        with self.lock:
+            sent = self.sent[name]
+            while sent and sent[0] <= now - seconds:
+                sent.popleft()
+            if len(sent) >= count:
+                return sent[0] + seconds - now
+            sent.append(now)
+            return 0.0
+
+
+class Worker:
+
+    def __init__(self, workers: int = None):
+        self.workers = workers or settings.VELICAN_OUTBOX_WORKERS
+        self.sessions = {}
+        self.limiter = Limiter()
+        self.lock = threading.Lock()
+
+    def session(self, destination: str) -> requests.Session:
+        """One session (connection pool) per publisher shared by all worker threads"""
+        with self.lock:
+            if destination not in self.sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.sessions[destination] = session
+            return self.sessions[destination]
+
+    def recover(self):
+        """Rows left `sending` by a crashed worker are sent again (with the same key)"""
+        stale = timezone.now() - timedelta(seconds=settings.VELICAN_OUTBOX_TIMEOUT * 3)
+        Outbox.objects.filter(status="sending", updated__lt=stale).update(status="pending")
+
+    def claim(self, now) -> list:
+        claimed = []
+        due = Outbox.objects.filter(status="pending", next_attempt__lte=now).order_by("next_attempt")
+        for entry in due.select_related("post", "post__site")[:BATCH]:
+            # conditional update so concurrent workers never send the same row
+            if Outbox.objects.filter(id=entry.id, status="pending").update(status="sending", updated=now):
+                claimed.append(entry)
+        return claimed
+
+    def deliver(self, entry: Outbox):
+        try:
+            self.send(entry)
+        except Exception:
+            logger.exception(f"Delivery of {entry} failed")
+            Outbox.objects.filter(id=entry.id).update(status="pending", next_attempt=timezone.now() + timedelta(seconds=MAX_BACKOFF))
+        finally:
+            close_old_connections()
+
+    def send(self, entry: Outbox):
+        module = publishers.get(entry.destination)
+        wait = self.limiter.acquire(f"{entry.destination}:{entry.account}", module.rate)
+        if wait:
+            return self.retry(entry, wait, attempt=False, message="Rate limit of the account reached")
+        token = (SocialToken.objects.filter(account__provider=module.provider, account__uid=entry.account)
+                 .values_list("token", flat=True).first())
+        if not token:
+            return self.finish(entry, "failed", message="The account has no token")
+        post = entry.post
+        text = post.punchline or post.description or post.title
+        try:
+            remote_id = module.send(self.session(entry.destination), token, text, post.get_url(), entry.key)
+        except publishers.RateLimited as e:
+            return self.retry(entry, e.retry_after, attempt=False, message=str(e))
+        except publishers.PublishError as e:
+            return self.finish(entry, "failed", attempts=entry.attempts + 1, message=str(e))
+        except (requests.RequestException, ValueError, KeyError) as e:
+            return self.retry(entry, None, attempt=True, message=str(e))
+        self.finish(entry, "sent", attempts=entry.attempts + 1, remote_id=str(remote_id), message="")
+
+    def retry(self, entry: Outbox, delay, attempt: bool, message: str):
+        attempts = entry.attempts + (1 if attempt else 0)
+        if attempts >= settings.VELICAN_OUTBOX_ATTEMPTS:
+            return self.finish(entry, "failed", attempts=attempts, message=message)
+        if delay is None:
+            delay = min(settings.VELICAN_OUTBOX_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF)
+            delay *= random.uniform(0.5, 1.0)  # spread retries of many rows failing at once
+        self.finish(entry, "pending", attempts=attempts, message=message[:512],
+                    next_attempt=timezone.now() + timedelta(seconds=delay))
+
+    def finish(self, entry: Outbox, status: str, **fields):
+        if "message" in fields:
+            fields["message"] = fields["message"][:512]
+        Outbox.objects.filter(id=entry.id).update(status=status, updated=timezone.now(), **fields)
+        logger.debug(f"{entry} {status} {fields.get('message', '')}")
+
+    def drain(self) -> int:
+        """Send everything that is due now. Return the number of processed rows"""
+        count = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while claimed := self.claim(timezone.now()):
+                list(pool.map(self.deliver, claimed))
+                count += len(claimed)
+        return count
+
+    def next_due(self):
+        return (Outbox.objects.filter(status="pending").order_by("next_attempt")
+                .values_list("next_attempt", flat=True).first())
+
+    def run(self, stop: threading.Event = None):
+        stop = stop or threading.Event()
+        self.recover()
+        while not stop.is_set():
+            close_old_connections()
+            self.drain()
+            wake = timezone.now() + timedelta(seconds=RECHECK)
+            upcoming = self.next_due()
+            if upcoming is not None:
+                wake = min(wake, upcoming)
+            stop.wait(max(0.0, (wake - timezone.now()).total_seconds()))
@@ -0,0 +1,127 @@
+'''
+Progress of running publishes.
+
+Builds record their phase and log lines into the `Publish` row (see
+`Publish.progress` and `capture`). Log lines are buffered and appended at
+most once per VELICAN_PROGRESS_POLL - nobody sees them sooner - so a build
+logging thousands of lines does not rewrite its growing log thousands of
+times. Async views watch it through `Watcher` which polls one publish once
+per VELICAN_PROGRESS_POLL for all clients connected to this process and
+loads only the part of the log it has not seen yet, so thousands of
+watching editors cost one small query per second per running publish
+instead of one per client.
+'''
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db.models.functions import Substr
+
+FIELDS = ("id", "phase", "log", "started", "finished", "success", "message", "updated")
+
+
+class PublishLogHandler(logging.Handler):
+    """Appends log records emitted by one thread into the log of a publish (buffered, see `flush`)"""
+
+    def __init__(self, publish, level=logging.INFO):
+        super().__init__(level)
+        self.publish = publish
+        self.thread = threading.get_ident()
+        self.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+        self.lines = []
+        self.flushed = time.monotonic()
+
+    def filter(self, record):
+        return record.thread == self.thread and super().filter(record)
+
+    def emit(self, record):
+        try:
+            self.lines.append(self.format(record))
+            if time.monotonic() - self.flushed >= settings.VELICAN_PROGRESS_POLL:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        """Append the buffered lines by one update"""
+        with self.lock:
+            if self.lines:
+                self.publish.progress(line="\n".join(self.lines))
+                self.lines = []
+            self.flushed = time.monotonic()
+
+
+@contextlib.contextmanager
+def capture(publish):  # publish: core.Publish
+    """Record log lines of the current thread into `publish` while the block runs"""
+    handler = PublishLogHandler(publish)
+    root = logging.getLogger()
+    root.addHandler(handler)
+    try:
+        yield handler
+    finally:
+        root.removeHandler(handler)
+        handler.flush()
+
+
+class Watcher:
+    """Shares polling of a single publish among all subscribers in the same event loop"""
+    watchers = {}
+
+    def __init__(self, publish_id: int):
+        self.publish_id = publish_id
+        self.snapshot = None
+        self.version = 0
+        self.subscribers = 0
+        self.condition = asyncio.Condition()
+        self.task = None
+
+    @classmethod
+    @contextlib.asynccontextmanager
+    async def subscribe(cls, publish_id: int):
+        key = (id(asyncio.get_running_loop()), publish_id)
+        watcher = cls.watchers.get(key)
+        if watcher is None:
+            watcher = cls.watchers[key] = cls(publish_id)
+            watcher.task = asyncio.create_task(watcher.poll())
+        watcher.subscribers += 1
+        try:
+            yield watcher
+        finally:
+            watcher.subscribers -= 1
+            if watcher.subscribers == 0:
+                watcher.task.cancel()
+                cls.watchers.pop(key, None)
+
+    async def poll(self):
+        from velican2.core.models import Publish
+        fields = [field for field in FIELDS if field != "log"]
+        updated, log = None, ""
+        while True:
+            # the log only grows - its new tail is enough
+            row = await Publish.objects.filter(id=self.publish_id).values(
+                *fields, tail=Substr("log", len(log) + 1)).afirst()
+            if row is not None:
+                log += row.pop("tail")
+                row["log"] = log
+            if row is None or row["updated"] != updated:
+                updated = row["updated"] if row else None
+                async with self.condition:
+                    self.snapshot = row
+                    self.version += 1
+                    self.condition.notify_all()
+            if row is None or row["finished"]:
+                return
+            await asyncio.sleep(settings.VELICAN_PROGRESS_POLL)
+
+    async def wait(self, version: int, timeout: float):
+        """Return (version, snapshot) newer than `version` or None after `timeout` seconds"""
+        async with self.condition:
+            try:
+                await asyncio.wait_for(self.condition.wait_for(lambda: self.version > version), timeout)
+            except asyncio.TimeoutError:
+                return None
+            return self.version, self.snapshot
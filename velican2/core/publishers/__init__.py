@@ -0,0 +1,43 @@
+'''
+Publishers announce new posts on social networks. Every publisher is a module
+in this package with a `name`, the allauth `provider` whose tokens it uses, a
+`rate` limit (posts, seconds) per account and a
+`send(session, token, text, link, key)` function that returns the id of the
+created remote post. Posts are not sent from the publish itself but through
+the outbox (see `velican2.core.outbox`). Enabled publishers are configured by
+`settings.VELICAN_PUBLISHERS`.
+'''
+import importlib
+
+import requests
+
+
+class PublishError(Exception):
+    """The destination refused the post; retrying would not help"""
+
+
+class RateLimited(Exception):
+    """The destination asks to retry after `retry_after` seconds"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Rate limited, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def get(name: str):
+    return importlib.import_module(f"velican2.core.publishers.{name}")
+
+
+def check(response: requests.Response) -> dict:
+    """Turn error responses of a destination API into PublishError/RateLimited"""
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After", "60"))
+        except ValueError:
+            retry_after = 60.0
+        raise RateLimited(retry_after)
+    if response.status_code >= 500:
+        response.raise_for_status()  # transient - retried with a backoff
+    if response.status_code >= 400:
+        raise PublishError(f"{response.status_code} {response.text[:400]}")
+    return response.json()
@@ -2,14 +2,26 @@
 Module Facebook handles publishing of posts to pre-defined site on facebook
 or directly to logged user's facebook profile.
 '''
-name = "facebook"
+import requests
+
+from django.conf import settings
 
-def init():
-    pass
+from velican2.core.publishers import check
 
-def config():
-    pass
+name = "facebook"
+provider = "facebook"
+# posts per account and seconds
+rate = (50, 3600)
 
 # permissions:
 # - email
-# - pages_manage_posts
\ No newline at end of file
+# - pages_manage_posts
+
+
+def send(session: requests.Session, token: str, text: str, link: str, key: str) -> str:
+    response = session.post(
+        f"{settings.VELICAN_FACEBOOK_API}/me/feed",
+        data={"message": text, "link": link, "access_token": token},
+        headers={"Idempotency-Key": key},
+        timeout=settings.VELICAN_OUTBOX_TIMEOUT)
+    return check(response)["id"]
@@ -1,9 +1,26 @@
 '''
 Module Twitter tweets about new posts to twitter using owner's twitter account
 '''
+import requests
 
-def init():
-    pass
+from django.conf import settings
 
-def config():
-    pass
\ No newline at end of file
+from velican2.core.publishers import check
+
+name = "twitter"
+provider = "twitter_oauth2"
+# posts per account and seconds
+rate = (50, 900)
+# tweets are limited to 280 characters, links count as 23
+LENGTH = 280 - 24
+
+
+def send(session: requests.Session, token: str, text: str, link: str, key: str) -> str:
+    if len(text) > LENGTH:
+        text = text[:LENGTH - 1] + "…"
+    response = session.post(
+        f"{settings.VELICAN_TWITTER_API}/2/tweets",
+        json={"text": f"{text} {link}"},
+        headers={"Authorization": f"Bearer {token}", "Idempotency-Key": key},
+        timeout=settings.VELICAN_OUTBOX_TIMEOUT)
+    return check(response)["data"]["id"]
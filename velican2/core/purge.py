@@ -0,0 +1,126 @@
+'''
+Purges of changed URLs from a caching proxy (or CDN) in front of the sites.
+
+After every successful publish `run` compares a manifest (size, mtime and
+content hash - see `velican2.core.deploy.scan`) of the output with the
+manifest of the last purged build of the site (`.velican/purge.json`) and
+sends the URLs of changed and removed files - `dir/` besides `dir/index.html`
+- to VELICAN_PURGE_URL:
+
+    POST VELICAN_PURGE_URL
+    Authorization: VELICAN_PURGE_AUTHORIZATION
+    {"site": "example.com", "urls": ["https://example.com/2024/post.html", ...]}
+
+in batches of VELICAN_PURGE_BATCH URLs. A batch answered by a connection
+error, 429 or 5xx is retried VELICAN_PURGE_ATTEMPTS times with exponential
+backoff (or after Retry-After). The manifest is stored only when every batch
+was accepted, so URLs of a failed purge are purged again with the next
+publish. The first publish of a site is the baseline - nothing is purged.
+
+`StandIn` is an endpoint recording the purges it receives for tests and
+local development (`manage.py velican_purge_standin`).
+'''
+import http.server
+import json
+import random
+import requests
+import time
+
+from pathlib import Path
+from django.conf import settings
+
+from velican2.core import logger
+from velican2.core.deploy import diff, scan
+from velican2.core.stages import read_json, write_json
+
+# longest delay (seconds) between two attempts of a batch
+MAX_BACKOFF = 60
+
+
+class PurgeError(Exception):
+    pass
+
+
+def urls(site, paths: list) -> list:  # site: core.Site
+    """URLs the files `paths` (relative to the output) are served at"""
+    found = []
+    for path in sorted(paths):
+        found.append(site.absolutize(path))
+        if path == "index.html" or path.endswith("/index.html"):
+            found.append(site.absolutize(path[:-len("index.html")]).rstrip("/") + "/")
+    return found
+
+
+def send(session: requests.Session, site, batch: list):
+    """POST one batch to the purge endpoint, retrying transient failures"""
+    headers = {"Authorization": settings.VELICAN_PURGE_AUTHORIZATION} if settings.VELICAN_PURGE_AUTHORIZATION else {}
+    for attempt in range(1, settings.VELICAN_PURGE_ATTEMPTS + 1):
+        delay = None
+        try:
+            response = session.post(settings.VELICAN_PURGE_URL, json={"site": site.domain, "urls": batch},
+                                    headers=headers, timeout=settings.VELICAN_PURGE_TIMEOUT)
+        except requests.RequestException as e:
+            error = str(e)
+        else:
+            if response.status_code < 300:
+                return
+            error = f"{response.status_code} {response.text[:200]}"
+            if response.status_code != 429 and response.status_code < 500:
+                raise PurgeError(f"Purge endpoint refused {len(batch)} URL(s): {error}")
+            if response.headers.get("Retry-After", "").isdigit():
+                delay = int(response.headers["Retry-After"])
+        if attempt == settings.VELICAN_PURGE_ATTEMPTS:
+            raise PurgeError(f"Purge of {len(batch)} URL(s) failed {attempt} times: {error}")
+        if delay is None:
+            delay = settings.VELICAN_PURGE_BACKOFF * 2 ** (attempt - 1) * random.uniform(0.5, 1.0)
+        logger.warning(f"Purge of {len(batch)} URL(s) of {site} failed ({error}), retrying in {delay:.1f}s")
+        time.sleep(min(delay, MAX_BACKOFF))
+
+
+def run(publish) -> int:  # publish: core.Publish
+    """Purge URLs of files changed by the publish. Return the number of purged URLs"""
+    if not settings.VELICAN_PURGE_URL:
+        return 0
+    site = publish.site
+    output = Path(site.get_engine().get_publish_path())
+    path = output / ".velican" / "purge.json"
+    state = read_json(path)
+    current = scan(output, state.get("files", {}) if state else {})
+    purged = []
+    if state is not None:
+        changed, removed = diff(state.get("files", {}), current)
+        purged = urls(site, changed + removed)
+        with requests.Session() as session:
+            for start in range(0, len(purged), settings.VELICAN_PURGE_BATCH):
+                try:
+                    send(session, site, purged[start:start + settings.VELICAN_PURGE_BATCH])
+                except PurgeError as e:
+                    logger.error(f"Purge of {site} failed: {e}")
+                    return start
+    path.parent.mkdir(exist_ok=True)
+    write_json(path, {"files": current})
+    logger.info(f"Purged {len(purged)} URL(s) of {site}")
+    return len(purged)
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """Purge endpoint recording received purges in `purges` and answering with queued `statuses`"""
+    protocol_version = "HTTP/1.1"
+    purges = []
+    statuses = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        status = StandIn.statuses.pop(0) if StandIn.statuses else 200
+        if status < 300:
+            StandIn.purges.append(body)
+            logger.info(f"Purge of {len(body['urls'])} URL(s) of {body['site']}")
+        content = json.dumps({"purged": len(body["urls"]) if status < 300 else 0}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,137 @@
+'''
+Revisions of posts and pages.
+
+Every save of a post or page that bumps its `version` stores a `Revision`.
+Revisions are zlib compressed JSON: all small fields in full and the
+`content` either in full (a snapshot) or as a line delta against the
+previous version. A snapshot is stored every VELICAN_REVISION_SNAPSHOT
+versions (and whenever the previous revision does not match what was
+saved over, e.g. after a bulk import), so reading any version applies at
+most that many deltas to one snapshot - all fetched by a single query.
+
+The previous state comes from the instance as it was loaded
+(`Content.from_db`) and the version, base and digest of the last revision
+are kept on the instance once it saved a revision. So a save is the
+conditional UPDATE (or the INSERT) and the INSERT of its revision; only the
+first save of a loaded instance also reads the last revision.
+'''
+import difflib
+import hashlib
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Subquery
+from django.utils.dateparse import parse_datetime
+
+from velican2.core.models import Category, Post, Revision
+
+DATETIMES = ("publish_at", )
+
+
+def state(instance) -> dict:
+    """Tracked fields of `instance` as they are now"""
+    return {"content": instance.content, **{name: getattr(instance, name) for name in instance.HISTORY}}
+
+
+def digest(data: dict) -> str:
+    return hashlib.sha1(json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def delta(old: str, new: str) -> list:
+    """Ops rebuilding `new` from lines of `old`: [start, end] copies old lines, a string is inserted"""
+    old_lines, new_lines = old.splitlines(keepends=True), new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(new_lines[j1:j2]))
+    return ops
+
+
+def patch(old: str, ops: list) -> str:
+    lines = old.splitlines(keepends=True)
+    return "".join(op if isinstance(op, str) else "".join(lines[op[0]:op[1]]) for op in ops)
+
+
+def owner(instance) -> dict:
+    return {"post": instance} if isinstance(instance, Post) else {"page": instance}
+
+
+def store(instance, version: int, data: dict, base: int = None, previous: dict = None, user=None) -> Revision:
+    """Save `data` (a state) as revision `version`; a delta against `previous` (state of version - 1)
+    unless `base` (version of the snapshot of the chain) is None"""
+    fields = {name: value for name, value in data.items() if name != "content"}
+    if base is None:
+        payload, base = {"fields": fields, "content": data["content"]}, version
+    else:
+        payload = {"fields": fields, "delta": delta(previous["content"], data["content"])}
+    return Revision.objects.create(
+        **owner(instance), version=version, base=base, digest=digest(data), author=user,
+        data=zlib.compress(json.dumps(payload, cls=DjangoJSONEncoder).encode("utf-8")))
+
+
+def record(instance, user=None, created=False):
+    """Store the current state of `instance` as the revision of its version (`created` - it was just
+    inserted so it has no revisions yet)"""
+    previous = getattr(instance, "_loaded", None)
+    data = state(instance)
+    last = getattr(instance, "_revision", None)
+    if created:
+        last = None
+    elif last is None or last["version"] != instance.version - 1:
+        last = (Revision.objects.filter(**owner(instance)).order_by("-version")
+                .values("version", "base", "digest").first())
+    if previous is not None and instance.version > 0 and (last is None or last["version"] < instance.version - 1):
+        # history starts here (e.g. an imported post) - the state that was saved over is kept too
+        last = {"version": instance.version - 1, "base": instance.version - 1, "digest": digest(previous)}
+        store(instance, instance.version - 1, previous)
+    chained = (previous is not None and last is not None and last["version"] == instance.version - 1
+               and last["digest"] == digest(previous)
+               and instance.version - last["base"] < settings.VELICAN_REVISION_SNAPSHOT)
+    revision = store(instance, instance.version, data, base=last["base"] if chained else None, previous=previous, user=user)
+    instance._loaded = data
+    instance._revision = {"version": revision.version, "base": revision.base, "digest": revision.digest}
+
+
+def load(instance, version: int) -> dict:
+    """State of `instance` at `version` (Revision.DoesNotExist when it is not kept)"""
+    revisions = Revision.objects.filter(**owner(instance))
+    # the snapshot the version's chain starts at and its deltas (none when the version is not kept)
+    base = revisions.filter(version=version).values("base")
+    content, fields = None, None
+    for data in revisions.filter(version__gte=Subquery(base), version__lte=version).order_by("version").values_list("data", flat=True):
+        payload = json.loads(zlib.decompress(data))
+        content = payload["content"] if "content" in payload else patch(content, payload["delta"])
+        fields = payload["fields"]
+    if fields is None:
+        raise Revision.DoesNotExist(f"Version {version} is not kept")
+    for name in DATETIMES:
+        if fields.get(name):
+            fields[name] = parse_datetime(fields[name])
+    return {"content": content, **fields}
+
+
+def diff(instance, old: int, new: int) -> dict:
+    """Changed fields ({name: [old value, new value]}) and a unified diff of the content between two versions"""
+    before, after = load(instance, old), load(instance, new)
+    return {
+        "fields": {name: [before.get(name), after[name]] for name in after
+                   if name != "content" and before.get(name) != after[name]},
+        "content": "".join(difflib.unified_diff(
+            before["content"].splitlines(keepends=True), after["content"].splitlines(keepends=True),
+            fromfile=f"version {old}", tofile=f"version {new}")),
+    }
+
+
+def restore(instance, version: int, user=None):
+    """Save `instance` with its state at `version` (as a new version)"""
+    data = load(instance, version)
+    if data.get("category_id") and not Category.objects.filter(id=data["category_id"]).exists():
+        data["category_id"] = None
+    for name, value in data.items():
+        setattr(instance, name, value)
+    instance.save(user=user)
+    return instance
@@ -0,0 +1,129 @@
+'''
+Scheduled publishing of posts and pages with `publish_at`.
+
+Scheduled content is kept out of the site (posts are exported as drafts,
+pages are not exported) until it is due. The scheduler (`manage.py
+velican_scheduler`) sleeps until the next due item found by an index that
+contains only scheduled rows; it never iterates over sites. Items are
+released in windows of VELICAN_SCHEDULE_WINDOW seconds: everything that came
+due for a site in the same window is published by a single build.
+
+All state is in the database so the scheduler survives restarts - overdue
+items are released right after the start. Releasing a site is idempotent
+and `publish_at` is cleared only after the build was queued, so a crash in
+between causes at most one extra build.
+
+A release is an edit like any other: it bumps the `version` of the items (so
+an editor saving a copy loaded before fails with OutdatedException) and
+records their revisions (see `velican2.core.revisions`). Posts put back into
+draft after they were scheduled are not released.
+'''
+import itertools
+import math
+import threading
+
+from datetime import datetime, timedelta, timezone as tz
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from velican2.core import logger, revisions
+from velican2.core.models import Page, Post, Publish, Site, UpdateException
+
+CHUNK = 1000
+
+
+def align(moment: datetime, window: float) -> datetime:
+    """End of the window `moment` falls into"""
+    timestamp = math.ceil(moment.timestamp() / window) * window
+    return datetime.fromtimestamp(timestamp, tz=tz.utc)
+
+
+def pending(model):
+    """Scheduled items of `model` that are released when due (not drafts)"""
+    items = model.objects.scheduled()
+    return items.filter(draft=False) if model is Post else items
+
+
+def next_due(now: datetime):
+    """The earliest `publish_at` in the future (one index lookup per model)"""
+    moments = [pending(model).filter(publish_at__gt=now).order_by("publish_at")
+               .values_list("publish_at", flat=True).first() for model in (Post, Page)]
+    moments = [moment for moment in moments if moment is not None]
+    return min(moments) if moments else None
+
+
+def due_sites(now: datetime) -> set:
+    return set(itertools.chain.from_iterable(
+        pending(model).filter(publish_at__lte=now).values_list("site_id", flat=True).distinct()
+        for model in (Post, Page)))
+
+
+def chunks(queryset):
+    ids = list(queryset.values_list("id", flat=True))
+    for start in range(0, len(ids), CHUNK):
+        yield ids[start:start + CHUNK]
+
+
+def release(site: Site, now: datetime):
+    """Make content of `site` due by `now` public and publish the site. Return the Publish or None
+    when the site is being published right now (its items are released in the next window)"""
+    if Publish.get_running(site) is not None:
+        return None
+    counts = {}
+    for model in (Post, Page):
+        due = pending(model).filter(site=site, publish_at__lte=now)
+        counts[model] = 0
+        for ids in chunks(due):
+            fields = {"updated": now, "version": F("version") + 1}
+            if model is Post:
+                fields["published"] = Coalesce("published", Value(now))
+            with transaction.atomic():
+                # an item put back into draft meanwhile stays as it is
+                released = list(pending(model).filter(id__in=ids).values_list("id", flat=True))
+                model.objects.filter(id__in=released).update(**fields)
+                for item in model.objects.filter(id__in=released).select_related("site"):
+                    revisions.record(item)
+                    # let the engine write the content as published (like a regular save would)
+                    post_save.send(sender=model, instance=item, created=False, raw=False,
+                                   using=item._state.db, update_fields=list(fields))
+            counts[model] += len(released)
+    try:
+        publish = site.publish(None)
+    except UpdateException:
+        return None
+    for model in (Post, Page):
+        pending(model).filter(site=site, publish_at__lte=now).update(publish_at=None)
+    logger.info(f"Released {counts[Post]} post(s) and {counts[Page]} page(s) of {site} in publish #{publish.id}")
+    return publish
+
+
+def tick(now: datetime) -> datetime:
+    """Release everything due by `now`. Return when the scheduler should wake up next"""
+    window = settings.VELICAN_SCHEDULE_WINDOW
+    wake = now + timedelta(seconds=settings.VELICAN_SCHEDULE_RECHECK)
+    for site in Site.objects.filter(id__in=due_sites(now)):
+        try:
+            publish = release(site, now)
+        except Exception:
+            logger.exception(f"Scheduled publish of {site} failed")
+            publish = None
+        if publish is None:
+            wake = min(wake, now + timedelta(seconds=window))  # retry in the next window
+    upcoming = next_due(now)
+    if upcoming is not None:
+        wake = min(wake, align(upcoming, window))
+    return wake
+
+
+def run(stop: threading.Event = None):
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        close_old_connections()  # the process lives much longer than CONN_MAX_AGE
+        now = timezone.now()
+        wake = tick(now)
+        logger.debug(f"Scheduler sleeps until {wake}")
+        stop.wait(max(0.0, (wake - timezone.now()).total_seconds()))
@@ -0,0 +1,62 @@
+'''
+Publish stages run after the engine rendered the site into its output
+directory. Every stage is a module in this package with a `name` and a
+`run(publish, output)` function. Enabled stages (and their order) are
+configured by `settings.VELICAN_PUBLISH_STAGES`.
+'''
+import importlib
+import json
+
+from pathlib import Path
+from django.conf import settings
+
+from velican2.core import logger
+
+
+def get(name: str):
+    return importlib.import_module(f"velican2.core.stages.{name}")
+
+
+def enabled(name: str) -> bool:
+    return name in settings.VELICAN_PUBLISH_STAGES
+
+
+def run(publish, output: Path):  # publish: core.Publish
+    for name in settings.VELICAN_PUBLISH_STAGES:
+        logger.debug(f"Running publish stage {name} for {publish.site}")
+        publish.progress(phase=name)
+        get(name).run(publish, output)
+
+
+def write_json(path: Path, data):
+    """Atomically replace `path` so clients never download a half-written file"""
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wt", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, separators=(",", ":"))
+    tmp.replace(path)
+
+
+def write_json_if_changed(path: Path, data) -> bool:
+    """`write_json` unless `path` already contains `data`"""
+    return write_if_changed(path, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+
+
+def read_json(path: Path, default=None):
+    try:
+        with path.open("rt", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def write_if_changed(path: Path, content: str) -> bool:
+    """Write text `content` into `path` unless it already contains it"""
+    try:
+        if path.read_text(encoding="utf-8") == content:
+            return False
+    except FileNotFoundError:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(content, encoding="utf-8")
+    tmp.replace(path)
+    return True
@@ -0,0 +1,71 @@
+'''
+Stage feeds writes Atom and RSS feeds of the newest `VELICAN_FEED_SIZE`
+published posts. Feeds are regenerated only when the set of the newest posts
+(or any of their `updated` times) changed since the previous build.
+'''
+import hashlib
+
+from pathlib import Path
+from django.conf import settings
+from feedgenerator import Atom1Feed, Rss201rev2Feed
+
+from velican2.core import logger
+from velican2.core.stages import read_json, write_json
+
+name = "feeds"
+
+ATOM_PATH = "feeds/all.atom.xml"
+RSS_PATH = "feeds/all.rss.xml"
+
+
+def fingerprint(site, posts) -> str:
+    digest = hashlib.sha1(f"{site.title}|{site.subtitle}|{site.lang}|{site.absolutize('/')}".encode("utf-8"))
+    for post_id, updated in posts.values_list("id", "updated"):
+        digest.update(f"|{post_id}:{updated.isoformat()}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def write(feed, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("wt", encoding="utf-8") as file:
+        feed.write(file, "utf-8")
+    tmp.replace(path)
+
+
+def run(publish, output: Path):  # publish: core.Publish
+    from velican2.core.models import Post
+    site = publish.site
+    engine = site.get_engine()
+    posts = Post.objects.public().filter(site=site).order_by("-created")[:settings.VELICAN_FEED_SIZE]
+
+    state_path = output / ".velican" / "feeds.json"
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    current = fingerprint(site, posts)
+    if read_json(state_path, {}).get("fingerprint") == current and (output / ATOM_PATH).exists():
+        logger.debug(f"Feeds of {site} are up to date")
+        return
+
+    items = list(posts.select_related("category", "author"))
+    for feed_class, path in ((Atom1Feed, ATOM_PATH), (Rss201rev2Feed, RSS_PATH)):
+        feed = feed_class(
+            title=site.title or site.domain,
+            link=site.absolutize("/"),
+            feed_url=site.absolutize(path),
+            description=site.subtitle or "",
+            language=site.lang[:2],
+        )
+        for post in items:
+            feed.add_item(
+                title=post.title,
+                link=engine.get_post_url(site, post),
+                unique_id=engine.get_post_url(site, post),
+                description=post.description,
+                author_name=str(post.author) if post.author else None,
+                categories=[post.category.name] if post.category else None,
+                pubdate=post.created,
+                updateddate=post.updated,
+            )
+        write(feed, output / path)
+    write_json(state_path, {"fingerprint": current})
+    logger.info(f"Feeds of {site} regenerated")
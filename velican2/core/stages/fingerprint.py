@@ -0,0 +1,215 @@
+'''
+Stage fingerprint serves theme and static assets under content-hashed names
+so they can be cached forever (see `velican2.caddy.apps.get_route`).
+
+Every asset (stylesheets, scripts, images and fonts) of the output gets a
+copy `<name>.<hash>.<suffix>` and references to it in `src`/`href`/`srcset`
+attributes of HTML and in `url()`s and `@import`s of stylesheets are
+rewritten to the copy - absolute, root-relative and relative URLs alike.
+Stylesheets are fingerprinted after their own references were rewritten so
+a changed font or image changes the name of the stylesheet too. The
+original files stay in place for references from outside of the site.
+Copies are never hard links - pelican updates theme files in place.
+References to copies of an earlier build are rewritten to the current ones.
+
+Hashes are kept in `.velican/fingerprint.json` with the size and mtime of
+the asset, so unchanged assets are not read again. The size and mtime of
+every document are kept too - while no copy changed, only documents written
+since the last run (by pelican) are read and rewritten. Copies of the previous
+build are kept (cached HTML may still reference them), older ones are
+removed.
+'''
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from velican2.core import logger
+from velican2.core.deploy import EXCLUDE, digest
+from velican2.core.stages import read_json, write_json
+
+name = "fingerprint"
+
+VERSION = 1
+HASH_LENGTH = 10
+ASSETS = frozenset((".css", ".js", ".png", ".jpg", ".jpeg", ".gif", ".svg", ".webp", ".avif", ".ico",
+                    ".woff", ".woff2", ".ttf", ".otf", ".eot"))
+# names of fingerprinted copies (also matched by the caddy route of the site, so only suffixes of
+# assets - a page or feed named like a copy must not be cached forever)
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{%d}\.(?i:%s)$" % (
+    HASH_LENGTH, "|".join(sorted(suffix[1:] for suffix in ASSETS))))
+HTML_REFERENCE = re.compile(r"""(\b(?:src|href)\s*=\s*)(["'])([^"'<>]+)\2""", re.IGNORECASE)
+HTML_SRCSET = re.compile(r"""(\bsrcset\s*=\s*)(["'])([^"'<>]+)\2""", re.IGNORECASE)
+# candidates of a srcset are "<url> [descriptor]" separated by commas
+SRCSET_CANDIDATE = re.compile(r"(^|,)(\s*)([^\s,]+)")
+# both have the groups (prefix, quote, url, suffix)
+CSS_REFERENCE = re.compile(r"""(url\(\s*)(["']?)([^"')]+)\2(\s*\))""", re.IGNORECASE)
+CSS_IMPORT = re.compile(r"""(@import\s+)(["'])([^"']+)\2()""", re.IGNORECASE)
+CSS_REFERENCES = (CSS_REFERENCE, CSS_IMPORT)
+
+
+def fingerprinted(path: str, hash: str) -> str:
+    stem, suffix = posixpath.splitext(path)
+    return f"{stem}.{hash[:HASH_LENGTH]}{suffix}"
+
+
+class Rewriter:
+    """Replaces references to assets in documents of the output"""
+
+    def __init__(self, site, assets: dict):
+        self.assets = assets  # relative path of an asset -> relative path of its copy
+        self.origin = site.absolutize("/").rstrip("/") + "/"
+        self.prefix = site.path.rstrip("/") + "/"
+
+    def resolve(self, url: str, document: str):
+        """Path of the asset `url` references from the `document` (both relative to the output)"""
+        parts = urlsplit(url)
+        if url.startswith(self.origin):
+            path = url[len(self.origin):]
+        elif parts.scheme or parts.netloc or url.startswith(("#", "data:")):
+            return None
+        elif parts.path.startswith("/"):
+            if not parts.path.startswith(self.prefix):
+                return None
+            path = parts.path[len(self.prefix):]
+        else:
+            path = posixpath.join(posixpath.dirname(document), parts.path)
+        return posixpath.normpath(urlsplit(path).path)
+
+    def replace(self, url: str, document: str) -> str:
+        path = self.resolve(url, document)
+        copy = self.assets.get(path) if path else None
+        if copy is None:
+            return url
+        parts = urlsplit(url)
+        # only the name changes so the URL keeps its form (absolute, relative, query)
+        stem = parts.path.rsplit("/", 1)
+        stem[-1] = posixpath.basename(copy)
+        return parts._replace(path="/".join(stem)).geturl()
+
+    def srcset(self, value: str, document: str) -> str:
+        return SRCSET_CANDIDATE.sub(lambda m: m.group(1) + m.group(2) + self.replace(m.group(3), document), value)
+
+    def html(self, text: str, document: str) -> str:
+        text = HTML_REFERENCE.sub(
+            lambda m: m.group(1) + m.group(2) + self.replace(m.group(3), document) + m.group(2), text)
+        return HTML_SRCSET.sub(
+            lambda m: m.group(1) + m.group(2) + self.srcset(m.group(3), document) + m.group(2), text)
+
+    def css(self, text: str, document: str) -> str:
+        for pattern in CSS_REFERENCES:
+            text = pattern.sub(
+                lambda m: m.group(1) + m.group(2) + self.replace(m.group(3), document) + m.group(2) + m.group(4), text)
+        return text
+
+
+def scan(output: Path):
+    """Relative paths of assets and of HTML documents of the output (copies excluded)"""
+    assets, documents = [], []
+    for directory, dirnames, filenames in os.walk(output, followlinks=True):
+        if directory == str(output):
+            dirnames[:] = [name for name in dirnames if name not in EXCLUDE]
+        for filename in filenames:
+            path = (Path(directory) / filename).relative_to(output).as_posix()
+            suffix = posixpath.splitext(filename)[1].lower()
+            if suffix == ".html":
+                documents.append(path)
+            elif suffix in ASSETS and not FINGERPRINTED.search(filename):
+                assets.append(path)
+    return assets, documents
+
+
+def place(copy: Path, source: Path = None, data: bytes = None):
+    """Create the fingerprinted `copy` of `source` (or with `data`) unless it exists"""
+    if copy.exists():
+        return
+    tmp = copy.with_name(copy.name + ".tmp")
+    if source is not None:
+        shutil.copyfile(source, tmp)
+    else:
+        tmp.write_bytes(data)
+    tmp.replace(copy)
+
+
+def run(publish, output: Path):  # publish: core.Publish
+    state_path = output / ".velican" / "fingerprint.json"
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    state = read_json(state_path, {})
+    known = state.get("assets", {}) if state.get("version") == VERSION else {}
+    assets, documents = scan(output)
+
+    copies, current, hashed = {}, {}, 0
+    stylesheets = []
+    for path in assets:
+        if path.endswith(".css"):
+            stylesheets.append(path)
+            continue
+        stat = (output / path).stat()
+        size, mtime, hash = known.get(path, (None, None, None))
+        if (size, mtime) != (stat.st_size, stat.st_mtime_ns):
+            size, mtime, hash = stat.st_size, stat.st_mtime_ns, digest(output / path)
+            hashed += 1
+        current[path] = [size, mtime, hash]
+        copies[path] = fingerprinted(path, hash)
+        place(output / copies[path], source=output / path)
+
+    # stylesheets reference other assets (and stylesheets) - they are fingerprinted as rewritten
+    rewriter = Rewriter(publish.site, copies)
+    pending = set(stylesheets)
+
+    def stylesheet(path: str):
+        pending.discard(path)
+        text = (output / path).read_text(encoding="utf-8", errors="surrogateescape")
+        for pattern in CSS_REFERENCES:
+            for match in pattern.finditer(text):
+                imported = rewriter.resolve(match.group(3), path)
+                if imported in pending:
+                    stylesheet(imported)
+        data = rewriter.css(text, path).encode("utf-8", errors="surrogateescape")
+        copies[path] = fingerprinted(path, hashlib.sha1(data).hexdigest())
+        place(output / copies[path], data=data)
+
+    while pending:
+        stylesheet(min(pending))
+
+    # documents rewritten by the last run keep their references unless a copy changed since
+    unchanged = state.get("version") == VERSION and state.get("copies") == sorted(set(copies.values()))
+    # documents not written since an earlier run reference the copies of then
+    outdated = {}
+    for copy in state.get("copies", []):
+        original = FINGERPRINTED.sub(lambda m: m.group(0)[HASH_LENGTH + 1:], copy)
+        if copies.get(original, copy) != copy:
+            outdated[copy] = copies[original]
+    rewriter.assets = {**outdated, **copies}
+    previous = state.get("documents", {}) if unchanged else {}
+    rewritten, read, seen = 0, 0, {}
+    for path in documents:
+        file = output / path
+        stat = file.stat()
+        if previous.get(path) == [stat.st_size, stat.st_mtime_ns]:
+            seen[path] = previous[path]
+            continue
+        read += 1
+        text = file.read_text(encoding="utf-8", errors="surrogateescape")
+        changed = rewriter.html(text, path)
+        if changed != text:
+            tmp = file.with_name(file.name + ".tmp")
+            tmp.write_text(changed, encoding="utf-8", errors="surrogateescape")
+            tmp.replace(file)
+            stat = file.stat()
+            rewritten += 1
+        seen[path] = [stat.st_size, stat.st_mtime_ns]
+
+    # copies of the previous build stay for pages cached before this one
+    kept = set(copies.values()) | set(state.get("copies", []))
+    for copy in state.get("previous", []):
+        if copy not in kept:
+            (output / copy).unlink(missing_ok=True)
+    write_json(state_path, {"version": VERSION, "assets": current, "copies": sorted(set(copies.values())),
+                            "previous": sorted(set(state.get("copies", []))), "documents": seen})
+    logger.info(f"Fingerprint of {publish.site}: {len(copies)} assets ({hashed} hashed), "
+                f"{read} of {len(documents)} documents read, {rewritten} rewritten")
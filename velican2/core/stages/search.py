@@ -0,0 +1,255 @@
+'''
+Stage search builds a client-side inverted index over the published posts of
+a site so that static sites can offer full-text search without any server.
+
+Layout of `<output>/search/`:
+
+    index.json          manifest (tokenizer settings, list of shards)
+    shards/<hex>.json   {term: [[post_id, score], ...]} for terms sharing a prefix,
+                        file name is the hex-encoded utf-8 of the prefix
+    docs/<n>.json       {post_id: [title, url, description]} for ids n*DOCS_CHUNK...
+    search.js           hook for themes exposing `window.velicanSearch(query)`
+
+Bookkeeping for incremental builds is kept in `<output>/.velican/search.json`
+(not deployed).
+
+The index is updated incrementally - only posts whose `updated` is newer than
+the last build (and posts that were removed or hidden as drafts) are
+processed and only shards and docs chunks they touch are rewritten (a build
+without changes writes nothing). Postings
+are spilled into temporary per-prefix files so the memory stays bounded
+regardless of the size of the site.
+'''
+import filecmp
+import re
+import shutil
+import tempfile
+import unicodedata
+
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.utils import timezone
+
+from velican2.core import logger
+from velican2.core.stages import read_json, write_json, write_json_if_changed
+
+name = "search"
+
+VERSION = 1
+DOCS_CHUNK = 1000
+SPILL_LIMIT = 200_000  # number of postings kept in memory before spilling to disk
+DESCRIPTION_LENGTH = 200
+
+TAG_RE = re.compile(r"<[^>]+>")
+MD_IMAGE_RE = re.compile(r"!\[[^\]]*\]\([^)]*\)")
+MD_LINK_RE = re.compile(r"\[([^\]]*)\]\([^)]*\)")
+WORD_RE = re.compile(r"\w+")
+
+
+def fold(word: str) -> str:
+    """Lowercase the word and strip diacritics (the same is done by search.js)"""
+    return "".join(c for c in unicodedata.normalize("NFKD", word.casefold())
+                   if not unicodedata.combining(c))
+
+
+STOPWORDS = {
+    "en": frozenset(fold(w) for w in (
+        "a an and are as at be but by for from has have he her his i in is it its "
+        "of on or she that the their them they this to was were will with you your").split()),
+    "cs": frozenset(fold(w) for w in (
+        "a aby ale ani az by byl byla bylo co do i jak jako je jeho jej jen jsem "
+        "jsou k kde ktera ktere ktery mezi na nebo o od po pod pro s se si ta tak "
+        "te ten to u v ve z za ze že již jsme být").split()),
+}
+
+
+def strip(text: str) -> str:
+    """Remove markup from markdown/HTML content leaving only the text"""
+    text = MD_IMAGE_RE.sub(" ", text)
+    text = MD_LINK_RE.sub(r"\1", text)
+    return TAG_RE.sub(" ", text)
+
+
+def tokenize(text: str, lang: str):
+    stopwords = STOPWORDS.get(lang[:2], frozenset())
+    for word in WORD_RE.findall(text):
+        word = fold(word)
+        if len(word) < 2 or word in stopwords:
+            continue
+        yield word
+
+
+def score(post, lang: str) -> Counter:  # post: core.Post
+    scores = Counter()
+    for weight, text in ((3, post.title), (2, post.description), (1, strip(post.content))):
+        for term in tokenize(text or "", lang):
+            scores[term] += weight
+    return scores
+
+
+def shard_name(prefix: str) -> str:
+    return prefix.encode("utf-8").hex()
+
+
+class Postings:
+    """Postings grouped by shard prefix that are spilled to disk when they grow over SPILL_LIMIT"""
+
+    def __init__(self, directory: Path, prefix: int):
+        self.directory = directory
+        self.prefix = prefix
+        self.buffer = defaultdict(list)
+        self.size = 0
+
+    def add(self, doc_id: int, scores: Counter):
+        for term, value in scores.items():
+            self.buffer[term[:self.prefix]].append(f"{term}\t{doc_id}\t{value}\n")
+        self.size += len(scores)
+        if self.size > SPILL_LIMIT:
+            self.flush()
+
+    def flush(self):
+        for prefix, lines in self.buffer.items():
+            with (self.directory / shard_name(prefix)).open("at", encoding="utf-8") as file:
+                file.writelines(lines)
+        self.buffer.clear()
+        self.size = 0
+
+    def read(self, prefix: str):
+        path = self.directory / shard_name(prefix)
+        if not path.exists():
+            return
+        with path.open("rt", encoding="utf-8") as file:
+            for line in file:
+                term, doc_id, value = line.rstrip("\n").split("\t")
+                yield term, int(doc_id), int(value)
+
+
+class Docs:
+    """Writer of docs chunks. Expects ids in ascending order so only one chunk is held in memory"""
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.chunk = None
+        self.docs = None
+
+    def set(self, doc_id: int, doc):
+        chunk = doc_id // DOCS_CHUNK
+        if chunk != self.chunk:
+            self.flush()
+            self.chunk = chunk
+            self.docs = read_json(self.directory / f"{chunk}.json", {})
+        if doc is None:
+            self.docs.pop(str(doc_id), None)
+        else:
+            self.docs[str(doc_id)] = doc
+
+    def flush(self):
+        if self.chunk is None:
+            return
+        path = self.directory / f"{self.chunk}.json"
+        if self.docs:
+            write_json(path, self.docs)
+        else:
+            path.unlink(missing_ok=True)
+        self.chunk = None
+        self.docs = None
+
+
+def load_state(root: Path, state_path: Path, site, prefix: int):
+    """Return state of the previous build or None when the index needs a full rebuild"""
+    state = read_json(state_path) if (root / "index.json").exists() else None
+    if not state or state.get("version") != VERSION or state.get("lang") != site.lang or state.get("prefix") != prefix:
+        return None
+    return state
+
+
+def run(publish, output: Path):  # publish: core.Publish
+    from velican2.core.models import Post
+    site = publish.site
+    engine = site.get_engine()
+    prefix = settings.VELICAN_SEARCH_PREFIX
+    root = output / "search"
+    state_path = output / ".velican" / "search.json"
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    started = timezone.now()
+
+    posts = Post.objects.public().filter(site=site)
+    state = load_state(root, state_path, site, prefix)
+    if state is None:
+        shutil.rmtree(root, ignore_errors=True)
+        state = {"version": VERSION, "lang": site.lang, "prefix": prefix, "docs": {}}
+        changed, removed = posts, []
+    else:
+        changed = posts.filter(updated__gt=datetime.fromisoformat(state["built"]))
+        live = set(posts.values_list("id", flat=True).iterator())
+        removed = sorted(int(doc_id) for doc_id in state["docs"] if int(doc_id) not in live)
+    (root / "shards").mkdir(parents=True, exist_ok=True)
+    (root / "docs").mkdir(parents=True, exist_ok=True)
+
+    stale = set()  # ids whose previous postings must be dropped from existing shards
+    touched = set()  # prefixes of shards that need to be rewritten
+    docs = Docs(root / "docs")
+    for doc_id in removed:
+        touched.update(state["docs"].pop(str(doc_id)).split())
+        stale.add(doc_id)
+        docs.set(doc_id, None)
+    docs.flush()
+
+    with tempfile.TemporaryDirectory(prefix="velican-search-") as tmp:
+        postings = Postings(Path(tmp), prefix)
+        count = 0
+        for post in (changed.select_related("category", "author")
+                     .order_by("id").iterator(chunk_size=2000)):
+            previous = state["docs"].get(str(post.id))
+            if previous is not None:
+                touched.update(previous.split())
+                stale.add(post.id)
+            scores = score(post, site.lang)
+            prefixes = {term[:prefix] for term in scores}
+            state["docs"][str(post.id)] = " ".join(sorted(prefixes))
+            touched.update(prefixes)
+            postings.add(post.id, scores)
+            docs.set(post.id, [
+                post.title,
+                engine.get_post_url(site, post),
+                (post.description or "").replace("\n", " ")[:DESCRIPTION_LENGTH],
+            ])
+            count += 1
+        docs.flush()
+        postings.flush()
+
+        for shard_prefix in touched:
+            path = root / "shards" / (shard_name(shard_prefix) + ".json")
+            shard = {}
+            for term, entries in read_json(path, {}).items():
+                entries = [entry for entry in entries if entry[0] not in stale]
+                if entries:
+                    shard[term] = entries
+            for term, doc_id, value in postings.read(shard_prefix):
+                shard.setdefault(term, []).append([doc_id, value])
+            for entries in shard.values():
+                entries.sort(key=lambda entry: -entry[1])
+            if shard:
+                write_json_if_changed(path, shard)
+            else:
+                path.unlink(missing_ok=True)
+
+    if count or removed or "built" not in state:
+        state["built"] = started.isoformat()
+    write_json_if_changed(state_path, state)
+    (root / "state.json").unlink(missing_ok=True)  # kept here (and deployed) by older versions
+    write_json_if_changed(root / "index.json", {
+        "version": VERSION,
+        "lang": site.lang[:2],
+        "prefix": prefix,
+        "docs_chunk": DOCS_CHUNK,
+        "stopwords": sorted(STOPWORDS.get(site.lang[:2], ())),
+        "shards": sorted(path.stem for path in (root / "shards").glob("*.json")),
+    })
+    script = finders.find("velican2/search.js")
+    if not (root / "search.js").exists() or not filecmp.cmp(script, root / "search.js", shallow=False):
+        shutil.copyfile(script, root / "search.js")
+    logger.info(f"Search index of {site}: {count} posts indexed, {len(removed)} removed, {len(touched)} shards rewritten")
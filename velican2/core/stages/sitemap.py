@@ -0,0 +1,141 @@
+'''
+Stage sitemap writes `sitemap.xml` (a sitemap index) with `sitemap-<n>.xml`
+shards of at most SITEMAP_SHARD urls and `robots.txt` driven by
+`Site.allow_crawlers` and `Site.allow_training`.
+
+Posts and pages are streamed from a single database cursor in a stable order
+so memory usage does not depend on the size of the site. Every shard is
+rendered into a temporary file together with a hash of its entries and it
+replaces the published shard only when the hash differs from the previous
+build.
+'''
+import hashlib
+import tempfile
+
+from pathlib import Path
+from types import SimpleNamespace
+from xml.sax.saxutils import escape
+from django.db.models import CharField, F, IntegerField, Value
+
+from velican2.core import logger
+from velican2.core.stages import read_json, write_json, write_if_changed
+
+name = "sitemap"
+
+SITEMAP_SHARD = 50_000  # maximum number of urls in a sitemap file by sitemaps.org
+
+# user agents of crawlers collecting data for AI training
+TRAINING_BOTS = (
+    "GPTBot", "ChatGPT-User", "Google-Extended", "CCBot", "anthropic-ai", "ClaudeBot",
+    "Claude-Web", "PerplexityBot", "Bytespider", "Applebot-Extended", "meta-externalagent",
+    "cohere-ai", "Diffbot", "omgili",
+)
+
+URLSET_HEAD = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_TAIL = '</urlset>\n'
+
+POST, PAGE = 0, 1
+
+
+def entries(site):
+    """Yield (url, lastmod) for every published post and page using one cursor"""
+    from velican2.core.models import Post, Page
+    engine = site.get_engine()
+    # columns that are not fields of both models are annotated in the same order in both
+    # queries because annotations are always selected after the model fields
+    posts = (Post.objects.public().filter(site=site)
+             .annotate(kind=Value(POST, output_field=IntegerField()),
+                       category_slug=F("category__slug"),
+                       author_username=F("author__username"))
+             .values_list("kind", "id", "slug", "lang", "created", "updated", "category_slug", "author_username"))
+    pages = (Page.objects.public().filter(site=site)
+             .annotate(kind=Value(PAGE, output_field=IntegerField()),
+                       category_slug=Value(None, output_field=CharField()),
+                       author_username=Value(None, output_field=CharField()))
+             .values_list("kind", "id", "slug", "lang", "created", "updated", "category_slug", "author_username"))
+    for kind, _, slug, lang, created, updated, category, author in \
+            posts.union(pages, all=True).order_by("kind", "id").iterator(chunk_size=2000):
+        content = SimpleNamespace(
+            slug=slug, lang=lang, created=created,
+            category=SimpleNamespace(slug=category) if category else None,
+            author=SimpleNamespace(username=author) if author else None)
+        if kind == POST:
+            yield engine.get_post_url(site, content), updated
+        else:
+            yield engine.get_page_url(site, content), updated
+
+
+class Shard:
+    """Sitemap shard rendered into a temporary file while hashing its content"""
+
+    def __init__(self, output: Path, number: int):
+        self.number = number
+        self.path = output / f"sitemap-{number}.xml"
+        self.file = tempfile.NamedTemporaryFile(
+            "wt", encoding="utf-8", dir=output, prefix=".sitemap-", suffix=".tmp", delete=False)
+        self.file.write(URLSET_HEAD)
+        self.hash = hashlib.sha1()
+        self.count = 0
+        self.lastmod = None
+
+    def add(self, url: str, lastmod):
+        line = f"<url><loc>{escape(url)}</loc><lastmod>{lastmod.isoformat()}</lastmod></url>\n"
+        self.file.write(line)
+        self.hash.update(line.encode("utf-8"))
+        self.count += 1
+        self.lastmod = lastmod if self.lastmod is None else max(self.lastmod, lastmod)
+
+    def close(self, previous: list) -> bool:
+        """Publish the shard if it differs from its `previous` hash. Return True if it was written"""
+        self.file.write(URLSET_TAIL)
+        self.file.close()
+        tmp = Path(self.file.name)
+        if self.number < len(previous) and previous[self.number] == self.hash.hexdigest() and self.path.exists():
+            tmp.unlink()
+            return False
+        tmp.chmod(0o644)
+        tmp.replace(self.path)
+        return True
+
+
+def robots(site) -> str:
+    lines = []
+    if not site.allow_training:
+        for bot in TRAINING_BOTS:
+            lines += [f"User-agent: {bot}", "Disallow: /", ""]
+    lines += ["User-agent: *", "Disallow: /" if not site.allow_crawlers else "Allow: /", ""]
+    if site.allow_crawlers:
+        lines.append(f"Sitemap: {site.absolutize('sitemap.xml')}")
+    return "\n".join(lines) + "\n"
+
+
+def run(publish, output: Path):  # publish: core.Publish
+    site = publish.site
+    state_path = output / ".velican" / "sitemap.json"
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    previous = read_json(state_path, {}).get("shards", [])
+
+    shards, written = [], 0
+    shard = None
+    for url, lastmod in entries(site):
+        if shard is None or shard.count >= SITEMAP_SHARD:
+            if shard is not None:
+                written += shard.close(previous)
+            shard = Shard(output, len(shards))
+            shards.append(shard)
+        shard.add(url, lastmod)
+    if shard is not None:
+        written += shard.close(previous)
+    for number in range(len(shards), len(previous)):
+        (output / f"sitemap-{number}.xml").unlink(missing_ok=True)
+
+    index = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for shard in shards:
+        index.append(f"<sitemap><loc>{escape(site.absolutize(shard.path.name))}</loc>"
+                     f"<lastmod>{shard.lastmod.isoformat()}</lastmod></sitemap>")
+    index.append("</sitemapindex>")
+    write_if_changed(output / "sitemap.xml", "\n".join(index) + "\n")
+    write_if_changed(output / "robots.txt", robots(site))
+    write_json(state_path, {"shards": [shard.hash.hexdigest() for shard in shards]})
+    logger.info(f"Sitemap of {site}: {len(shards)} shards, {written} rewritten")
@@ -0,0 +1,92 @@
+/*
+ * Client-side search over the index built by velican's `search` publish stage.
+ *
+ * Include it in a theme (Pelican exposes the path as VELICAN_SEARCH):
+ *
+ *   {% if VELICAN_SEARCH %}<script src="{{ SITEURL }}/{{ VELICAN_SEARCH }}" defer></script>{% endif %}
+ *
+ * and call `velicanSearch(query, limit)` which resolves to a list of
+ * {title, url, description, score}. Shards are downloaded lazily by term
+ * prefix and cached for the lifetime of the page.
+ */
+(function () {
+  "use strict";
+  var script = document.currentScript;
+  var base = script ? script.src.replace(/[^/]*$/, "") : "/search/";
+  var cache = {};
+
+  function load(path) {
+    if (!cache[path]) {
+      cache[path] = fetch(base + path).then(function (response) {
+        return response.ok ? response.json() : {};
+      });
+    }
+    return cache[path];
+  }
+
+  function hex(text) {
+    return Array.prototype.map.call(new TextEncoder().encode(text), function (b) {
+      return ("0" + b.toString(16)).slice(-2);
+    }).join("");
+  }
+
+  function tokenize(text, manifest) {
+    var stopwords = new Set(manifest.stopwords);
+    return (text.match(/[\p{L}\p{N}_]+/gu) || []).map(function (word) {
+      return word.normalize("NFKD").replace(/\p{M}/gu, "").toLowerCase();
+    }).filter(function (word) {
+      return word.length > 1 && !stopwords.has(word);
+    });
+  }
+
+  function lookup(term, manifest) {
+    var shard = hex(term.slice(0, manifest.prefix));
+    if (manifest.shards.indexOf(shard) < 0) {
+      return Promise.resolve({});
+    }
+    return load("shards/" + shard + ".json").then(function (postings) {
+      var scores = {};
+      Object.keys(postings).forEach(function (candidate) {
+        if (candidate.lastIndexOf(term, 0) !== 0) {
+          return;
+        }
+        postings[candidate].forEach(function (entry) {
+          // exact matches weight more than prefix matches
+          var value = candidate === term ? entry[1] : entry[1] / 2;
+          scores[entry[0]] = Math.max(scores[entry[0]] || 0, value);
+        });
+      });
+      return scores;
+    });
+  }
+
+  window.velicanSearch = function (query, limit) {
+    limit = limit || 20;
+    return load("index.json").then(function (manifest) {
+      var terms = tokenize(query, manifest);
+      return Promise.all(terms.map(function (term) {
+        return lookup(term, manifest);
+      })).then(function (results) {
+        var hits = {};
+        results.forEach(function (scores) {
+          Object.keys(scores).forEach(function (id) {
+            var hit = hits[id] || (hits[id] = {id: +id, matched: 0, score: 0});
+            hit.matched += 1;
+            hit.score += scores[id];
+          });
+        });
+        var best = Object.keys(hits).map(function (id) { return hits[id]; }).sort(function (a, b) {
+          return (b.matched - a.matched) || (b.score - a.score);
+        }).slice(0, limit);
+        return Promise.all(best.map(function (hit) {
+          return load("docs/" + Math.floor(hit.id / manifest.docs_chunk) + ".json").then(function (docs) {
+            var doc = docs[hit.id];
+            return doc && {title: doc[0], url: doc[1], description: doc[2], score: hit.score};
+          });
+        }));
+      }).then(function (docs) {
+        return docs.filter(Boolean);
+      });
+    });
+  };
+})();
@@ -0,0 +1,1158 @@
+import asyncio
+import http.server
+import io
+import json
+import logging
+import re
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import models as auth
+from django.core.management import call_command
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from velican2.core import (api, archive, background, builds, db, deploy, importers, outbox, progress, purge,
+                           revisions, scheduler)
+from velican2.core.deploy import local
+from velican2.core.management.commands.velican_import import Importer
+from velican2.core.stages import feeds, fingerprint, search, sitemap
+from velican2.core.models import Category, OutdatedException, Outbox, Page, Post, Publish, Revision, Site
+from velican2.pelican import apps as pelican_apps
+from velican2.pelican.models import Settings, Theme
+
+
+class FakeTwitter(http.server.BaseHTTPRequestHandler):
+    """Answers POST /2/tweets with the queued (status, headers, body) responses"""
+    protocol_version = "HTTP/1.1"  # keep-alive so the worker reuses pooled connections
+    answers = []
+    requests = []
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        FakeTwitter.requests.append((self.path, dict(self.headers), json.loads(body)))
+        status, headers, data = FakeTwitter.answers.pop(0) if FakeTwitter.answers else (201, {}, {"data": {"id": "1"}})
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class OutboxTest(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), FakeTwitter)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):
+        FakeTwitter.answers = []
+        FakeTwitter.requests = []
+        self.settings = override_settings(
+            VELICAN_TWITTER_API=f"http://127.0.0.1:{self.server.server_port}",
+            VELICAN_PUBLISHERS=["twitter"],
+            VELICAN_OUTBOX_BACKOFF=0.01)
+        self.settings.enable()
+        Theme.sync_installed(force=True)  # rows of installed themes are flushed after every test
+        self.user = auth.User.objects.create(username="author")
+        app = SocialApp.objects.create(provider="twitter_oauth2", name="twitter", client_id="id", secret="secret")
+        account = SocialAccount.objects.create(user=self.user, provider="twitter_oauth2", uid="42")
+        SocialToken.objects.create(app=app, account=account, token="token")
+        self.site = Site.objects.create(domain="outbox.example.com", lang="en_US", title="Outbox")
+        # publishes are inserted without signals so no build is started
+        Publish.objects.bulk_create([Publish(site=self.site, success=True, message="") for _ in range(2)])
+        self.baseline, self.publish = Publish.objects.filter(site=self.site).order_by("id")
+        self.post = Post.objects.create(site=self.site, slug="new", title="New", lang="en_US", content="",
+                                        description="Description", punchline="Read it", draft=False, author=self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def test_enqueue_once_per_destination(self):
+        self.assertEqual(outbox.enqueue(self.baseline), 0)
+        self.assertEqual(outbox.enqueue(self.publish), 1)
+        outbox.enqueue(self.publish)
+        entry = Outbox.objects.get()
+        self.assertEqual((entry.post, entry.destination, entry.account), (self.post, "twitter", "42"))
+
+    def test_edited_old_post_is_not_enqueued(self):
+        Post.objects.filter(id=self.post.id).update(published=self.baseline.started - timedelta(days=1))
+        post = Post.objects.get(id=self.post.id)
+        post.title = "New (typo fixed)"
+        post.save()
+        self.assertEqual(outbox.enqueue(self.publish), 0)
+        post.draft = True
+        post.save()
+        post.draft = False
+        post.save()  # back from a draft it was already announced
+        self.assertEqual(outbox.enqueue(self.publish), 0)
+        draft = Post.objects.create(site=self.site, slug="draft", title="Draft", lang="en_US", content="",
+                                    description="", draft=True, author=self.user)
+        draft.draft = False
+        draft.save()
+        self.assertEqual(outbox.enqueue(self.publish), 1)
+
+    def test_retries_with_the_same_key(self):
+        outbox.enqueue(self.publish)
+        FakeTwitter.answers = [
+            (503, {}, {}),
+            (429, {"Retry-After": "0"}, {}),
+        ]
+        worker = outbox.Worker(workers=2)
+        for _ in range(50):
+            worker.drain()
+            if Outbox.objects.get().status == "sent":
+                break
+            Outbox.objects.update(next_attempt=Outbox.objects.get().created)
+        entry = Outbox.objects.get()
+        self.assertEqual((entry.status, entry.remote_id, entry.attempts), ("sent", "1", 2))
+        self.assertEqual(len(FakeTwitter.requests), 3)
+        self.assertEqual({headers["Idempotency-Key"] for _, headers, _ in FakeTwitter.requests}, {entry.key})
+        path, headers, body = FakeTwitter.requests[-1]
+        self.assertEqual((path, headers["Authorization"]), ("/2/tweets", "Bearer token"))
+        self.assertTrue(body["text"].startswith("Read it https://outbox.example.com/"))
+
+    def test_refused_post_is_not_retried(self):
+        outbox.enqueue(self.publish)
+        FakeTwitter.answers = [(403, {}, {"detail": "forbidden"})]
+        outbox.Worker().drain()
+        entry = Outbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts), ("failed", 1))
+        self.assertIn("403", entry.message)
+
+    def test_rate_limit_per_account(self):
+        limiter = outbox.Limiter()
+        self.assertEqual(limiter.acquire("twitter:42", (2, 60)), 0)
+        self.assertEqual(limiter.acquire("twitter:42", (2, 60)), 0)
+        self.assertGreater(limiter.acquire("twitter:42", (2, 60)), 59)
+        self.assertEqual(limiter.acquire("twitter:43", (2, 60)), 0)
+
+
+@override_settings(VELICAN_REPLICA_LAG=5)
+class ReplicaTest(TransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="replica.example.com", lang="en_US", title="Replica")
+        self.post = Post.objects.create(site=self.site, slug="post", title="Post", lang="en_US", content="", description="")
+        self.replicas = mock.patch.object(db, "replicas", return_value=["replica1"])
+        self.replicas.start()
+
+    def tearDown(self):
+        self.replicas.stop()
+
+    def age(self):
+        Post.objects.filter(id=self.post.id).update(updated=timezone.now() - timedelta(seconds=10))
+
+    def test_only_wrapped_reads_use_replicas(self):
+        self.age()
+        router = db.Router()
+        self.assertEqual(router.db_for_read(Post), "default")
+        with db.replica(self.site):
+            self.assertEqual(router.db_for_read(Post), "replica1")
+            self.assertEqual(router.db_for_write(Post), "default")
+        self.assertEqual(router.db_for_read(Post, instance=self.post), "default")
+
+    def test_recently_changed_site_reads_primary(self):
+        self.assertEqual(db.choose(self.site), "default")
+        self.assertEqual(db.choose(self.site, fallback="snapshot"), "snapshot")
+        self.age()
+        self.assertEqual(db.choose(self.site), "replica1")
+
+    def test_client_reads_own_writes(self):
+        seen = []
+        middleware = db.StickyMiddleware(lambda request: seen.append(db.choose()) or HttpResponse())
+        response = middleware(RequestFactory().post("/admin/"))
+        self.assertEqual(seen, ["replica1"])
+        request = RequestFactory().get("/api/")
+        request.COOKIES[db.COOKIE] = response.cookies[db.COOKIE].value
+        middleware(request)
+        self.assertEqual(seen[-1], "default")
+        request.COOKIES[db.COOKIE] = str(int(response.cookies[db.COOKIE].value) - 10)
+        middleware(request)
+        self.assertEqual(seen[-1], "replica1")
+
+
+class BackgroundTest(TransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="background.example.com", lang="en_US", title="Background")
+        self.connections = weakref.WeakSet()
+        self.peak = 0
+        self.lock = threading.Lock()
+        connection_created.connect(self.on_connection_created)
+
+    def tearDown(self):
+        connection_created.disconnect(self.on_connection_created)
+
+    def on_connection_created(self, connection, **kwargs):
+        with self.lock:
+            self.connections.add(connection)
+            self.peak = max(self.peak, self.opened())
+
+    def opened(self) -> int:
+        """Connections opened during the test that are still open"""
+        return sum(1 for connection in list(self.connections) if connection.connection is not None)
+
+    def test_connections_stay_bounded(self):
+        def build(engine, publish):
+            with db.snapshot(publish.site):
+                list(Post.objects.filter(site=publish.site_id)[:10])
+            Publish.objects.filter(id=publish.id).update(finished=publish.started, success=True)
+
+        Publish.objects.bulk_create([Publish(site=self.site, message="") for _ in range(300)])
+        with override_settings(VELICAN_PUBLISH_WORKERS=4), mock.patch.object(background, "_executor", None), \
+                mock.patch.object(Settings, "publish", build):
+            try:
+                futures = [background.submit(publish.run) for publish in Publish.objects.filter(site=self.site)]
+                for future in futures:
+                    future.result()
+            finally:
+                background.executor().shutdown(cancel_futures=True)
+        self.assertEqual(Publish.objects.filter(site=self.site, success=True).count(), 300)
+        # every worker thread holds at most one connection per alias (default and snapshot)
+        self.assertLessEqual(self.peak, 4 * 2)
+        # idle workers keep none
+        self.assertEqual(self.opened(), 0)
+
+
+@override_settings(VELICAN_REVISION_SNAPSHOT=3)
+class RevisionTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="revisions.example.com", lang="en_US", title="Revisions")
+        self.post = Post.objects.create(site=self.site, slug="post", title="v0", lang="en_US", description="",
+                                        content="".join(f"line {n}\n" for n in range(100)))
+        self.contents = [self.post.content]
+        for version in range(1, 8):
+            self.post.title = f"v{version}"
+            self.post.content = self.post.content.replace(f"line {version * 10}\n", f"changed {version}\n")
+            self.post.save()
+            self.contents.append(self.post.content)
+
+    def test_versions_are_rebuilt_from_snapshots_and_deltas(self):
+        stored = list(self.post.revisions.order_by("version").values_list("version", "base"))
+        self.assertEqual(stored, [(0, 0), (1, 0), (2, 0), (3, 3), (4, 3), (5, 3), (6, 6), (7, 6)])
+        for version, content in enumerate(self.contents):
+            self.assertEqual(revisions.load(self.post, version), {**revisions.load(self.post, version),
+                                                                  "content": content, "title": f"v{version}"})
+        changes = revisions.diff(self.post, 2, 4)
+        self.assertEqual(changes["fields"], {"title": ["v2", "v4"]})
+        self.assertIn("-line 30\n+changed 3\n", changes["content"])
+
+    def test_save_of_an_outdated_version_fails(self):
+        first, second = Post.objects.get(id=self.post.id), Post.objects.get(id=self.post.id)
+        first.title = "first"
+        first.save()
+        second.title = "second"
+        with self.assertRaises(OutdatedException):
+            second.save()
+        self.assertEqual(Post.objects.values_list("title", "version").get(id=self.post.id), ("first", 8))
+
+    def test_restore_saves_a_new_version(self):
+        revisions.restore(Post.objects.get(id=self.post.id), 2)
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.version, post.title, post.content), (8, "v2", self.contents[2]))
+
+    def test_version_is_loaded_by_one_query(self):
+        post = Post.objects.get(id=self.post.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(revisions.load(post, 5)["content"], self.contents[5])
+        with self.assertRaises(Revision.DoesNotExist):
+            revisions.load(post, 42)
+
+    def test_save_costs_the_update_and_the_revision(self):
+        # without the content file velican2.pelican writes on every save
+        post_save.disconnect(pelican_apps.on_post_save, sender=Post)
+        self.addCleanup(post_save.connect, pelican_apps.on_post_save, sender=Post)
+        with self.assertNumQueries(4):  # BEGIN, INSERT of the post and of its revision, COMMIT
+            Post.objects.create(site=self.site, slug="new", title="new", lang="en_US", description="", content="")
+        post = Post.objects.get(id=self.post.id)
+        post.content += "added\n"
+        with self.assertNumQueries(5):  # the last revision is read by the first save of a loaded post
+            post.save()
+        post.content += "added again\n"
+        with self.assertNumQueries(4):  # BEGIN, UPDATE, INSERT of the revision, COMMIT
+            post.save()
+        self.assertEqual(list(post.revisions.filter(version__gte=8).values_list("version", "base")), [(8, 6), (9, 9)])
+        self.assertEqual(revisions.load(post, 9)["content"], post.content)
+
+    def test_restore_is_allowed_to_whoever_may_publish(self):
+        url = f"/api/revisions.example.com/posts/{self.post.id}/revisions/2/restore/"
+        self.client.force_login(auth.User.objects.create_user("visitor"))
+        self.assertEqual(self.client.post(url).status_code, 403)
+        self.client.force_login(auth.User.objects.create_superuser("admin", "admin@example.com", "password"))
+        response = self.client.post(url)
+        self.assertEqual((response.status_code, response.json()), (200, {"version": 8}))
+        self.assertEqual(self.client.post(url.replace("/2/", "/42/")).status_code, 404)
+
+    def test_history_of_imported_content_starts_with_its_state(self):
+        Post.objects.bulk_create([Post(site=self.site, slug="imported", title="imported", lang="en_US",
+                                       description="", content="old\n", version=0)])
+        post = Post.objects.get(slug="imported")
+        post.content = "new\n"
+        post.save()
+        self.assertEqual([revisions.load(post, version)["content"] for version in (0, 1)], ["old\n", "new\n"])
+
+
+class ApiTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="api.example.com", lang="en_US", title="API")
+        user = auth.User.objects.create_user("editor")
+        self.site.staff.add(user)
+        self.client.force_login(user)
+        now = timezone.now()
+        # inserted without signals - nothing is written into the content directory
+        Post.objects.bulk_create([Post(site=self.site, slug=f"post-{n}", title=f"Post {n}", lang="en_US",
+                                       description="", content="", created=now, updated=now - timedelta(minutes=n % 3))
+                                  for n in range(7)])
+        self.url = "/api/api.example.com/posts/"
+
+    def test_pages_follow_each_other(self):
+        ids, url = [], f"{self.url}?limit=3&fields=id,updated"
+        while url:
+            data = self.client.get(url).json()
+            self.assertLessEqual(len(data["items"]), 3)
+            ids.extend(item["id"] for item in data["items"])
+            url = data["next"]
+        expected = list(Post.objects.filter(site=self.site).order_by("updated", "id").values_list("id", flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_first_page_is_not_modified_until_a_post_changes(self):
+        response = self.client.get(f"{self.url}?limit=3")
+        tag = response["ETag"]
+        self.assertEqual(self.client.get(f"{self.url}?limit=3", HTTP_IF_NONE_MATCH=tag).status_code, 304)
+        # following pages are not tagged (the aggregate is computed for first pages only)
+        self.assertNotIn("ETag", self.client.get(response.json()["next"]))
+        Post.objects.filter(site=self.site, slug="post-3").update(updated=timezone.now())
+        response = self.client.get(f"{self.url}?limit=3", HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], tag)
+
+    def test_bad_input_is_refused(self):
+        for query in ("cursor=%21%21", f"cursor={api.encode_cursor([1])}", f"cursor={api.encode_cursor({'a': 1})}",
+                      f"cursor={api.encode_cursor(['x', 'y'])}", f"cursor={api.encode_cursor([5, 1])}",
+                      f"cursor={api.encode_cursor(['2024-13-01T00:00:00+00:00', 1])}",
+                      "limit=many", "fields=id,secret", "order=title", "updated_since=yesterday"):
+            response = self.client.get(f"{self.url}?{query}")
+            self.assertEqual(response.status_code, 400, query)
+            self.assertIn("error", response.json())
+
+
+class ProgressTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="progress.example.com", lang="en_US", title="Progress")
+        # inserted without signals so no build is started
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+
+    def test_log_lines_are_appended_in_batches(self):
+        logger = logging.getLogger("velican2.tests")
+        with override_settings(VELICAN_PROGRESS_POLL=60), CaptureQueriesContext(connection) as queries:
+            with progress.capture(self.publish):
+                for n in range(20):
+                    logger.warning(f"line {n}")
+                self.assertEqual(Publish.objects.get(id=self.publish.id).log, "")
+        self.assertEqual(sum(query["sql"].startswith("UPDATE") for query in queries), 1)
+        log = Publish.objects.get(id=self.publish.id).log
+        self.assertEqual(log.splitlines(), [f"WARNING velican2.tests: line {n}" for n in range(20)])
+
+    def test_watcher_loads_new_lines_only(self):
+        async def watch():
+            async with progress.Watcher.subscribe(self.publish.id) as watcher:
+                version, snapshot = await watcher.wait(0, 5)
+                logs = [snapshot["log"]]
+                await sync_to_async(self.publish.progress)(line="second")
+                version, snapshot = await watcher.wait(version, 5)
+                logs.append(snapshot["log"])
+                await Publish.objects.filter(id=self.publish.id).aupdate(finished=timezone.now(), updated=timezone.now())
+                version, snapshot = await watcher.wait(version, 5)
+                return logs, snapshot
+
+        self.publish.progress(line="first")
+        with override_settings(VELICAN_PROGRESS_POLL=0.01):
+            logs, snapshot = asyncio.run(watch())
+        self.assertEqual(logs, ["first\n", "first\nsecond\n"])
+        self.assertEqual(snapshot["log"], "first\nsecond\n")
+        self.assertIsNotNone(snapshot["finished"])
+
+    def test_preview_starts_while_a_publish_is_running(self):
+        self.client.force_login(auth.User.objects.create_superuser("admin", "admin@example.com", "password"))
+        with mock.patch("velican2.pelican.apps.background.submit") as submit:
+            response = self.client.post("/preview/progress.example.com/")
+            self.assertEqual(response.status_code, 202)
+            started = Publish.objects.get(id=response.json()["id"])
+            self.assertTrue(started.preview)
+            # a second click gets the running preview
+            self.assertEqual(self.client.post("/preview/progress.example.com/").json()["id"], started.id)
+            self.assertEqual(self.client.post("/publish/progress.example.com/").json()["id"], self.publish.id)
+        self.assertEqual(submit.call_count, 1)
+
+    def test_publish_started_meanwhile_is_a_conflict(self):
+        self.client.force_login(auth.User.objects.create_superuser("admin", "admin@example.com", "password"))
+        # another request creates its publish between the check of the view and the insert
+        with mock.patch.object(Publish, "get_running", side_effect=[None, self.publish]):
+            response = self.client.post("/publish/progress.example.com/")
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json(), {"error": "Publish is already running"})
+        self.assertEqual(Publish.objects.filter(site=self.site).count(), 1)
+
+
+class BuildTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="build.example.com", lang="en_US", title="Build")
+        # inserted without signals so no build is started
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+
+    def build(self, publish):
+        # the budget is not applied to the test process
+        with mock.patch.object(Settings, "publish", publish), mock.patch.object(builds, "limit") as limit, \
+                mock.patch.object(builds, "SAMPLE", 0.01):
+            builds.build(Publish.objects.get(id=self.publish.id), budget=100000, top=3)
+        limit.assert_called_once_with(100000)
+        return Publish.objects.get(id=self.publish.id)
+
+    def test_memory_use_is_recorded(self):
+        def publish(engine, publish):
+            held = [bytearray(1024) for _ in range(20000)]
+            time.sleep(0.1)  # sampled while held
+            Publish.objects.filter(id=publish.id).update(success=True, finished=timezone.now())
+            return len(held)
+
+        publish = self.build(publish)
+        self.assertTrue(publish.success)
+        self.assertGreater(publish.peak_memory, 20 * 1024 * 1024)
+        self.assertEqual(len(publish.allocations.splitlines()), 3)
+        self.assertIn("tests.py", publish.allocations.splitlines()[0])
+
+    def test_budget_overrun_fails_the_publish(self):
+        def publish(engine, publish):
+            raise MemoryError()
+
+        publish = self.build(publish)
+        self.assertEqual((publish.success, publish.phase), (False, "failed"))
+        self.assertEqual(publish.message, "Build exceeded its memory budget of 100000 MB")
+        self.assertIsNotNone(publish.finished)
+
+
+@override_settings(VELICAN_SEARCH_PREFIX=2)
+class SearchTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="search.example.com", lang="en_US", title="Search")
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        self.output = Path(tempfile.mkdtemp())
+        self.posts = {title: Post.objects.create(site=self.site, slug=title.lower(), title=title, lang="en_US",
+                                                 description="", content=content, draft=False)
+                      for title, content in (("Apple", "orchard"), ("Banana", "plantation"), ("Cherry", "orchard"))}
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def shard(self, prefix: str) -> dict:
+        return json.loads((self.output / "search/shards" / f"{search.shard_name(prefix)}.json").read_text())
+
+    def files(self) -> dict:
+        return {path: (path.stat().st_mtime_ns, path.read_bytes()) for path in self.output.rglob("*") if path.is_file()}
+
+    def test_edited_and_deleted_posts_update_their_shards(self):
+        search.run(self.publish, self.output)
+        apple, banana, cherry = self.posts.values()
+        self.assertEqual(self.shard("or"), {"orchard": [[apple.id, 1], [cherry.id, 1]]})
+        before = self.files()
+
+        banana.content = "orchard"
+        banana.save()
+        cherry.delete()
+        search.run(self.publish, self.output)
+        self.assertEqual(self.shard("or"), {"orchard": [[apple.id, 1], [banana.id, 1]]})
+        self.assertFalse((self.output / "search/shards" / f"{search.shard_name('pl')}.json").exists())
+        self.assertFalse((self.output / "search/shards" / f"{search.shard_name('ch')}.json").exists())
+        docs = json.loads((self.output / "search/docs/0.json").read_text())
+        self.assertEqual(sorted(docs), sorted([str(apple.id), str(banana.id)]))
+        # shards of terms of neither post are not rewritten
+        shard = self.output / "search/shards" / f"{search.shard_name('ap')}.json"
+        self.assertEqual(shard.stat().st_mtime_ns, before[shard][0])
+
+    def test_unchanged_rebuild_writes_nothing(self):
+        search.run(self.publish, self.output)
+        # bookkeeping is kept out of the deployed files
+        self.assertTrue((self.output / ".velican/search.json").exists())
+        self.assertFalse((self.output / "search/state.json").exists())
+        before = self.files()
+        search.run(self.publish, self.output)
+        self.assertEqual(self.files(), before)
+
+
+class SitemapTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="sitemap.example.com", lang="en_US", title="Sitemap")
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        self.output = Path(tempfile.mkdtemp())
+        self.posts = [Post.objects.create(site=self.site, slug=f"post-{n}", title=f"Post {n}", lang="en_US",
+                                          description="", content=f"Content of post {n}", draft=False)
+                      for n in range(5)]
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def shards(self) -> dict:
+        return {path.name: path for path in self.output.glob("sitemap-*.xml")}
+
+    @mock.patch.object(sitemap, "SITEMAP_SHARD", 2)
+    def test_changed_post_rewrites_only_its_shard(self):
+        sitemap.run(self.publish, self.output)
+        shards = self.shards()
+        self.assertEqual(sorted(shards), ["sitemap-0.xml", "sitemap-1.xml", "sitemap-2.xml"])
+        inodes = {name: path.stat().st_ino for name, path in shards.items()}
+
+        self.posts[3].title = "Edited"
+        self.posts[3].save()
+        sitemap.run(self.publish, self.output)
+        self.assertEqual({name: path.stat().st_ino == inodes[name] for name, path in self.shards().items()},
+                         {"sitemap-0.xml": True, "sitemap-1.xml": False, "sitemap-2.xml": True})
+        self.assertIn(self.posts[3].updated.isoformat(), shards["sitemap-1.xml"].read_text())
+
+    @mock.patch.object(sitemap, "SITEMAP_SHARD", 2)
+    def test_deleted_posts_drop_out(self):
+        sitemap.run(self.publish, self.output)
+        url = self.site.get_engine().get_post_url(self.site, self.posts[4])
+        self.assertIn(url, self.shards()["sitemap-2.xml"].read_text())
+
+        self.posts[4].delete()
+        self.posts[1].draft = True
+        self.posts[1].save()
+        sitemap.run(self.publish, self.output)
+        self.assertEqual(sorted(self.shards()), ["sitemap-0.xml", "sitemap-1.xml"])
+        urls = "".join(path.read_text() for path in self.shards().values())
+        self.assertNotIn(url, urls)
+        self.assertNotIn(self.site.get_engine().get_post_url(self.site, self.posts[1]), urls)
+        self.assertEqual(urls.count("<url>"), 3)
+        self.assertNotIn("sitemap-2.xml", (self.output / "sitemap.xml").read_text())
+
+
+@override_settings(VELICAN_FEED_SIZE=2)
+class FeedsTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="feeds.example.com", lang="en_US", title="Feeds")
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        self.output = Path(tempfile.mkdtemp())
+        self.posts = [Post.objects.create(site=self.site, slug=f"post-{n}", title=f"Post {n}", lang="en_US",
+                                          description="", content=f"Content of post {n}", draft=False)
+                      for n in range(4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def inodes(self) -> tuple:
+        return tuple((self.output / path).stat().st_ino for path in (feeds.ATOM_PATH, feeds.RSS_PATH))
+
+    def titles(self) -> list:
+        return re.findall(r"<item><title>([^<]*)</title>", (self.output / feeds.RSS_PATH).read_text())
+
+    def test_only_changes_of_the_newest_posts_rewrite_feeds(self):
+        feeds.run(self.publish, self.output)
+        self.assertEqual(self.titles(), ["Post 3", "Post 2"])
+        inodes = self.inodes()
+
+        self.posts[0].title = "Edited out of the feeds"
+        self.posts[0].save()
+        feeds.run(self.publish, self.output)
+        self.assertEqual(self.inodes(), inodes)
+
+        self.posts[2].title = "Edited"
+        self.posts[2].save()
+        feeds.run(self.publish, self.output)
+        self.assertNotEqual(self.inodes(), inodes)
+        self.assertEqual(self.titles(), ["Post 3", "Edited"])
+        self.assertIn("Edited", (self.output / feeds.ATOM_PATH).read_text())
+
+    def test_deleted_posts_drop_out(self):
+        feeds.run(self.publish, self.output)
+        self.posts[3].delete()
+        feeds.run(self.publish, self.output)
+        self.assertEqual(self.titles(), ["Post 2", "Post 1"])
+        self.assertNotIn("Post 3", (self.output / feeds.ATOM_PATH).read_text())
+
+
+class SchedulerTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="scheduler.example.com", lang="en_US", title="Scheduler")
+        self.now = timezone.now()
+        later = self.now + timedelta(days=1)
+        for slug in ("first", "second", "future"):
+            Post.objects.create(site=self.site, slug=slug, title=slug, lang="en_US", content="", description="",
+                                draft=False, publish_at=later)
+        Page.objects.create(site=self.site, slug="about", title="About", lang="en_US", content="", publish_at=later)
+        # the scheduled time of all but one passed meanwhile
+        Post.objects.filter(slug="first").update(publish_at=self.now - timedelta(seconds=50))
+        Post.objects.filter(slug="second").update(publish_at=self.now - timedelta(seconds=10))
+        Page.objects.update(publish_at=self.now - timedelta(seconds=30))
+        Post.objects.filter(slug="future").update(publish_at=self.now + timedelta(minutes=10))
+        # publishes are inserted without signals so no build is started
+        self.publish = mock.patch.object(
+            Site, "publish", lambda site, user, preview=False: Publish.objects.bulk_create([Publish(site=site, message="")])[0])
+        self.publish.start()
+
+    def tearDown(self):
+        self.publish.stop()
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def test_due_items_are_released_by_one_publish(self):
+        wake = scheduler.tick(self.now)
+        self.assertEqual(Publish.objects.filter(site=self.site).count(), 1)
+        released = Post.objects.filter(slug__in=("first", "second"))
+        self.assertEqual(list(released.values_list("draft", "publish_at", "published").distinct()),
+                         [(False, None, self.now)])
+        self.assertIsNone(Page.objects.get().publish_at)
+        self.assertIn("Status: draft", self.site.get_engine().get_post_path(Post.objects.get(slug="future")).read_text())
+        self.assertNotIn("Status: draft", self.site.get_engine().get_post_path(released.first()).read_text())
+        self.assertTrue(self.site.get_engine().get_page_path(Page.objects.get()).is_file())
+        self.assertEqual(wake, self.now + timedelta(seconds=settings.VELICAN_SCHEDULE_RECHECK))
+
+        # released items are not released again
+        Publish.objects.update(finished=self.now, success=True)
+        scheduler.tick(self.now + timedelta(seconds=1))
+        self.assertEqual(Publish.objects.filter(site=self.site).count(), 1)
+
+    def test_release_is_a_new_version(self):
+        editing = Post.objects.get(slug="first")
+        scheduler.tick(self.now)
+        released = Post.objects.get(slug="first")
+        self.assertEqual(released.version, editing.version + 1)
+        self.assertEqual(list(released.revisions.values_list("version", flat=True)), [0, 1])
+        self.assertEqual(revisions.load(released, 1)["content"], released.content)
+        editing.title = "edited before the release"
+        with self.assertRaises(OutdatedException):
+            editing.save()
+
+    def test_posts_put_back_into_draft_are_not_released(self):
+        Post.objects.filter(slug="second").update(draft=True)
+        scheduler.tick(self.now)
+        post = Post.objects.get(slug="second")
+        self.assertEqual((post.draft, post.published, post.version), (True, None, 0))
+        self.assertIsNotNone(post.publish_at)
+        self.assertFalse(Post.objects.get(slug="first").draft)
+        self.assertEqual(scheduler.due_sites(self.now + timedelta(seconds=1)), set())
+
+    def test_future_items_are_not_released(self):
+        future = Post.objects.get(slug="future")
+        with override_settings(VELICAN_SCHEDULE_WINDOW=60, VELICAN_SCHEDULE_RECHECK=3600):
+            wake = scheduler.tick(self.now)
+            self.assertEqual(wake, scheduler.align(future.publish_at, 60))
+            future.refresh_from_db()
+            self.assertIsNotNone(future.publish_at)
+            self.assertIsNone(future.published)
+            Publish.objects.update(finished=self.now, success=True)
+            scheduler.tick(wake)
+        future.refresh_from_db()
+        self.assertEqual((future.publish_at, future.published), (None, wake))
+        self.assertEqual(Publish.objects.filter(site=self.site).count(), 2)
+
+    def test_items_of_a_site_being_published_wait_for_the_next_window(self):
+        Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        with override_settings(VELICAN_SCHEDULE_WINDOW=60):
+            self.assertEqual(scheduler.tick(self.now), self.now + timedelta(seconds=60))
+        self.assertEqual(Post.objects.scheduled().count(), 3)
+
+
+class DeployTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.output, self.target = Path(tempfile.mkdtemp()), Path(tempfile.mkdtemp())
+        self.site = Site.objects.create(domain="deploy.example.com", lang="en_US", title="Deploy",
+                                        deployment="local", deploy_target=str(self.target))
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        self.write("index.html", "index")
+        self.write("2024/01/post.html", "post")
+        self.write("theme/css/main.css", "css")
+        self.write(".velican/search.json", "{}")
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+        shutil.rmtree(self.target)
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def write(self, path: str, content: str):
+        (self.output / path).parent.mkdir(parents=True, exist_ok=True)
+        (self.output / path).write_text(content)
+
+    def test_only_changed_content_is_changed(self):
+        previous = deploy.scan(self.output, {})
+        self.assertEqual(sorted(previous), ["2024/01/post.html", "index.html", "theme/css/main.css"])
+        self.write("index.html", "INDEX")  # same size, another content
+        self.write("theme/css/main.css", "css")  # rewritten with the same content
+        self.write("index.html.tmp", "half written")
+        (self.output / "2024/01/post.html").unlink()
+        current = deploy.scan(self.output, previous)
+        self.assertEqual(deploy.diff(previous, current), (["index.html"], ["2024/01/post.html"]))
+        self.assertEqual(deploy.diff({}, current), (sorted(current), []))
+
+    def test_emptied_directories_are_listed_deepest_first(self):
+        current = {"a/kept.html": [1, 1, "x"], "index.html": [1, 1, "y"]}
+        removed = ["a/b/c/gone.html", "a/b/gone.html", "a/gone.html", "x/gone.html"]
+        self.assertEqual(deploy.emptied(removed, current), ["a/b/c", "a/b", "x"])
+
+    def test_local_deployment_mirrors_changes(self):
+        deploy.run(self.publish, self.output)
+        files = sorted(path.relative_to(self.target).as_posix() for path in self.target.rglob("*") if path.is_file())
+        self.assertEqual(files, ["2024/01/post.html", "index.html", "theme/css/main.css"])
+
+        self.write("index.html", "new index")
+        (self.output / "2024/01/post.html").unlink()
+        with mock.patch.object(local, "transfer", wraps=local.transfer) as transfer:
+            deploy.run(self.publish, self.output)
+        self.assertEqual([call.args[2] for call in transfer.call_args_list], [["index.html"]])
+        self.assertEqual((self.target / "index.html").read_text(), "new index")
+        self.assertFalse((self.target / "2024").exists())
+        self.assertEqual(Publish.objects.get(id=self.publish.id).phase, "deploy")
+
+        # another target starts from scratch
+        Site.objects.filter(id=self.site.id).update(deploy_target=str(self.target / "mirror"))
+        self.publish.site.refresh_from_db()
+        deploy.run(self.publish, self.output)
+        self.assertEqual((self.target / "mirror/theme/css/main.css").read_text(), "css")
+
+    def stand_in(self, script: str) -> str:
+        """Command replacing ssh - `script` gets the host and the remote command as $1 and $2"""
+        directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, directory)
+        (directory / "ssh").write_text("#!/bin/sh\n" + script)
+        (directory / "ssh").chmod(0o755)
+        return str(directory / "ssh")
+
+    def deploy_by_ssh(self, script: str):
+        Site.objects.filter(id=self.site.id).update(deployment="ssh", deploy_target=f"editor@node:{self.target}/www")
+        self.publish.site.refresh_from_db()
+        with override_settings(VELICAN_DEPLOY_SSH=self.stand_in(script)):
+            deploy.run(self.publish, self.output)
+
+    def test_ssh_deployment_mirrors_changes(self):
+        # runs the remote command locally (on the host of the target only)
+        script = '[ "$1" = editor@node ] || exit 255\nexec sh -c "$2"\n'
+        self.write("index.html.tmp", "half written")
+        self.deploy_by_ssh(script)
+        www = self.target / "www"
+        files = sorted(path.relative_to(www).as_posix() for path in www.rglob("*") if path.is_file())
+        self.assertEqual(files, ["2024/01/post.html", "index.html", "theme/css/main.css"])
+
+        self.write("index.html", "new index")
+        (self.output / "2024/01/post.html").unlink()
+        self.deploy_by_ssh(script)
+        self.assertEqual((www / "index.html").read_text(), "new index")
+        self.assertFalse((www / "2024").exists())
+        self.assertEqual((www / "theme/css/main.css").read_text(), "css")
+
+    def test_failed_ssh_command_fails_the_deployment(self):
+        with self.assertRaisesRegex(deploy.DeployError, "tar -x .* on editor@node failed: Permission denied"):
+            self.deploy_by_ssh('echo "Permission denied (publickey)" >&2\nexit 255\n')
+        # nothing is recorded as deployed - the next deployment transfers everything again
+        self.assertFalse((self.output / ".velican/deploy.json").exists())
+
+
+class ArchiveTest(TransactionTestCase):
+    databases = "__all__"
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.user = auth.User.objects.create(username="editor")
+        self.site = Site.objects.create(domain="archive.example.com", lang="en_US", title="Archive")
+        self.site.staff.add(self.user)
+        category = Category.objects.create(site=self.site, slug="news", name="News")
+        Post.objects.create(site=self.site, slug="first", title="First", lang="en_US", description="", content="One",
+                            draft=False, category=category, author=self.user)
+        draft = Post.objects.create(site=self.site, slug="draft", title="Draft", lang="en_US", description="",
+                                    content="Two")
+        draft.content = "Two, edited"
+        draft.save(user=self.user)
+        Page.objects.create(site=self.site, slug="about", title="About", lang="en_US", content="About us")
+        Publish.objects.bulk_create([Publish(site=self.site, message="", success=True, finished=timezone.now())])
+        output = self.site.get_engine().get_publish_path()
+        (output / "2024").mkdir(parents=True, exist_ok=True)
+        (output / "2024/first.html").write_text("<h1>First</h1>")
+
+    def tearDown(self):
+        for site in Site.objects.all():
+            shutil.rmtree(site.get_engine().get_content_path(), ignore_errors=True)
+            shutil.rmtree(site.get_engine().get_publish_path(), ignore_errors=True)
+
+    def state(self, site: Site) -> dict:
+        """Rows and files of `site` without its own ids"""
+        rows = {}
+        for model, related in ((Category, ()), (Post, ("category__slug", "author__username")), (Page, ()), (Publish, ())):
+            fields = [field.attname for field in model._meta.concrete_fields if field.attname not in (
+                "id", "site_id", "category_id", "author_id")]
+            rows[model.__name__] = list(model.objects.filter(site=site).order_by(*fields[:1]).values(*fields, *related))
+        rows["Revision"] = [list(Revision.objects.filter(**{f"{kind}__site": site}).order_by(f"{kind}__slug", "version")
+                                 .values(f"{kind}__slug", "version", "base", "digest", "data", "created", "author__username"))
+                            for kind in ("post", "page")]
+        engine = site.get_engine()
+        rows["engine"] = (engine.theme_id, engine.post_url_template)
+        rows["staff"] = list(site.staff.values_list("username", flat=True))
+        for name, root in (("content", engine.get_content_path()), ("output", engine.get_publish_path())):
+            rows[name] = {path.relative_to(root).as_posix(): path.read_bytes() for path in root.rglob("*") if path.is_file()}
+        return rows
+
+    def test_restore_of_an_export_is_the_same_site(self):
+        before = self.state(self.site)
+        self.assertEqual(len(before["content"]), 3)
+        stream = io.BytesIO()
+        counts = archive.export(self.site, stream)
+        self.assertEqual((counts["posts"], counts["pages"], counts["output"]), (2, 1, 1))
+        for root in (self.site.get_engine().get_content_path(), self.site.get_engine().get_publish_path()):
+            shutil.rmtree(root)
+        self.site.delete()
+        self.assertFalse(Post.objects.exists())
+
+        stream.seek(0)
+        site, counts = archive.restore(stream)
+        self.assertEqual((site.domain, counts["posts"], counts["content"], counts["output"]),
+                         ("archive.example.com", 2, 3, 1))
+        self.assertEqual(self.state(site), before)
+        draft = Post.objects.get(site=site, slug="draft")
+        self.assertEqual([revisions.load(draft, version)["content"] for version in (0, 1)], ["Two", "Two, edited"])
+
+    def test_media_of_a_copy_do_not_replace_media_of_the_original(self):
+        media = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, media)
+        with override_settings(MEDIA_ROOT=media):
+            (media / "archive.example.com").mkdir()
+            (media / "archive.example.com/logo.png").write_bytes(b"logo")
+            Site.objects.filter(id=self.site.id).update(logo="archive.example.com/logo.png")
+            stream = io.BytesIO()
+            archive.export(Site.objects.get(id=self.site.id), stream)
+            (media / "archive.example.com/logo.png").write_bytes(b"changed since")
+
+            stream.seek(0)
+            copy, counts = archive.restore(stream, domain="copy.example.com")
+            self.assertEqual(counts["media"], 1)
+            self.assertEqual((media / "archive.example.com/logo.png").read_bytes(), b"changed since")
+            copy.refresh_from_db()
+            self.assertEqual(copy.logo.name, "copy.example.com/logo.png")
+            self.assertEqual(Path(copy.logo.path).read_bytes(), b"logo")
+
+
+class FingerprintTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="assets.example.com", path="/blog", lang="en_US", title="Assets")
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        self.output = Path(tempfile.mkdtemp())
+        self.write("theme/css/main.css", "body { background: url('../images/bg.png'); }")
+        self.write("theme/images/bg.png", "png")
+        self.write("images/photo.jpg", "jpeg")
+        self.write("2024/post.html", '<link href="https://assets.example.com/blog/theme/css/main.css" rel="stylesheet">'
+                                     '<img src="../images/photo.jpg?w=1"><img src="/blog/images/photo.jpg">'
+                                     '<a href="/blog/index.html">Home</a><img src="https://cdn.example.com/images/photo.jpg">')
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def write(self, path: str, content: str):
+        (self.output / path).parent.mkdir(parents=True, exist_ok=True)
+        (self.output / path).write_text(content)
+
+    def copy(self, path: str) -> str:
+        copies = [name for name in (self.output / path).parent.iterdir() if name.name != (self.output / path).name]
+        self.assertEqual(len(copies), 1)
+        return copies[0].name
+
+    def test_references_point_to_fingerprinted_copies(self):
+        fingerprint.run(self.publish, self.output)
+        css, photo = self.copy("theme/css/main.css"), self.copy("images/photo.jpg")
+        self.assertRegex(photo, r"^photo\.[0-9a-f]{10}\.jpg$")
+        self.assertEqual((self.output / "theme/css" / css).read_text(),
+                         f"body {{ background: url('../images/{self.copy('theme/images/bg.png')}'); }}")
+        self.assertEqual((self.output / "2024/post.html").read_text(),
+                         f'<link href="https://assets.example.com/blog/theme/css/{css}" rel="stylesheet">'
+                         f'<img src="../images/{photo}?w=1"><img src="/blog/images/{photo}">'
+                         '<a href="/blog/index.html">Home</a><img src="https://cdn.example.com/images/photo.jpg">')
+
+    def current(self, path: str) -> str:
+        """Name of the copy of `path` made by the last run"""
+        copies = json.loads((self.output / ".velican/fingerprint.json").read_text())["copies"]
+        return next(Path(copy).name for copy in copies if fingerprint.FINGERPRINTED.sub(Path(path).suffix, copy) == path)
+
+    def test_imports_and_srcsets_are_rewritten(self):
+        self.write("theme/css/print.css", '@import "fonts.css";\n@import \'main.css\' print;')
+        self.write("theme/css/fonts.css", "@font-face { src: url(../fonts/sans.woff2); }")
+        self.write("theme/fonts/sans.woff2", "font")
+        self.write("gallery.html", '<img srcset="images/photo.jpg 1x, /blog/theme/images/bg.png 2x,'
+                                   'https://cdn.example.com/a.jpg 3x">')
+        fingerprint.run(self.publish, self.output)
+        printed = self.current("theme/css/print.css")
+        self.assertEqual((self.output / "theme/css" / printed).read_text(),
+                         f'@import "{self.current("theme/css/fonts.css")}";\n'
+                         f'@import \'{self.current("theme/css/main.css")}\' print;')
+        self.assertEqual((self.output / "gallery.html").read_text(),
+                         f'<img srcset="images/{self.current("images/photo.jpg")} 1x, '
+                         f'/blog/theme/images/{self.current("theme/images/bg.png")} 2x,https://cdn.example.com/a.jpg 3x">')
+
+        # a changed font changes the name of the stylesheet importing the stylesheet using it
+        self.write("theme/fonts/sans.woff2", "another font")
+        fingerprint.run(self.publish, self.output)
+        self.assertNotEqual(self.current("theme/css/print.css"), printed)
+        self.assertIn(f'@import "{self.current("theme/css/fonts.css")}"',
+                      (self.output / "theme/css" / self.current("theme/css/print.css")).read_text())
+
+    def test_only_written_documents_are_read_while_assets_are_unchanged(self):
+        fingerprint.run(self.publish, self.output)
+        self.write("2024/new.html", '<img src="../images/photo.jpg">')  # written by pelican since
+        with mock.patch.object(fingerprint.Rewriter, "html", autospec=True, side_effect=fingerprint.Rewriter.html) as html:
+            fingerprint.run(self.publish, self.output)
+            self.assertEqual([call.args[2] for call in html.call_args_list], ["2024/new.html"])
+            self.assertIn(self.current("images/photo.jpg"), (self.output / "2024/new.html").read_text())
+            html.reset_mock()
+            fingerprint.run(self.publish, self.output)
+            self.assertEqual(html.call_count, 0)
+            # a changed asset changes references of every document
+            self.write("images/photo.jpg", "another jpeg")
+            fingerprint.run(self.publish, self.output)
+            self.assertEqual(html.call_count, 2)
+        self.assertIn(self.current("images/photo.jpg"), (self.output / "2024/post.html").read_text())
+
+    def test_only_assets_are_named_like_copies(self):
+        self.assertTrue(fingerprint.FINGERPRINTED.search("photo.0123456789.jpg"))
+        self.assertTrue(fingerprint.FINGERPRINTED.search("Photo.0123456789.JPG"))
+        for name in ("deadbeef.0123456789.html", "feeds/all.0123456789.xml", "notes.0123456789.txt"):
+            self.assertFalse(fingerprint.FINGERPRINTED.search(name), name)
+        self.write("2024/release.0123456789.html", '<img src="../images/photo.jpg">')
+        self.assertIn("2024/release.0123456789.html", fingerprint.scan(self.output)[1])
+
+    def test_changed_asset_gets_a_new_copy(self):
+        fingerprint.run(self.publish, self.output)
+        first = self.copy("theme/images/bg.png")
+        self.write("theme/images/bg.png", "another png")
+        fingerprint.run(self.publish, self.output)
+        names = {path.name for path in (self.output / "theme/images").iterdir()} - {"bg.png"}
+        self.assertEqual(len(names), 2)  # the previous copy is kept for cached pages
+        self.assertIn(first, names)
+        fingerprint.run(self.publish, self.output)
+        self.assertNotIn(first, {path.name for path in (self.output / "theme/images").iterdir()})
+
+
+class PurgeTest(TransactionTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), purge.StandIn)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="purge.example.com", lang="en_US", title="Purge")
+        self.publish, = Publish.objects.bulk_create([Publish(site=self.site, message="")])
+        self.output = Path(self.site.get_engine().get_publish_path())
+        purge.StandIn.purges.clear()
+        purge.StandIn.statuses.clear()
+        self.settings = override_settings(VELICAN_PURGE_URL=f"http://127.0.0.1:{self.server.server_port}/purge",
+                                          VELICAN_PURGE_BATCH=2, VELICAN_PURGE_BACKOFF=0.01)
+        self.settings.enable()
+        for path in ("index.html", "2024/post.html", "2024/old.html", "theme/main.css"):
+            self.write(path, path)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.output)
+
+    def write(self, path: str, content: str):
+        (self.output / path).parent.mkdir(parents=True, exist_ok=True)
+        (self.output / path).write_text(content)
+
+    def purged(self) -> list:
+        return sorted(url for body in purge.StandIn.purges for url in body["urls"])
+
+    def test_changed_and_removed_urls_are_purged_in_batches(self):
+        self.assertEqual(purge.run(self.publish), 0)  # baseline
+        self.assertEqual(purge.StandIn.purges, [])
+        self.write("index.html", "changed")
+        self.write("2024/post.html", "2024/post.html")  # same content
+        (self.output / "2024/old.html").unlink()
+        self.assertEqual(purge.run(self.publish), 3)
+        self.assertEqual(self.purged(), ["https://purge.example.com/", "https://purge.example.com/2024/old.html",
+                                         "https://purge.example.com/index.html"])
+        self.assertEqual([len(body["urls"]) for body in purge.StandIn.purges], [2, 1])
+        self.assertEqual(purge.run(self.publish), 0)
+
+    def test_failed_batches_are_retried_and_purged_again_next_time(self):
+        purge.run(self.publish)
+        self.write("theme/main.css", "changed")
+        purge.StandIn.statuses.extend([503, 429])
+        self.assertEqual(purge.run(self.publish), 1)
+        self.assertEqual(self.purged(), ["https://purge.example.com/theme/main.css"])
+        self.write("2024/post.html", "changed")
+        with override_settings(VELICAN_PURGE_ATTEMPTS=2):
+            purge.StandIn.statuses.extend([500, 500])
+            self.assertEqual(purge.run(self.publish), 0)
+            purge.StandIn.statuses.clear()
+            purge.StandIn.purges.clear()
+            self.assertEqual(purge.run(self.publish), 1)
+        self.assertEqual(self.purged(), ["https://purge.example.com/2024/post.html"])
+
+
+class ImportTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="import.example.com", lang="en_US", title="Import")
+        self.author = auth.User.objects.create(username="writer")
+        self.directory = Path(tempfile.mkdtemp())
+        (self.directory / "pages").mkdir()
+        (self.directory / "first.md").write_text(
+            "Title: First\nDate: 2020-01-02 10:00\nCategory: News\nAuthor: writer\n\nFirst content")
+        (self.directory / "second.md").write_text("Title: Second\nDate: 2021-03-04\nStatus: draft\n\nSecond content")
+        (self.directory / "pages" / "about.md").write_text("Title: About\n\nAbout us")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def run_import(self):
+        call_command("velican_import", self.site.domain, str(self.directory), "--batch-size", "2", "--no-publish",
+                     stdout=io.StringIO())
+
+    def test_directory_is_imported_and_reimported_in_place(self):
+        self.run_import()
+        posts = {post.slug: post for post in Post.objects.filter(site=self.site).select_related("category", "author")}
+        self.assertEqual(set(posts), {"first", "second"})
+        first, second = posts["first"], posts["second"]
+        self.assertEqual((first.category.name, first.author, first.draft), ("News", self.author, False))
+        self.assertEqual(first.created.year, 2020)
+        # imported public posts count as published long ago - they are not announced
+        self.assertEqual(first.published, first.created)
+        self.assertEqual((second.draft, second.published), (True, None))
+        self.assertEqual(Page.objects.get(site=self.site).content, "About us")
+        self.assertTrue(self.site.get_engine().get_post_path(first).is_file())
+
+        (self.directory / "first.md").write_text("Title: First, edited\nSlug: first\nDate: 2020-01-02 10:00\n\nEdited")
+        self.run_import()
+        self.assertEqual(Post.objects.filter(site=self.site).count(), 2)
+        self.assertEqual(Post.objects.get(site=self.site, slug="first").content, "Edited")
+
+    def test_last_duplicate_of_a_batch_wins(self):
+        importer = Importer(self.site, batch_size=10)
+        for title in ("one", "two"):
+            importer.add(importers.Item(kind="post", slug="same", title=title, content=title))
+            importer.add(importers.Item(kind="page", slug="same", title=title, content=title))
+        importer.flush()
+        self.assertEqual(list(Post.objects.filter(site=self.site).values_list("title", flat=True)), ["two"])
+        self.assertEqual(list(Page.objects.filter(site=self.site).values_list("title", flat=True)), ["two"])
+        self.assertEqual(importer.count, 2)
+
+    def test_saves_during_an_import_get_their_dates(self):
+        saved = []
+        bulk_create = QuerySet.bulk_create
+
+        def save_meanwhile(queryset, objs, **kwargs):
+            if not saved:  # as another thread of the process would
+                saved.append(Post.objects.create(site=self.site, slug="meanwhile", title="Meanwhile", lang="en_US",
+                                                 description="", content=""))
+            return bulk_create(queryset, objs, **kwargs)
+
+        with mock.patch.object(QuerySet, "bulk_create", save_meanwhile):
+            self.run_import()
+        meanwhile = Post.objects.get(slug="meanwhile")
+        self.assertGreater(meanwhile.created, timezone.now() - timedelta(minutes=1))
+        self.assertEqual(Post.objects.get(slug="first").created.year, 2020)
+        self.assertTrue(Post._meta.get_field("created").auto_now_add)
+
+
+class ProvisionTest(TransactionTestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.staff = auth.User.objects.create(username="editor")
+        self.directory = Path(tempfile.mkdtemp())
+        self.source = self.directory / "sites.csv"
+        self.source.write_text("domain,title,staff,deployment,deploy_target\n"
+                               "one.example.com.,One,editor,,\n"
+                               "two.example.com,Two,editor nobody,local,/srv/two\n"
+                               "not a domain,Bad,,,\n"
+                               "three.example.com,Three,,ssh,\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        for site in Site.objects.all():
+            for directory in (site.get_engine().get_content_path(), site.get_engine().get_publish_path()):
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def provision(self, *args) -> str:
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("velican_provision", str(self.source), "--batch-size", "1", "--no-caddy", *args,
+                     stdout=stdout, stderr=stderr)
+        return stdout.getvalue() + stderr.getvalue()
+
+    def test_sites_are_created_once(self):
+        output = self.provision()
+        self.assertIn("2 sites provisioned (2 created, 0 existing, 2 invalid)", output)
+        self.assertIn("sites.csv:4: domain:", output)
+        self.assertIn("sites.csv:5: deploy_target:", output)
+        self.assertIn("Unknown staff users: nobody", output)
+        two = Site.objects.get(domain="two.example.com")
+        self.assertEqual((two.title, two.deployment), ("Two", "local"))
+        self.assertTrue(Site.objects.filter(domain="one.example.com").exists())
+        self.assertEqual(list(two.staff.all()), [self.staff])
+        self.assertTrue(two.get_engine().get_publish_path().is_dir())
+        self.assertTrue((two.get_engine().get_content_path() / "content").is_dir())
+
+        Settings.objects.filter(site=two).delete()  # interrupted after the site was created
+        output = self.provision("--staff", "editor")
+        self.assertIn("2 sites provisioned (0 created, 2 existing, 2 invalid)", output)
+        self.assertEqual(Site.objects.count(), 2)
+        self.assertEqual(Settings.objects.count(), 2)
+        self.assertEqual(Site.staff.through.objects.count(), 2)
@@ -1,9 +1,24 @@
 from django.contrib import admin
 from django.urls import path, include
-from . import views
+from . import api, views
 
 urlpatterns = [
     path('domains/', views.domains),
     path('publish/<site>/', views.publish),
-    path('preview/<site>/', views.preview),
+    path('preview/<site>/', views.preview, name="preview"),
+    path('preview/<site>/<path:path>', views.browse),
+    path('publishes/<int:publish_id>/', views.status, name="publish-status"),
+    path('publishes/<int:publish_id>/events/', views.events, name="publish-events"),
+    path('api/<domain>/posts/', api.listing, {"resource": "posts"}, name="api-posts"),
+    path('api/<domain>/pages/', api.listing, {"resource": "pages"}, name="api-pages"),
+    path('api/<domain>/categories/', api.listing, {"resource": "categories"}, name="api-categories"),
 ]
+
+# revisions of posts and pages
+for resource in ("posts", "pages"):
+    urlpatterns += [
+        path(f'api/<domain>/{resource}/<int:id>/revisions/', api.history, {"resource": resource}),
+        path(f'api/<domain>/{resource}/<int:id>/revisions/<int:version>/', api.revision, {"resource": resource}),
+        path(f'api/<domain>/{resource}/<int:id>/revisions/<int:old>/diff/<int:new>/', api.diff, {"resource": resource}),
+        path(f'api/<domain>/{resource}/<int:id>/revisions/<int:version>/restore/', api.restore, {"resource": resource}),
+    ]
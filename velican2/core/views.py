@@ -1,18 +1,164 @@
+import json
+import os
+
+from asgiref.sync import sync_to_async
 from django import http
+from django.core.exceptions import PermissionDenied
+from django.core.serializers.json import DjangoJSONEncoder
 from django.shortcuts import render, get_object_or_404
+from django.urls import reverse
+from django.utils._os import safe_join
+from django.views import static
 from . import models
+from .progress import FIELDS, Watcher
+
+# seconds between keep-alive comments of an idle event stream
+KEEPALIVE = 15
+
+
+def get_site(request: http.HttpRequest, domain: str) -> models.Site:
+    site = get_object_or_404(models.Site, domain=domain)
+    if not site.can_publish(request.user):
+        raise PermissionDenied
+    return site
+
+
+def get_publish(request: http.HttpRequest, publish_id: int) -> models.Publish:
+    publish = get_object_or_404(models.Publish.objects.select_related("site"), id=publish_id)
+    if not publish.site.can_publish(request.user):
+        raise PermissionDenied
+    return publish
+
+
+def describe(publish: dict) -> dict:
+    data = {key: publish[key] for key in FIELDS if key != "log"}
+    data["status"] = reverse("publish-status", args=(publish["id"], ))
+    data["events"] = reverse("publish-events", args=(publish["id"], ))
+    return data
+
+
+def etag(publish: dict) -> str:
+    return f'W/"{publish["id"]}-{publish["updated"].timestamp():.6f}"'
+
+
+async def start(request: http.HttpRequest, domain: str, preview: bool):
+    if request.method != "POST":
+        return http.HttpResponseNotAllowed(["POST"])
+    site = await sync_to_async(get_site)(request, domain)
+    try:
+        publish = await sync_to_async(site.publish)(request.user, preview=preview)
+    except models.UpdateException as e:  # started by someone else meanwhile
+        return http.JsonResponse({"error": str(e)}, status=409)
+    data = describe({key: getattr(publish, key) for key in FIELDS})
+    response = http.JsonResponse(data, status=202)
+    response["Location"] = data["status"]
+    return response
+
+
+async def publish(request: http.HttpRequest, site: str):
+    return await start(request, site, preview=False)
+
+
+async def preview(request: http.HttpRequest, site: str):
+    if request.method in ("GET", "HEAD"):
+        return await sync_to_async(browse)(request, site, "")
+    return await start(request, site, preview=True)
+
+
+def browse(request: http.HttpRequest, site: str, path: str):
+    """Files of the current preview of the site - for its staff only. Links of
+    HTML pages to the site are rewritten to stay in the preview"""
+    if request.method not in ("GET", "HEAD"):
+        return http.HttpResponseNotAllowed(["GET", "HEAD"])
+    site = get_site(request, site)
+    engine = site.get_engine()
+    root = engine.get_preview_path() / "current" if engine else None
+    if root is None or not root.is_dir():
+        raise http.Http404("The site has no preview")
+    if not path or path.endswith("/"):
+        path += "index.html"
+    if path.endswith(".html"):
+        file = safe_join(root, path)
+        if not os.path.isfile(file):
+            raise http.Http404(path)
+        with open(file, encoding="utf-8", errors="surrogateescape") as stream:
+            text = stream.read()
+        text = text.replace(site.absolutize("/").rstrip("/") + "/", reverse("preview", args=(site.domain, )))
+        response = http.HttpResponse(text.encode("utf-8", errors="surrogateescape"), content_type="text/html; charset=utf-8")
+    else:
+        response = static.serve(request, path, document_root=root)
+    response["Cache-Control"] = "private, no-store"
+    response["X-Robots-Tag"] = "noindex"
+    return response
+
+
+async def status(request: http.HttpRequest, publish_id: int):
+    if request.method not in ("GET", "HEAD"):
+        return http.HttpResponseNotAllowed(["GET", "HEAD"])
+    publish = await sync_to_async(get_publish)(request, publish_id)
+    data = {key: getattr(publish, key) for key in FIELDS}
+    tag = etag(data)
+    if tag in request.headers.get("If-None-Match", ""):
+        response = http.HttpResponseNotModified()
+    else:
+        response = http.JsonResponse(describe(data))
+    response["ETag"] = tag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def event(name: str, data, event_id=None) -> str:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {name}")
+    lines.extend(f"data: {line}" for line in json.dumps(data, cls=DjangoJSONEncoder).splitlines())
+    return "\n".join(lines) + "\n\n"
 
 
-def publish(request: http.HttpRequest, site: str):
-    get_object_or_404(models.Site, domain=site).publish(
-        request.user, preview=False)
+async def stream(publish_id: int, offset: int):
+    """Server-Sent Events with phase changes and log lines of a publish.
+    Event ids are offsets into the log so a reconnecting client continues
+    where it stopped (Last-Event-ID)"""
+    phase = None
+    async with Watcher.subscribe(publish_id) as watcher:
+        version = 0
+        while True:
+            update = await watcher.wait(version, KEEPALIVE)
+            if update is None:
+                yield ": keep-alive\n\n"
+                continue
+            version, snapshot = update
+            if snapshot is None:
+                yield event("error", {"message": "Publish does not exist"})
+                return
+            if snapshot["phase"] != phase:
+                phase = snapshot["phase"]
+                yield event("phase", {"phase": phase})
+            log = snapshot["log"]
+            while offset < len(log):
+                end = log.find("\n", offset)
+                if end < 0:
+                    break
+                yield event("log", {"line": log[offset:end]}, event_id=end + 1)
+                offset = end + 1
+            if snapshot["finished"]:
+                yield event("done", describe(snapshot))
+                return
 
 
-def preview(request: http.HttpRequest, site: str):
-    get_object_or_404(models.Site, domain=site).publish(
-        request.user, preview=True)
+async def events(request: http.HttpRequest, publish_id: int):
+    if request.method != "GET":
+        return http.HttpResponseNotAllowed(["GET"])
+    await sync_to_async(get_publish)(request, publish_id)
+    try:
+        offset = int(request.headers.get("Last-Event-ID", "0"))
+    except ValueError:
+        offset = 0
+    response = http.StreamingHttpResponse(stream(publish_id, offset), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
 
 
 def domains(request: http.HttpRequest):
     return http.JsonResponse(
-        models.Site.objects.all().values_list("domain", flat=True))
\ No newline at end of file
+        list(models.Site.objects.all().values_list("domain", flat=True)), safe=False)
@@ -1,14 +1,27 @@
 from django.contrib import admin
+from django.utils.html import format_html
 from django.utils.translation import gettext as _
 
+from . import jobs
 from .models import Theme, ThemeSource, Settings
 
 
 class ThemeAdmin(admin.ModelAdmin):
-    list_display = ("name", "installed", "updated")
+    list_display = ("name", "screenshot", "installed", "updated")
     readonly_fields = ("installed", "updated", "log")
     actions = ['install', 'update', ]
 
+    def changelist_view(self, request, extra_context=None):
+        Theme.sync_installed()
+        return super().changelist_view(request, extra_context)
+
+    @admin.display(description=_("Screenshot"))
+    def screenshot(self, obj):
+        urls = obj.thumbnails
+        if not urls:
+            return "-"
+        return format_html('<img src="{}" alt="{}" loading="lazy" style="max-height: 6em">', urls[0], obj.name)
+
     @admin.action(description=_('Install selected theme(s)'))
     def install(self, request, queryset):
         for object in queryset.all():
@@ -20,25 +33,22 @@ class ThemeAdmin(admin.ModelAdmin):
             object.update(save=True)
 
 class ThemeSourceAdmin(admin.ModelAdmin):
-    list_display = ("url", "multiple", "downloaded", "installed")
-    readonly_fields = ("updated", "downloaded", "installed", "path", "log")
-    actions = ['install', 'update', "download", "clear"]
+    list_display = ("url", "multiple", "downloaded", "installed", "status", "progress", "duration", "commit")
+    readonly_fields = ("updated", "downloaded", "installed", "path", "commit", "status", "progress", "duration", "log")
+    actions = ["sync", "install", "clear"]
     actions_on_top = True
 
-    @admin.action(description=_('Download the reposiotry using git clone'))
-    def download(self, request, queryset):
-        for object in queryset.all():
-            object.download(save=True)
+    @admin.action(description=_('Download or update the repository in background (shallow clone or fetch of the newest commit)'))
+    def sync(self, request, queryset):
+        # listed before queueing, which marks them as queued
+        sources = list(queryset.exclude(status__in=("queued", "running")))
+        jobs.submit(sources)
+        self.message_user(request, _("%d theme source(s) queued, reload to see their progress") % len(sources))
 
     @admin.action(description=_('Create a Theme object from the cloned repository'))
     def install(self, request, queryset):
         for object in queryset.all():
-            object.install(save=True)
-
-    @admin.action(description=_('Update the repository by running git pull'))
-    def update(self, request, queryset):
-        for object in queryset.all():
-            object.update(recurse=True, save=True)
+            object.install()
 
     @admin.action(description=_('Remove cloned directory and reset source state'))
     def clear(self, request, queryset):
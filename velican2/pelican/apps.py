@@ -1,14 +1,12 @@
 import io
-import threading
 
-from datetime import datetime
 from django.apps import apps, AppConfig
 from django.conf import settings
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
-from pathlib import Path
-from pelican.tools import pelican_themes
 
+from velican2.core import background
 from velican2.pelican import logger
 
 
@@ -17,17 +15,10 @@ class App(AppConfig):
     name = 'velican2.pelican'
 
     def ready(self):
+        # Themes installed into pelican are synchronized lazily by Theme.sync_installed
+        # (or by `manage.py velican_sync_themes`) so the startup does not touch the database
         if not settings.PELICAN_THEMES.is_dir():
-            settings.PELICAN_THEMES.mkdir(exist_ok=True)
-
-        # prefill Themes tables with builtin themes (into Pelican)
-        if "migrat" not in settings.SUBCOMMAND:
-            Theme = self.get_model("Theme")
-            for (theme, _) in pelican_themes.themes():
-                Theme.objects.get_or_create(name=Path(theme).parts[-1], defaults={
-                    "installed": True,
-                    "updated": datetime.now(),
-                })
+            settings.PELICAN_THEMES.mkdir(parents=True, exist_ok=True)
 
         post_save.connect(on_site_save, sender=apps.get_model("core", "Site"))
         post_save.connect(on_post_save, sender=apps.get_model("core", "Post"))
@@ -39,11 +30,12 @@ def on_site_save(instance, **kwargs): # instance: core.Site
     from velican2.pelican.models import Settings, Theme
     if instance.engine != "pelican":
         return
+    Theme.sync_installed()
     _, created = Settings.objects.get_or_create(
         site=instance,
         defaults=dict(
             theme=Theme.objects.all().first(),
-            post_url_template=Settings.POST_URL_TEMPLATES[0][1],
+            post_url_template=Settings.POST_URL_TEMPLATES[0][0],
         )
     )
     if created:
@@ -63,18 +55,24 @@ def on_page_save(instance, **kwargs): # instance: core.Page
     if instance.site.engine != "pelican":
         return
     pelican = Settings.objects.get(site=instance.site)
-    with pelican.get_page_path(instance).open("wt") as file:
+    path = pelican.get_page_path(instance)
+    if instance.is_scheduled:
+        path.unlink(missing_ok=True)  # written by the scheduler when the page is due
+        return
+    with path.open("wt") as file:
         write_page(instance, file)
 
 
 def on_publish_save(instance, **kwargs): # instance: core.Publish
-    from velican2.pelican.models import Settings
     if instance.site.engine != "pelican":
         return
-    pelican = Settings.objects.get(site=instance.site)
     if not instance.finished:
-        threading.Thread(
-            target=lambda instance: pelican.publish(instance), args=(instance, ), daemon=True).start()
+        # the build starts when the Publish row is committed (visible to the worker's connection)
+        if settings.VELICAN_PUBLISH_MEMORY:
+            from velican2.core import builds
+            transaction.on_commit(lambda: background.submit(builds.spawn, instance.id))
+        else:
+            transaction.on_commit(lambda: background.submit(instance.run))
 
 
 def write_post(post, writer: io.TextIOBase): # post: core.Post
@@ -85,6 +83,8 @@ def write_post(post, writer: io.TextIOBase): # post: core.Post
     # writer.write("Tags: "); writer.write(str(post.created)); writer.write("\n")
     writer.write("Authors: "); writer.write(str(post.author)); writer.write("\n")
     writer.write("Summary: "); writer.write(post.description.replace("\n", "")); writer.write("\n")
+    if post.draft or post.is_scheduled:
+        writer.write("Status: draft\n")
     writer.write("\n")
     writer.write(post.content)
 
@@ -0,0 +1,90 @@
+'''
+Jinja bytecode cache of themes shared by all sites and builds.
+
+Pelican creates a new Jinja environment (and compiles every template of the
+theme again) for each build. Compiled templates are stored per theme and
+theme version (source commit or directory mtime) in
+
+    PELICAN_THEMES/.jinja/<theme>/<version>/
+
+so only the first build after a theme was installed or updated compiles
+them. `Theme.update` and `ThemeSource.update` drop the cache of the theme.
+Every build gets its own `Cache` which also measures how much time the
+build spent compiling templates (reported into the publish log).
+'''
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from jinja2 import BytecodeCache, FileSystemBytecodeCache
+
+
+def root():
+    return settings.PELICAN_THEMES / ".jinja"
+
+
+class Timing(BytecodeCache):
+    """Measures compilation of templates; a bucket without code is compiled between get and set"""
+
+    def __init__(self):
+        self.compiled = 0
+        self.loaded = 0
+        self.compiling = 0.0
+        # start of compilation per thread (a plain dict - pelican pickles settings into its cache)
+        self._started = {}
+
+    def load_bytecode(self, bucket):
+        pass
+
+    def dump_bytecode(self, bucket):
+        pass
+
+    def get_bucket(self, environment, name, filename, source):
+        bucket = super().get_bucket(environment, name, filename, source)
+        if bucket.code is None:
+            self._started[threading.get_ident()] = time.perf_counter()
+        else:
+            self.loaded += 1
+        return bucket
+
+    def set_bucket(self, bucket):
+        started = self._started.pop(threading.get_ident(), None)
+        if started is not None:
+            self.compiling += time.perf_counter() - started
+            self.compiled += 1
+        super().set_bucket(bucket)
+
+    def report(self) -> str:
+        return f"{self.compiled} template(s) compiled in {self.compiling * 1000:.0f} ms, {self.loaded} loaded from cache"
+
+
+class Cache(Timing, FileSystemBytecodeCache):
+    """Compiled templates in `directory` - created by the first write (reads of a missing one are misses)"""
+
+    def __init__(self, directory):
+        Timing.__init__(self)
+        FileSystemBytecodeCache.__init__(self, str(directory))
+        self.created = False
+
+    load_bytecode = FileSystemBytecodeCache.load_bytecode
+
+    def dump_bytecode(self, bucket):
+        if not self.created:
+            os.makedirs(self.directory, exist_ok=True)
+            self.created = True
+        FileSystemBytecodeCache.dump_bytecode(self, bucket)
+
+
+def get(theme) -> Timing:  # theme: pelican.Theme
+    """Bytecode cache for one build with `theme` (none while the files of the theme are missing)"""
+    version = theme.version if settings.VELICAN_TEMPLATE_CACHE else None
+    if version is None:
+        return Timing()
+    return Cache(root() / theme.name / version)
+
+
+def invalidate(name: str):
+    """Drop compiled templates of theme `name` (all versions)"""
+    shutil.rmtree(root() / name, ignore_errors=True)
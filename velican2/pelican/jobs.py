@@ -0,0 +1,47 @@
+'''
+Background synchronisation of theme sources.
+
+Cloning and fetching theme repositories is slow (network bound) so admin
+actions and `ThemeSource.save` only queue the work here. A process-wide pool
+runs at most VELICAN_THEME_JOBS git processes at once; every source records
+its status, progress and duration on its row so the admin shows the state
+of a sync on reload.
+'''
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+
+from velican2.core import background
+from velican2.pelican import logger
+
+_executor = None
+_lock = threading.Lock()
+
+
+def executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.VELICAN_THEME_JOBS, thread_name_prefix="velican-theme")
+    return _executor
+
+
+@background.closing
+def run(url: str) -> bool:
+    from velican2.pelican.models import ThemeSource
+    try:
+        source = ThemeSource.objects.filter(url=url).first()
+        return source.sync() if source else False
+    except Exception as e:
+        logger.exception(f"Sync of theme source {url} failed")
+        ThemeSource.objects.filter(url=url).update(status="failed", log=str(e))
+        return False
+
+
+def submit(sources) -> list:
+    """Queue sync of `sources` (ThemeSources or their URLs). Return futures of the jobs"""
+    from velican2.pelican.models import ThemeSource
+    urls = [getattr(source, "url", source) for source in sources]
+    ThemeSource.objects.filter(url__in=urls).update(status="queued", progress="")
+    return [executor().submit(run, url) for url in urls]
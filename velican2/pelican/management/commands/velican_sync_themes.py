@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from velican2.pelican import jobs, thumbnails
+from velican2.pelican.models import Theme, ThemeSource
+
+
+class Command(BaseCommand):
+    help = "Create Theme rows for themes installed into Pelican (idempotent)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--fetch", action="store_true",
+                            help="Clone or update all theme sources first (VELICAN_THEME_JOBS at a time)")
+
+    def handle(self, fetch, **options):
+        if fetch:
+            started = time.monotonic()
+            futures = jobs.submit(ThemeSource.objects.all())
+            failed = sum(not future.result() for future in futures)
+            for source in ThemeSource.objects.order_by("url"):
+                self.stdout.write(f"{source}: {source.status} {source.progress} in {source.duration or 0:.1f}s {source.commit[:10]}")
+            self.stdout.write(f"{len(futures)} source(s) synced in {time.monotonic() - started:.1f}s, {failed} failed")
+        created = Theme.sync_installed(force=True)
+        self.stdout.write(f"{created} theme(s) added, {Theme.objects.count()} theme(s) known")
+        started = time.monotonic()
+        count = sum(len(thumbnails.generate(theme)) for theme in Theme.objects.filter(installed=True))
+        self.stdout.write(f"{count} thumbnail(s) up to date in {time.monotonic() - started:.1f}s")
@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-19 16:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pelican', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='theme',
+            name='commit',
+            field=models.CharField(blank=True, default='', help_text='Commit of the source the theme was installed from', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='themesource',
+            name='commit',
+            field=models.CharField(blank=True, default='', help_text='Commit the themes were installed from', max_length=40),
+        ),
+        migrations.AddField(
+            model_name='themesource',
+            name='duration',
+            field=models.FloatField(blank=True, help_text='Seconds the last sync took', null=True),
+        ),
+        migrations.AddField(
+            model_name='themesource',
+            name='progress',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='themesource',
+            name='status',
+            field=models.CharField(blank=True, choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='', max_length=8),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='facebook',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='github',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='linkedin',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='post_url_template',
+            field=models.CharField(choices=[('{date:%Y}/{date:%b}/{date:%d}/{slug}.html', 'slug.html'), ('{slug}/index.html', 'slug/index.html'), ('{date:%Y}/{slug}.html', 'year/slug.html'), ('{date:%Y}/{date:%b}/{slug}.html', 'year/month/slug.html'), ('{category}/{slug}.html', 'author/slug.html'), ('{category}/{slug}.html', 'category/slug.html'), ('{category}/{date:%Y}/{slug}.html', 'category/year/slug.html')], default='{date:%Y}/{date:%b}/{date:%d}/{slug}.html', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='settings',
+            name='twitter',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+    ]
@@ -1,19 +1,24 @@
-import io
+import os
 import pelican
 import re
+import shutil
 import subprocess
+import time
 import pelican.paginator
 
 from pathlib import Path
 from datetime import datetime
 from functools import cached_property
+from typing import Optional
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 from django.utils.translation import gettext as _
 from velican2.core import models as core
-from velican2.pelican import logger
+from velican2.core import db, deploy, progress, stages
+from velican2.pelican import bytecode, logger, parallel, preview, thumbnails
 from pelican.tools import pelican_themes
 #
 # HACK: inject different err function so we can actually see errors
@@ -25,10 +30,20 @@ pelican_themes.err = pelican_themes_err
 
 class ThemeSource(models.Model):
     """Git URL to the theme(s) that will be downloaded and if `not multiple` then installed automatically"""
+    STATUS_CHOICES = (
+        ("queued", _("Queued")),
+        ("running", _("Running")),
+        ("done", _("Done")),
+        ("failed", _("Failed")),
+    )
     url = models.CharField(max_length=256, null=False, primary_key=True)
     multiple = models.BooleanField(default=False, help_text="Check when the repository contains multiple themes. You cannot install them easily then")
     updated = models.DateTimeField(null=True, blank=True)
     log = models.TextField(null=True)
+    commit = models.CharField(max_length=40, blank=True, default="", help_text="Commit the themes were installed from")
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, blank=True, default="")
+    progress = models.CharField(max_length=64, blank=True, default="")
+    duration = models.FloatField(null=True, blank=True, help_text="Seconds the last sync took")
 
     __str__ = lambda self: self.name
 
@@ -48,38 +63,91 @@ class ThemeSource(models.Model):
     def path(self):
         return settings.PELICAN_THEMES / self.name
 
+    def record(self, **fields):
+        """Store `fields` right away (without going through `save`) so progress is visible while syncing"""
+        for key, value in fields.items():
+            setattr(self, key, value)
+        ThemeSource.objects.filter(url=self.url).update(**fields)
+
+    def git(self, *args, cwd=None):
+        """Run git with the per-repository timeout. Return (success, output)"""
+        try:
+            proc = subprocess.run(
+                ["git", *args], cwd=str(cwd or self.path), stderr=subprocess.STDOUT, stdout=subprocess.PIPE,
+                text=True, timeout=settings.VELICAN_THEME_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            return False, f"git {args[0]} timed out after {settings.VELICAN_THEME_TIMEOUT}s"
+        if proc.returncode != 0:
+            logger.debug(proc.stdout)
+        return proc.returncode == 0, proc.stdout
+
+    def head(self):
+        ok, output = self.git("rev-parse", "HEAD")
+        return output.strip() if ok else ""
+
     def download(self, save=True):
+        """Shallow clone of the repository (only the newest commit, submodules included)"""
         if self.downloaded:
             return True
-        proc = subprocess.Popen(
-            ["git", "clone", "--recurse-submodules", self.url, self.name],
-            cwd=settings.PELICAN_THEMES, stderr=subprocess.STDOUT, stdout=subprocess.PIPE, text=True)
-        if proc.wait() == 0:
-            self.updated = datetime.now()
+        ok, output = self.git(
+            "clone", "--depth", "1", "--single-branch", "--recurse-submodules", "--shallow-submodules",
+            self.url, self.name, cwd=settings.PELICAN_THEMES)
+        if ok:
+            self.updated = timezone.now()
             self.log = None
         else:
-            self.log = proc.stdout.read()
-            logger.debug(self.log)
+            self.log = output
         if save:
             self.save()
-        return proc.poll() == 0
+        return ok
 
     def update(self, recurse=True, save=True):
-        proc = subprocess.Popen(
-            ["git", "pull",  "--recurse-submodules"],
-            cwd=str(self.path), stderr=subprocess.STDOUT, stdout=subprocess.PIPE, text=True)
-        if proc.wait() == 0:
-            self.updated = datetime.now()
+        """Fetch only the newest commit of the tracked branch and reset the checkout to it"""
+        previous = self.head()
+        ok, output = self.git("fetch", "--depth", "1", "origin")
+        if ok:
+            ok, output = self.git("reset", "--hard", "FETCH_HEAD")
+        if ok:
+            ok, output = self.git("submodule", "update", "--init", "--recursive", "--depth", "1")
+        if ok and self.head() != previous:
+            for name in self.themes.values_list("name", flat=True):
+                bytecode.invalidate(name)
+        if ok:
+            self.updated = timezone.now()
             self.log = None
             if recurse:
                 for theme in self.themes.all():
                     theme.update()
         else:
-            self.log = proc.stdout.read()
-            logger.debug(self.log)
+            self.log = output
         if save:
-            return self.save()
-        return self.poll() == 0
+            self.save()
+        return ok
+
+    def sync(self):
+        """Download or update the repository and (re)install its themes when the commit changed.
+        Runs in a background job (see `velican2.pelican.jobs`); progress is recorded as it goes"""
+        started = time.monotonic()
+        self.record(status="running", progress="update" if self.downloaded else "clone", log=None)
+        ok = self.update(recurse=False, save=False) if self.downloaded else self.download(save=False)
+        previous = self.commit
+        if ok:
+            self.commit = self.head()
+            self.record(progress="unchanged" if self.commit == previous else "install")
+            # themes skip pelican_themes.install when they are installed from the same commit
+            themes = list(self.themes.all())
+            for theme in themes:
+                theme.update()
+            if not themes:
+                self.install()
+        self.record(
+            status="done" if ok else "failed",
+            commit=self.commit,
+            updated=self.updated,
+            log=self.log,
+            duration=time.monotonic() - started,
+        )
+        return ok
 
     def install(self):
         if self.multiple or self.installed:
@@ -89,24 +157,29 @@ class ThemeSource(models.Model):
         ).installed
 
     def clear(self, save=True):
-        self.path.unlink()
+        if self.path.exists():
+            shutil.rmtree(self.path)
         self.updated = None
         self.log = None
+        self.commit = ""
+        self.status = ""
+        self.progress = ""
         if save:
             return self.save()
 
     def delete(self, **kwargs):
-        self.clear()
+        self.clear(save=False)
         return super().delete(**kwargs)
 
     def save(self, **kwargs):
         if self.url.startswith("https") and not self.url.endswith(".git"):
             self.url += ".git"
-        if not self.downloaded:
-            self.download(save=False)
-        if self.downloaded and not self.installed:
-            self.install()
-        return super().save(**kwargs)
+        result = super().save(**kwargs)
+        if not self.downloaded and not self.status:
+            # clone in background once the row is committed so the (admin) request returns right away
+            from velican2.pelican import jobs
+            transaction.on_commit(lambda: jobs.submit([self]))
+        return result
 
 
 def is_theme(path):
@@ -119,23 +192,68 @@ class Theme(models.Model):
     installed = models.BooleanField(default=False)
     updated = models.DateTimeField(auto_now_add=True)
     log = models.TextField(null=True)
+    commit = models.CharField(max_length=40, blank=True, default="", help_text="Commit of the source the theme was installed from")
     source = models.ForeignKey(ThemeSource, on_delete=models.SET_NULL, null=True, related_name="themes")
 
     class Meta:
         verbose_name = _("Theme")
         verbose_name_plural = _("Themes")
 
+    # fingerprint (mtime of pelican's themes directory) of the last sync in this process
+    _synced = None
+
+    @classmethod
+    def sync_installed(cls, force=False):
+        """Make sure every theme installed into Pelican has a Theme row.
+
+        Called lazily where themes are needed (and by `velican_sync_themes`) instead
+        of on every process start. The directory listing and the database are
+        consulted only when pelican's themes directory changed since the last sync."""
+        fingerprint = os.stat(pelican_themes._THEMES_PATH).st_mtime_ns
+        if cls._synced == fingerprint and not force:
+            return 0
+        names = [Path(theme).parts[-1] for (theme, _) in pelican_themes.themes()]
+        existing = set(cls.objects.filter(name__in=names).values_list("name", flat=True))
+        missing = [cls(name=name, installed=True, updated=datetime.now()) for name in names if name not in existing]
+        cls.objects.bulk_create(missing, ignore_conflicts=True)
+        cls._synced = fingerprint
+        return len(missing)
+
+    @property
+    def directory(self) -> Path:
+        """Directory with the files of the theme (the clone or pelican's copy of a builtin theme)"""
+        if self.source:
+            return self.path
+        return Path(pelican_themes._THEMES_PATH) / self.name
+
+    @property
+    def version(self) -> Optional[str]:
+        """Identifies the installed files of the theme (commit of its source or mtime of its directory).
+        None while the directory is missing (the source was cleared or is not cloned yet)"""
+        if self.commit:
+            return self.commit[:12]
+        try:
+            return str(self.directory.stat().st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    @property
+    def screenshots(self):
+        return sorted(path for path in self.directory.iterdir()
+                      if path.suffix.lower() in thumbnails.SUFFIXES and path.is_file())
+
     @property
     def screenshots_jpeg(self):
-        return [io.FileIO(path, mode='r', closefd=True)
-                for path in Path(self.path).iterdir()
-                if str(path).endswith("jpg") or str(path).endswith("jpeg")]
+        return [path for path in self.screenshots if path.suffix.lower() in (".jpg", ".jpeg")]
 
     @property
     def screenshots_png(self):
-        return [io.FileIO(path, mode='r', closefd=True)
-                for path in self.path.iterdir()
-                if str(path).endswith("png")]
+        return [path for path in self.screenshots if path.suffix.lower() == ".png"]
+
+    @property
+    def thumbnails(self):
+        """URLs of thumbnails of the screenshots (see `velican2.pelican.thumbnails`)"""
+        return thumbnails.urls(self.name)
 
     @property
     def path(self):
@@ -150,9 +268,15 @@ class Theme(models.Model):
     def update(self, save=True):
         if not self.installed:
             return
+        commit = self.source.commit if self.source else ""
+        if commit and commit == self.commit:
+            return  # installed files are already from this commit
         try:
             pelican_themes.install(str(self.path), u=True, v=False)
             self.updated = datetime.now()
+            self.commit = commit
+            bytecode.invalidate(self.name)
+            thumbnails.generate(self)
         except Exception as e:
             self.log = str(e)
         if save:
@@ -164,6 +288,8 @@ class Theme(models.Model):
         try:
             pelican_themes.install(str(self.path), v=False)
             self.installed = True
+            self.commit = self.source.commit if self.source else ""
+            thumbnails.generate(self)
         except Exception as e:
             self.log = str(e)
         if save:
@@ -229,12 +355,19 @@ class Settings(models.Model):
     def author_url_template(self):
         return (self.author_url_prefix + "/" if self.author_url_prefix else "") + "{slug}.html"
 
+    def directories(self) -> list:
+        """Directories of the site (created by `save` and by `velican_provision`)"""
+        return [
+            self.conf["PATH"],
+            self.conf["PATH"] / self.conf['PAGE_PATHS'][0],
+            self.conf["PATH"] / self.conf['ARTICLE_PATHS'][0],
+            self.conf["OUTPUT_PATH"],
+            self.conf["PREVIEW_PATH"],
+        ]
+
     def save(self, **kwargs):
-        self.conf["PATH"].mkdir(exist_ok=True, parents=True)
-        (self.conf["PATH"] / self.conf['PAGE_PATHS'][0]).mkdir(exist_ok=True)
-        (self.conf["PATH"] / self.conf['ARTICLE_PATHS'][0]).mkdir(exist_ok=True)
-        self.conf["OUTPUT_PATH"].mkdir(exist_ok=True, parents=True)
-        self.conf["PREVIEW_PATH"].mkdir(exist_ok=True, parents=True)
+        for directory in self.directories():
+            directory.mkdir(exist_ok=True, parents=True)
         return super().save(**kwargs)
 
     @property
@@ -264,31 +397,65 @@ class Settings(models.Model):
             'AUTHOR_URL': self.author_url_template,
             'AUTHOR_SAVE_AS': self.author_url_template,
             'OUTPUT_PATH': settings.PELICAN_OUTPUT / self.site.domain / self.site.path,
-            'PREVIEW_PATH': settings.PELICAN_OUTPUT / self.site.domain / self.site.path / "preview",
+            # outside of OUTPUT_PATH - previews are served to staff only (see velican2.pelican.preview)
+            'PREVIEW_PATH': settings.PELICAN_PREVIEW / self.site.domain / self.site.path,
             'THEME': self.theme.name,
+            'JINJA_ENVIRONMENT': {
+                **pelican.settings.DEFAULT_CONFIG['JINJA_ENVIRONMENT'],
+                'bytecode_cache': bytecode.get(self.theme),
+            },
+            'VELICAN_SEARCH': "search/search.js" if stages.enabled("search") else None,
             # Why the heck the dafault PAGINATION_PATTERNS are broken?!
             'PAGINATION_PATTERNS': [pelican.paginator.PaginationRule(*x) for x in pelican.settings.DEFAULT_CONFIG['PAGINATION_PATTERNS']]
         })
+        if stages.enabled("feeds"):
+            # feeds are generated by the publish stage only when the newest posts change
+            from velican2.core.stages import feeds
+            self._settings.update({
+                'FEED_ALL_ATOM': None,
+                'CATEGORY_FEED_ATOM': None,
+                'AUTHOR_FEED_ATOM': None,
+                'AUTHOR_FEED_RSS': None,
+                'TRANSLATION_FEED_ATOM': None,
+                'VELICAN_FEED_ATOM': feeds.ATOM_PATH,
+                'VELICAN_FEED_RSS': feeds.RSS_PATH,
+            })
         return self._settings
 
     def get_publish_path(self):
         return self.conf['OUTPUT_PATH']
 
+    def get_preview_path(self):
+        return self.conf['PREVIEW_PATH']
+
+    def get_content_path(self):
+        return self.conf['PATH']
+
     def get_page_path(self, page: core.Page):
         return self.conf['PATH'] / self.conf['PAGE_PATHS'][0] / (page.slug + ".md")
 
     def get_post_path(self, post: core.Post):
         return self.conf['PATH'] / self.conf['ARTICLE_PATHS'][0] / (post.slug + ".md")
 
+    def export(self):
+        """Write all posts and pages of the site into the content directory (e.g. after a bulk import)"""
+        from velican2.pelican.apps import write_post, write_page
+        for post in core.Post.objects.filter(site=self.site).select_related("author").iterator(chunk_size=2000):
+            with self.get_post_path(post).open("wt") as file:
+                write_post(post, file)
+        for page in core.Page.objects.public().filter(site=self.site).iterator(chunk_size=2000):
+            with self.get_page_path(page).open("wt") as file:
+                write_page(page, file)
+
     def get_page_url(self, site: core.Site, page: core.Page):
         return site.absolutize(
-            self.post_url_template.format(
+            self.conf['PAGE_URL'].format(
                 slug=page.slug
             ))
 
     def get_post_url(self, site: core.Site, post: core.Post):
         return site.absolutize(
-            self.post_url_template.format(
+            self.conf['ARTICLE_URL'].format(
                 slug=post.slug,
                 date=post.created,
                 category=post.category.slug if post.category else "",
@@ -298,15 +465,31 @@ class Settings(models.Model):
     
     def publish(self, publish: core.Publish):
         try:
-            proc = pelican.Pelican(self.conf)
-            proc.run()
+            with progress.capture(publish):
+                publish.progress(phase="render")
+                if publish.preview:
+                    # only the changes are rendered over the production output, nothing is deployed
+                    preview.build(self, publish)
+                else:
+                    # output of large sites is written by several processes
+                    proc = parallel.Pelican(self.conf)
+                    proc.run()
+                logger.info(self.conf['JINJA_ENVIRONMENT']['bytecode_cache'].report())
+                if not publish.preview:
+                    # pelican reads the content files, the stages read the database - from a single snapshot
+                    with db.snapshot(self.site):
+                        stages.run(publish, self.conf['OUTPUT_PATH'])
+                    deploy.run(publish, self.conf['OUTPUT_PATH'])
             publish.success = True
+            publish.phase = "done"
         except Exception as e:
             publish.success = False
-            publish.message = str(e)
+            publish.phase = "failed"
+            publish.message = str(e)[:512]
             raise
         finally:
-            publish.finished = datetime.utcnow()
+            publish.refresh_from_db(fields=["log"])
+            publish.finished = timezone.now()
             publish.save()
 
 
@@ -0,0 +1,245 @@
+'''
+Rendering of large sites by several processes.
+
+Pelican reads all content into one shared context and then renders every
+article, paginated index and archive one after another on a single core.
+For sites with at least VELICAN_RENDER_PARALLEL_FROM articles and pages
+`Pelican` reads the context once and forks VELICAN_RENDER_PROCESSES
+processes which share it copy-on-write (nothing is serialized). Every
+process runs all generators but renders only its shard of the output files
+(by a hash of their path) straight into the output directory, so the merged
+result is the output of a sequential run. A file always belongs to the same
+shard so pelican's checks of files written twice still apply.
+
+Static files and sources are copied by the publishing thread meanwhile.
+The forked processes never use the database (content comes from the
+content directory) and leave without closing the inherited connections.
+Only a process without other threads forks - a child inherits locks held
+by other threads (of the web server, the database driver, logging) that
+nobody ever releases. So sites are rendered in parallel by the build
+processes (`velican_build`, see velican2.core.builds) unless their
+allocations are traced, never by builds run in the web process.
+
+A memory budget of the build (RLIMIT_AS, see velican2.core.builds) is
+inherited by every forked process, so it is split instead: each process
+(the publishing one included) may grow by an equal share of what is left of
+the budget at the fork. A process may end up copying the whole context
+(touching an object copies its page), so there are at most as many
+processes as shares as large as the context.
+
+Every process still runs all generators (it only skips rendering and
+writing files of other shards), so the speed-up depends on the theme and
+the number of cores. Parallel rendering is off unless VELICAN_RENDER_PROCESSES
+is set; `benchmarks/render.py` compares the durations (and outputs) of
+builds by different numbers of processes.
+'''
+import logging
+import multiprocessing
+import os
+import resource
+import threading
+import time
+import zlib
+
+import pelican
+
+from django.conf import settings
+from pelican import signals
+from pelican.generators import ArticlesGenerator, PagesGenerator, PelicanTemplateNotFound, TemplatePagesGenerator
+from pelican.writers import Writer
+
+from velican2.core import builds, progress
+from velican2.pelican import logger
+
+# generators whose output goes through the writer (split among processes)
+SHARDED = (ArticlesGenerator, PagesGenerator, TemplatePagesGenerator)
+# sends pelican's content_written to its receivers (ShardWriter replaces it in the forked processes)
+CONTENT_WRITTEN = signals.content_written.send
+# loaded before forking so the processes do not compile them each
+TEMPLATES = ("article", "page", "index", "archives", "period_archives", "tag", "tags", "category", "categories",
+             "author", "authors")
+
+
+def processes(count: int) -> int:
+    """Number of processes rendering a site with `count` articles and pages"""
+    if count < settings.VELICAN_RENDER_PARALLEL_FROM or threading.active_count() > 1:
+        return 1
+    return settings.VELICAN_RENDER_PROCESSES or os.cpu_count() or 1
+
+
+def shares(shards: int, context: int) -> tuple:
+    """Number of processes and the address space (bytes) each of them may use within the limit
+    of this process - None when it is not limited. `context` is the size of the context in bytes"""
+    soft, _ = resource.getrlimit(resource.RLIMIT_AS)
+    if soft == resource.RLIM_INFINITY:
+        return shards, None
+    used = builds.address_space()
+    headroom = max(soft - used, 0)
+    shards = max(1, min(shards, headroom // max(context, 1) - 1))
+    return shards, used + headroom // (shards + 1)
+
+
+def limit(size: int):
+    """Limit the address space of this process to `size` bytes"""
+    resource.setrlimit(resource.RLIMIT_AS, (size, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+
+class Template:
+    """Renders only files of the writer's shard (others are written to /dev/null)"""
+
+    def __init__(self, template, writer):
+        self.template = template
+        self.writer = writer
+
+    def render(self, context):
+        if not self.writer.owns(context["output_file"]):
+            return ""
+        return self.template.render(context)
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+
+class ShardWriter(Writer):
+    """Writes the files whose path hashes to `shard` of `shards`"""
+
+    def __init__(self, output_path, settings, shard: int, shards: int):
+        super().__init__(output_path, settings=settings)
+        self.shard = shard
+        self.shards = shards
+
+    def owns(self, name: str) -> bool:
+        return zlib.crc32(os.path.normpath(name).encode("utf-8")) % self.shards == self.shard
+
+    def filter(self, record) -> bool:
+        """Drop pelican's log lines of files of other shards"""
+        return record.msg != 'Writing "%s"' or self.owns(os.path.relpath(record.args[0], self.output_path))
+
+    def write_file(self, name, template, context, *args, **kwargs):
+        return super().write_file(name, Template(template, self), context, *args, **kwargs)
+
+    def content_written(self, path, **kwargs):
+        """pelican's `content_written` sent for files of the shard only (every file is announced once)"""
+        if not self.owns(os.path.relpath(path, self.output_path)):
+            return []
+        return CONTENT_WRITTEN(path, **kwargs)
+
+    def write_feed(self, elements, context, path=None, *args, **kwargs):
+        if path and not self.owns(path):
+            return None
+        return super().write_feed(elements, context, path, *args, **kwargs)
+
+    def _open_w(self, filename, encoding, override=False):
+        if not self.owns(os.path.relpath(filename, self.output_path)):
+            return open(os.devnull, "w", encoding=encoding)
+        return super()._open_w(filename, encoding, override)
+
+
+def render(sharded: list, output_path, conf: dict, shard: int, shards: int, size: int, pipe):
+    """Body of a forked process: write the shard's output of `sharded` generators and send the number of files"""
+    try:
+        if size:
+            limit(size)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, progress.PublishLogHandler):
+                root.removeHandler(handler)  # it writes into the database
+        writer = ShardWriter(output_path, conf, shard, shards)
+        logging.getLogger("pelican.writers").addFilter(writer)
+        signals.content_written.send = writer.content_written
+        for generator in sharded:
+            generator.generate_output(writer)
+        pipe.send((len(writer._written_files), None))
+    except BaseException as e:
+        pipe.send((0, f"{type(e).__name__}: {e}"))
+    finally:
+        pipe.close()
+
+
+class Pelican(pelican.Pelican):
+    """Pelican writing the output of large sites by several forked processes"""
+
+    def run(self):
+        context = self.settings.copy()
+        context["generated_content"] = {}
+        context["static_links"] = set()
+        context["static_content"] = {}
+        context["localsiteurl"] = self.settings["SITEURL"]
+        generators = [
+            cls(context=context, settings=self.settings, path=self.path, theme=self.theme, output_path=self.output_path)
+            for cls in self._get_generator_classes()
+        ]
+        before = builds.address_space()
+        for generator in generators:
+            if hasattr(generator, "generate_context"):
+                generator.generate_context()
+            if hasattr(generator, "check_disabled_readers"):
+                generator.check_disabled_readers()
+        signals.all_generators_finalized.send(generators)
+        for generator in generators:
+            if hasattr(generator, "refresh_metadata_intersite_links"):
+                generator.refresh_metadata_intersite_links()
+
+        shards = processes(len(context["generated_content"]))
+        if shards > 1:
+            self.write(generators, shards, builds.address_space() - before)
+        else:
+            self.write_all(generators)
+        signals.finalized.send(self)
+
+    def write_all(self, generators: list):
+        writer = self._get_writer()
+        for generator in generators:
+            if hasattr(generator, "generate_output"):
+                generator.generate_output(writer)
+
+    def write(self, generators: list, shards: int, size: int):
+        started = time.monotonic()
+        sharded = [generator for generator in generators if isinstance(generator, SHARDED)]
+        for generator in sharded:
+            for name in TEMPLATES:
+                try:
+                    generator.get_template(name)
+                except PelicanTemplateNotFound:
+                    pass
+        wanted = shards
+        shards, share = shares(shards, size)
+        if shards < wanted:
+            logger.info(f"{shards} of {wanted} rendering processes fit in the memory budget")
+        if shards == 1:
+            return self.write_all(generators)
+        budget = resource.getrlimit(resource.RLIMIT_AS)[0]
+        context = multiprocessing.get_context("fork")
+        workers = []
+        for shard in range(shards):
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=render, args=(sharded, self.output_path, self.settings, shard, shards, share, sender),
+                name=f"velican-render-{shard}", daemon=True)
+            process.start()
+            sender.close()
+            workers.append((process, receiver))
+
+        errors, written = [], 0
+        try:
+            if share:
+                limit(share)
+            writer = self._get_writer()
+            for generator in generators:
+                if hasattr(generator, "generate_output") and generator not in sharded:
+                    generator.generate_output(writer)
+        finally:
+            if share:
+                limit(budget)
+            for shard, (process, receiver) in enumerate(workers):
+                try:
+                    count, error = receiver.recv()
+                except EOFError:
+                    count, error = 0, None
+                process.join()
+                written += count
+                if error or process.exitcode:
+                    errors.append(f"rendering process {shard} failed: {error or f'exit code {process.exitcode}'}")
+        if errors:
+            raise RuntimeError("; ".join(errors))
+        logger.info(f"{written} file(s) written by {shards} processes in {time.monotonic() - started:.1f}s")
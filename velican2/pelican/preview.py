@@ -0,0 +1,183 @@
+'''
+Previews of drafts and unpublished edits overlaid on the production output.
+
+A preview is the production output of the site as a tree of hard links
+(`PREVIEW_PATH/<publish id>`, outside of OUTPUT_PATH so it is never
+deployed or served by caddy) with only the files affected by changes since
+the last successful publish written over it:
+
+ * drafts and scheduled posts (rendered as if they were published),
+ * posts and pages saved after the last publish started,
+ * every listing (index, archives, tag, category and author pages) that
+   contains one of them.
+
+Pelican still reads the whole content (from its own cache, not shared with
+production builds which must not see drafts as published) but renders only
+those files, so a preview costs about as much as the change. Written and
+copied files (theme and static files included) replace their links and
+never change the production output. Pages outside
+of the diff (e.g. a sidebar with the newest posts) show production content.
+
+`PREVIEW_PATH/current` links the newest tree; it is served only to staff of
+the site by `velican2.core.views.browse`. A site without production output
+is previewed whole.
+'''
+import fnmatch
+import os
+import shutil
+
+import pelican
+
+from django.db.models import Q
+from django.utils import timezone
+from pelican import signals
+from pelican.generators import StaticGenerator
+from pelican.writers import Writer
+
+from velican2.core import models as core
+from velican2.pelican import logger
+
+CURRENT = "current"
+
+
+class PreviewWriter(Writer):
+    """Writes only files showing one of the `changed` sources (all when None)"""
+
+    def __init__(self, output_path, settings, changed: set = None):
+        super().__init__(output_path, settings=settings)
+        self.changed = changed
+        self.skipped = 0
+
+    def affected(self, kwargs: dict) -> bool:
+        if self.changed is None:
+            return True
+        items = [kwargs.get("article"), kwargs.get("page"), *kwargs.get("articles", ()), *kwargs.get("dates", ())]
+        return any(item is not None and os.path.abspath(item.source_path) in self.changed for item in items)
+
+    def write_file(self, name, template, context, *args, **kwargs):
+        if not self.affected(kwargs):
+            self.skipped += 1
+            return None
+        return super().write_file(name, template, context, *args, **kwargs)
+
+    def write_feed(self, elements, context, path=None, *args, **kwargs):
+        return None  # feeds of previews are not read by anyone
+
+    def _open_w(self, filename, encoding, override=False):
+        # the file is a link into the production output - replace it instead of writing through it
+        if os.path.lexists(filename) and filename not in self._written_files:
+            os.unlink(filename)
+        return super()._open_w(filename, encoding, override)
+
+
+def unlink_copies(source: str, destination: str, ignores: list):
+    """Remove files of `destination` pelican's copy of `source` writes over (they are links into the production output)"""
+    if os.path.isfile(source):
+        if os.path.lexists(destination) and not os.path.isdir(destination):
+            os.unlink(destination)
+        return
+    for directory, dirnames, filenames in os.walk(source, followlinks=True):
+        dirnames[:] = [name for name in dirnames if not any(fnmatch.fnmatch(name, ignore) for ignore in ignores)]
+        target = os.path.join(destination, os.path.relpath(directory, source))
+        for filename in filenames:
+            path = os.path.join(target, filename)
+            if not any(fnmatch.fnmatch(filename, ignore) for ignore in ignores) and os.path.lexists(path):
+                os.unlink(path)
+
+
+class PreviewStaticGenerator(StaticGenerator):
+    """Copies theme and static files over new files instead of through the links of the tree"""
+
+    def _copy_paths(self, paths, source, destination, output_path, final_path=None):
+        for path in paths:
+            source_path = os.path.join(source, path)
+            if final_path:
+                target = os.path.join(output_path, destination, final_path)
+                if os.path.isfile(source_path):
+                    target = os.path.join(target, os.path.basename(path))
+            else:
+                target = os.path.join(output_path, destination, path)
+            unlink_copies(source_path, target, self.settings["IGNORE_FILES"])
+        super()._copy_paths(paths, source, destination, output_path, final_path)
+
+    def _copy_staticfile(self, sc):
+        unlink_copies(os.path.join(self.path, sc.source_path), os.path.join(self.output_path, sc.save_as), [])
+        super()._copy_staticfile(sc)
+
+
+class Pelican(pelican.Pelican):
+    """Pelican rendering only the files of a preview's changes"""
+
+    def __init__(self, settings, changed: set = None):
+        super().__init__(settings)
+        self.changed = changed
+        self.writer = None
+
+    def _get_generator_classes(self):
+        return [PreviewStaticGenerator if cls is StaticGenerator else cls for cls in super()._get_generator_classes()]
+
+    def _get_writer(self):
+        self.writer = PreviewWriter(self.output_path, self.settings, self.changed)
+        return self.writer
+
+
+def publish_drafts(sender, metadata: dict):
+    """Drafts of a preview are rendered like published content"""
+    if sender.settings.get("VELICAN_PREVIEW") and str(metadata.get("status", "")).lower() == "draft":
+        metadata["status"] = "published"
+
+
+signals.article_generator_context.connect(publish_drafts)
+signals.page_generator_context.connect(publish_drafts)
+
+
+def changes(engine, since) -> set:  # engine: pelican.models.Settings
+    """Source paths of drafts, scheduled content and content saved after `since`"""
+    posts = core.Post.objects.filter(
+        Q(updated__gte=since) | Q(draft=True) | Q(publish_at__gt=timezone.now()), site=engine.site)
+    pages = core.Page.objects.filter(site=engine.site, updated__gte=since)
+    changed = [engine.get_post_path(post) for post in posts.only("slug")]
+    changed.extend(engine.get_page_path(page) for page in pages.only("slug"))
+    return {os.path.abspath(path) for path in changed}
+
+
+def link(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)  # another filesystem
+
+
+def build(engine, publish: core.Publish):
+    """Render the preview of the site of `engine` and make it the current one"""
+    root = engine.get_preview_path()
+    root.mkdir(parents=True, exist_ok=True)
+    tree = root / str(publish.id)
+    shutil.rmtree(tree, ignore_errors=True)
+    production = core.Publish.objects.filter(
+        site=engine.site, preview=False, success=True).order_by("-started").first()
+    output = engine.conf["OUTPUT_PATH"]
+    if production is not None and output.is_dir():
+        shutil.copytree(output, tree, symlinks=True, copy_function=link, ignore=shutil.ignore_patterns(".velican"))
+        changed = changes(engine, production.started)
+    else:
+        tree.mkdir()
+        changed = None
+
+    conf = {**engine.conf, "OUTPUT_PATH": tree, "CACHE_PATH": str(root / ".cache"), "VELICAN_PREVIEW": True}
+    proc = Pelican(conf, changed)
+    proc.run()
+    if changed is None:
+        logger.info(f"Preview of {engine.site}: whole site rendered (no production output)")
+    else:
+        logger.info(f"Preview of {engine.site}: {len(proc.writer._written_files)} file(s) rendered, "
+                    f"{proc.writer.skipped} kept from production for {len(changed)} change(s)")
+
+    current = root / CURRENT
+    tmp = root / (CURRENT + ".tmp")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(tree.name)
+    tmp.replace(current)
+    for path in root.iterdir():
+        if path.name.isdigit() and path != tree:
+            shutil.rmtree(path, ignore_errors=True)
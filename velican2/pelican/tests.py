@@ -1,3 +1,295 @@
-from django.test import TestCase
+import filecmp
+import multiprocessing
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import types
 
-# Create your tests here.
+import jinja2
+
+from pathlib import Path
+from unittest import mock
+from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from pelican import signals
+from PIL import Image
+
+from velican2.core.models import Post, Publish, Site
+from velican2.pelican import bytecode, jobs, parallel, preview, thumbnails
+from velican2.pelican.models import Settings, Theme, ThemeSource
+from velican2.pelican.views import IMMUTABLE
+
+
+class ParallelTest(TestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="parallel.example.com", lang="en_US", title="Parallel")
+        for n in range(30):
+            Post.objects.create(site=self.site, slug=f"post-{n}", title=f"Post {n}", lang="en_US",
+                                description="", content=f"Content of post {n}", draft=False)
+        self.directory = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.site.get_engine().get_content_path(), ignore_errors=True)
+
+    def build(self, processes: int) -> Path:
+        output = self.directory / str(processes)
+        conf = {**self.site.get_engine().conf, "OUTPUT_PATH": str(output), "CACHE_CONTENT": False}
+        with override_settings(VELICAN_RENDER_PROCESSES=processes, VELICAN_RENDER_PARALLEL_FROM=0):
+            parallel.Pelican(conf).run()
+        return output
+
+    def test_output_is_the_same_as_of_one_process(self):
+        single, sharded = self.build(1), self.build(3)
+        names = sorted(str(path.relative_to(single)) for path in single.rglob("*") if path.is_file())
+        self.assertTrue(any(name.endswith("/post-29.html") for name in names))
+        match, mismatch, errors = filecmp.cmpfiles(single, sharded, names, shallow=False)
+        self.assertEqual((mismatch, errors), ([], []))
+        self.assertEqual(len(list(sharded.rglob("*"))), len(list(single.rglob("*"))))
+
+    def test_every_file_has_one_shard(self):
+        writers = [parallel.ShardWriter(str(self.directory), {}, shard, 3) for shard in range(3)]
+        for name in ("index.html", "index2.html", "category/news.html", "./feeds/all.atom.xml"):
+            self.assertEqual(sum(writer.owns(name) for writer in writers), 1)
+
+    def test_sites_are_rendered_by_one_process_by_default(self):
+        with override_settings(VELICAN_RENDER_PARALLEL_FROM=0):
+            self.assertEqual(parallel.processes(30), 1)
+
+    def test_only_a_single_threaded_process_forks(self):
+        with override_settings(VELICAN_RENDER_PROCESSES=3, VELICAN_RENDER_PARALLEL_FROM=0):
+            self.assertEqual(parallel.processes(30), 3)
+            stop = threading.Event()
+            thread = threading.Thread(target=stop.wait)
+            thread.start()
+            try:
+                self.assertEqual(parallel.processes(30), 1)
+            finally:
+                stop.set()
+                thread.join()
+
+    def test_every_file_is_announced_by_its_shard(self):
+        written = []
+
+        def receiver(path, **kwargs):
+            written.append(path)
+
+        signals.content_written.connect(receiver)
+        try:
+            writers = [parallel.ShardWriter(str(self.directory), {}, shard, 3) for shard in range(3)]
+            for name in ("index.html", "index2.html", "category/news.html"):
+                for writer in writers:
+                    writer.content_written(str(self.directory / name), context={})
+        finally:
+            signals.content_written.disconnect(receiver)
+        self.assertEqual(sorted(written), sorted(str(self.directory / name)
+                                                 for name in ("index.html", "index2.html", "category/news.html")))
+
+    def test_memory_budget_is_split_among_processes(self):
+        MB = 1024 * 1024
+        with mock.patch.object(parallel.builds, "address_space", return_value=400 * MB), \
+                mock.patch.object(parallel.resource, "getrlimit", return_value=(1000 * MB, -1)):
+            # 600 MB left: 3 processes and the publishing one get 150 MB each
+            self.assertEqual(parallel.shares(3, 100 * MB), (3, 550 * MB))
+            # only two shares as large as a 250 MB context fit
+            self.assertEqual(parallel.shares(3, 250 * MB), (1, 700 * MB))
+        with mock.patch.object(parallel.resource, "getrlimit", return_value=(parallel.resource.RLIM_INFINITY, -1)):
+            self.assertEqual(parallel.shares(3, 250 * MB), (3, None))
+
+
+class BytecodeTest(TestCase):
+
+    def test_directory_is_created_by_the_first_write(self):
+        themes = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, themes)
+        with override_settings(PELICAN_THEMES=themes, VELICAN_TEMPLATE_CACHE=True):
+            cache = bytecode.get(types.SimpleNamespace(name="theme", version="1"))
+            directory = themes / ".jinja/theme/1"
+            self.assertFalse(directory.exists())
+            loader = jinja2.DictLoader({"page.html": "{{ title }}"})
+            jinja2.Environment(loader=loader, bytecode_cache=cache).get_template("page.html")
+            self.assertEqual(len(list(directory.iterdir())), 1)
+            # a build with the compiled templates only reads them
+            cache = bytecode.get(types.SimpleNamespace(name="theme", version="1"))
+            jinja2.Environment(loader=loader, bytecode_cache=cache).get_template("page.html")
+            self.assertEqual((cache.compiled, cache.loaded), (0, 1))
+
+    def test_theme_without_files_is_not_cached(self):
+        root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, root)
+        with override_settings(PELICAN_THEMES=root / "themes", PELICAN_CONTENT=root / "content",
+                               VELICAN_TEMPLATE_CACHE=True):
+            # e.g. its source was cleared; inserted without `save` which installs the theme
+            theme, = Theme.objects.bulk_create([Theme(name="cleared", installed=True)])
+            self.assertIsNone(theme.version)
+            site = Site.objects.create(domain="cleared.example.com", lang="en_US", title="Cleared")
+            Settings.objects.filter(site=site).update(theme=theme)
+            post = Post.objects.create(site=site, slug="post", title="Post", lang="en_US", description="",
+                                       content="Content", draft=False)
+            engine = site.get_engine()
+            self.assertTrue(engine.get_post_path(post).exists())
+            self.assertNotIsInstance(engine.conf["JINJA_ENVIRONMENT"]["bytecode_cache"], bytecode.Cache)
+            self.assertFalse((root / "themes/.jinja").exists())
+
+
+class ThumbnailsTest(TestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.enterContext(override_settings(PELICAN_THEMES=self.root, VELICAN_THUMBNAIL_SIZE=100))
+
+    def theme(self, name: str, key="1") -> types.SimpleNamespace:
+        directory = self.root / name
+        directory.mkdir(exist_ok=True)
+        Image.new("RGB", (800, 400), "red").save(directory / "screenshot.png")
+        Image.new("RGB", (300, 600), "blue").save(directory / "screenshot.jpg")
+        return types.SimpleNamespace(name=name, directory=directory, version=key,
+                                     screenshots=sorted(directory.glob("screenshot.*")))
+
+    def test_screenshots_are_resized_into_webp(self):
+        theme = self.theme("red")
+        self.assertEqual(thumbnails.generate(theme), ["0.webp", "1.webp"])
+        sizes = []
+        for file in ("0.webp", "1.webp"):
+            with Image.open(thumbnails.path("red", "1", file)) as image:
+                self.assertEqual(image.format, "WEBP")
+                sizes.append(image.size)
+        self.assertEqual(sizes, [(50, 100), (100, 50)])  # screenshot.jpg, screenshot.png
+        self.assertEqual(thumbnails.urls("red"), ["/themes/red/1/0.webp", "/themes/red/1/1.webp"])
+        response = self.client.get("/themes/red/1/0.webp")
+        self.assertEqual((response["Content-Type"], response["Cache-Control"]), ("image/webp", IMMUTABLE))
+        # thumbnails of the previous commit are removed
+        theme.version = "2"
+        thumbnails.generate(theme)
+        self.assertEqual([path.name for path in (self.root / ".thumbnails/red").iterdir()], ["2"])
+
+    def test_concurrent_processes_keep_each_others_entries(self):
+        themes = [self.theme(f"theme-{n}") for n in range(8)]
+        processes = [multiprocessing.get_context("fork").Process(target=thumbnails.generate, args=(theme,))
+                     for theme in themes]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual([process.exitcode for process in processes], [0] * len(processes))
+        self.assertEqual(sorted(thumbnails.index()), sorted(theme.name for theme in themes))
+
+
+class SyncTest(TransactionTestCase):
+
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.root)
+        self.enterContext(override_settings(PELICAN_THEMES=self.root / "themes"))
+        (self.root / "themes").mkdir()
+        # a local repository stands in for the remote one
+        self.remote = self.root / "themes.git"
+        self.remote.mkdir()
+        subprocess.run(["git", "init", "-q"], cwd=self.remote, check=True)
+        self.commit("first")
+        self.futures = []
+        submit = jobs.submit
+        self.enterContext(mock.patch.object(
+            jobs, "submit", side_effect=lambda sources: self.futures.extend(submit(sources)) or self.futures))
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+
+    def commit(self, message: str) -> str:
+        (self.remote / "README").write_text(message)
+        for command in (["add", "README"],
+                        ["-c", "user.name=Editor", "-c", "user.email=editor@example.com", "commit", "-q", "-m", message]):
+            subprocess.run(["git", *command], cwd=self.remote, check=True)
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=self.remote, check=True,
+                              stdout=subprocess.PIPE, text=True).stdout.strip()
+
+    def wait(self) -> list:
+        results = [future.result(timeout=60) for future in self.futures]
+        self.futures.clear()
+        return results
+
+    def test_sync_action_queues_clone_or_update(self):
+        # multiple themes are not installed into pelican
+        source = ThemeSource.objects.create(url=f"file://{self.remote}", multiple=True)
+        self.assertEqual(self.wait(), [True])  # cloned once saved
+        source.refresh_from_db()
+        self.assertEqual((source.status, source.progress), ("done", "install"))
+        self.assertEqual((source.path / "README").read_text(), "first")
+
+        head = self.commit("second")
+        response = self.client.post("/admin/pelican/themesource/",
+                                    {"action": "sync", "_selected_action": [source.url]}, follow=True)
+        self.assertContains(response, "1 theme source(s) queued")
+        self.assertEqual(self.wait(), [True])
+        source.refresh_from_db()
+        self.assertEqual((source.status, source.progress, source.commit), ("done", "install", head))
+        self.assertEqual((source.path / "README").read_text(), "second")
+
+        # sources already queued are not queued twice
+        ThemeSource.objects.filter(url=source.url).update(status="queued")
+        self.client.post("/admin/pelican/themesource/", {"action": "sync", "_selected_action": [source.url]})
+        self.assertEqual(self.futures, [])
+
+
+class PreviewTest(TestCase):
+
+    def setUp(self):
+        Theme.sync_installed(force=True)
+        self.site = Site.objects.create(domain="preview.example.com", lang="en_US", title="Preview")
+        self.posts = [Post.objects.create(site=self.site, slug=f"post-{n}", title=f"Post {n}", lang="en_US",
+                                          description="", content=f"Content of post {n}", draft=False)
+                      for n in range(3)]
+        self.engine = self.site.get_engine()
+        self.engine.conf["THEME"] = str(Theme.objects.get(name="notmyidea").directory)  # a theme with static files
+        self.directory = Path(tempfile.mkdtemp())
+        parallel.Pelican({**self.engine.conf, "CACHE_CONTENT": False}).run()
+        self.production = Publish.objects.create(site=self.site, success=True, finished=timezone.now())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        for path in (self.engine.get_content_path(), self.engine.get_publish_path(), self.engine.get_preview_path()):
+            shutil.rmtree(path, ignore_errors=True)
+
+    def files(self, root: Path) -> dict:
+        return {path.relative_to(root).as_posix(): path for path in root.rglob("*.html")}
+
+    def test_only_changes_are_rendered_over_production(self):
+        Post.objects.create(site=self.site, slug="draft", title="Unpublished draft", lang="en_US",
+                            description="", content="Draft content", draft=True)
+        preview.build(self.engine, Publish.objects.create(site=self.site, preview=True))
+        tree = self.engine.get_preview_path() / "current"
+        output = self.engine.get_publish_path()
+        production, previewed = self.files(output), self.files(tree)
+
+        draft = next(name for name in previewed if name.endswith("/draft.html"))
+        self.assertNotIn(draft, production)
+        self.assertIn("Unpublished draft", previewed["index.html"].read_text())
+        self.assertNotIn("Unpublished draft", production["index.html"].read_text())
+        post = next(name for name in production if name.endswith("/post-0.html"))
+        self.assertTrue(os.path.samefile(production[post], previewed[post]))
+        self.assertFalse(os.path.samefile(production["index.html"], previewed["index.html"]))
+        self.assertFalse(any(name.startswith("preview") for name in production))
+
+    def test_theme_files_of_production_are_not_written_through(self):
+        output = self.engine.get_publish_path()
+        stylesheet = next(path for path in (output / "theme").rglob("*.css"))
+        stylesheet.write_text("/* theme of the last publish */")  # the theme changed since
+        inode = stylesheet.stat().st_ino
+        preview.build(self.engine, Publish.objects.create(site=self.site, preview=True))
+        self.assertEqual((stylesheet.stat().st_ino, stylesheet.read_text()), (inode, "/* theme of the last publish */"))
+        copy = self.engine.get_preview_path() / "current" / stylesheet.relative_to(output)
+        self.assertNotEqual(copy.read_text(), "/* theme of the last publish */")
+
+    def test_served_to_staff_only(self):
+        preview.build(self.engine, Publish.objects.create(site=self.site, preview=True))
+        self.assertEqual(self.client.get("/preview/preview.example.com/").status_code, 403)
+        self.client.force_login(User.objects.create_superuser("admin", "admin@example.com", "password"))
+        response = self.client.get("/preview/preview.example.com/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'href="/preview/preview.example.com/', response.content)
+        self.assertNotIn(self.site.absolutize("/").encode(), response.content)
+        self.assertEqual(response["Cache-Control"], "private, no-store")
@@ -0,0 +1,100 @@
+'''
+Thumbnails of theme screenshots.
+
+Screenshots (png/jpeg images in the root of a theme) are resized into WebP
+thumbnails once per theme commit and stored beside the themes:
+
+    PELICAN_THEMES/.thumbnails/index.json              {theme: {"key": ..., "files": [...]}}
+    PELICAN_THEMES/.thumbnails/<theme>/<key>/<n>.webp
+
+The key (commit of the theme source or mtime of the theme directory) is part
+of the URL so thumbnails are served as immutable. A theme gallery reads only
+the index instead of listing and decoding images of hundreds of themes.
+
+Updates of the index are serialized by an exclusive `flock` of
+`.thumbnails/index.lock`, so that thumbnails generated concurrently by web
+workers and `velican_sync_themes` do not drop entries of each other.
+'''
+import fcntl
+import os
+import shutil
+
+from pathlib import Path
+from django.conf import settings
+from django.urls import reverse
+from PIL import Image
+
+from velican2.core.stages import read_json, write_json
+from velican2.pelican import logger
+
+SUFFIXES = (".png", ".jpg", ".jpeg")
+
+# (mtime of the index, index) loaded by this process
+_index = (None, {})
+
+
+def root() -> Path:
+    return settings.PELICAN_THEMES / ".thumbnails"
+
+
+def index() -> dict:
+    """Thumbnails of all themes; re-read only when the index file changed"""
+    global _index
+    try:
+        mtime = (root() / "index.json").stat().st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    if _index[0] != mtime:
+        _index = (mtime, read_json(root() / "index.json", {}))
+    return _index[1]
+
+
+def urls(name: str) -> list:
+    entry = index().get(name)
+    if not entry:
+        return []
+    return [reverse("theme-thumbnail", args=(name, entry["key"], file)) for file in entry["files"]]
+
+
+def generate(theme, force=False) -> list:  # theme: pelican.Theme
+    """Create thumbnails of `theme` unless they exist for its current key. Return their file names"""
+    directory = theme.directory
+    if not directory.is_dir():
+        return []
+    current = theme.version
+    entry = index().get(theme.name)
+    if entry and entry["key"] == current and not force:
+        return entry["files"]
+    target = root() / theme.name / current
+    files = []
+    for number, screenshot in enumerate(theme.screenshots):
+        target.mkdir(parents=True, exist_ok=True)
+        name = f"{number}.webp"
+        try:
+            with Image.open(screenshot) as image:
+                image.thumbnail((settings.VELICAN_THUMBNAIL_SIZE, settings.VELICAN_THUMBNAIL_SIZE))
+                image.save(target / name, "WEBP", quality=80)
+            files.append(name)
+        except OSError as e:
+            logger.warning(f"Cannot create thumbnail of {screenshot}: {e}")
+    root().mkdir(parents=True, exist_ok=True)
+    with (root() / "index.lock").open("a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)  # released by closing the file
+        data = read_json(root() / "index.json", {})
+        data[theme.name] = {"key": current, "files": files}
+        write_json(root() / "index.json", data)
+    # thumbnails of previous commits are not referenced anymore
+    for previous in (root() / theme.name).glob("*"):
+        if previous.name != current:
+            shutil.rmtree(previous, ignore_errors=True)
+    return files
+
+
+def path(name: str, key: str, file: str) -> Path:
+    """Path of a thumbnail file; raises FileNotFoundError for unknown or malformed names"""
+    if any(os.sep in part or part.startswith(".") for part in (name, key, file)):
+        raise FileNotFoundError(file)
+    result = root() / name / key / file
+    if not result.is_file():
+        raise FileNotFoundError(result)
+    return result
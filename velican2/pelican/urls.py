@@ -0,0 +1,7 @@
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('', views.gallery, name="theme-gallery"),
+    path('<name>/<key>/<file>', views.thumbnail, name="theme-thumbnail"),
+]
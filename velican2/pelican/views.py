@@ -0,0 +1,41 @@
+import hashlib
+import json
+
+from django import http
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import require_safe
+
+from . import thumbnails
+from .models import Theme
+
+# thumbnail URLs contain the theme commit so they never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+
+@require_safe
+def thumbnail(request: http.HttpRequest, name: str, key: str, file: str):
+    try:
+        path = thumbnails.path(name, key, file)
+    except FileNotFoundError:
+        raise http.Http404(file)
+    response = http.FileResponse(path.open("rb"), content_type="image/webp")
+    response["Cache-Control"] = IMMUTABLE
+    return response
+
+
+@require_safe
+@staff_member_required
+def gallery(request: http.HttpRequest):
+    """Index of themes with URLs of their thumbnails for theme pickers"""
+    themes = [
+        {"name": name, "installed": installed, "thumbnails": thumbnails.urls(name)}
+        for name, installed in Theme.objects.order_by("name").values_list("name", "installed")
+    ]
+    tag = 'W/"' + hashlib.md5(json.dumps(themes).encode()).hexdigest() + '"'
+    if tag in request.headers.get("If-None-Match", ""):
+        response = http.HttpResponseNotModified()
+    else:
+        response = http.JsonResponse({"themes": themes})
+    response["ETag"] = tag
+    response["Cache-Control"] = "private, no-cache"
+    return response
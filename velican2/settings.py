@@ -45,6 +45,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'velican2.core.db.StickyMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -68,6 +69,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'velican2.wsgi.application'
+# tests never call a caddy running on the machine (see velican2.testing)
+TEST_RUNNER = 'velican2.testing.Runner'
 
 
 # Database
@@ -77,17 +80,106 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'sqlite3.db',
+        # a file - Django never closes connections to an in-memory database (connection lifecycle tests)
+        'TEST': {'NAME': BASE_DIR / 'test-sqlite3.db'},
     }
 }
+# connections of one worker process per database alias kept in a client-side pool (PostgreSQL only, 0 - no pool)
+VELICAN_DB_POOL = int(os.getenv("VELICAN_DB_POOL", "0"))
+# PostgreSQL instead of the SQLite file (other connection parameters come from the PG* environment variables)
+if os.getenv("PGDATABASE"):
+    DATABASES["default"] = {
+        'ENGINE': 'velican2.core.backends.postgresql',
+        'NAME': os.getenv("PGDATABASE"),
+        'OPTIONS': {"pool": {"max_size": VELICAN_DB_POOL}} if VELICAN_DB_POOL else {},
+    }
+# comma separated names of read replicas of the default database (files for sqlite), see velican2.core.db
+for number, name in enumerate(filter(None, os.getenv("VELICAN_DB_REPLICAS", "").split(",")), start=1):
+    DATABASES[f"replica{number}"] = {**DATABASES["default"], "NAME": name, "TEST": {"MIRROR": "default"}}
+# second connection to the primary database builds read their snapshot from when there is no replica
+DATABASES["snapshot"] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+DATABASE_ROUTERS = ["velican2.core.db.Router"]
 
 MEDIA_ROOT = BASE_DIR / "media"
 
 PELICAN_THEMES = Path(os.getenv("PELICAN_CONTENT", BASE_DIR / "runtime/themes/"))
 PELICAN_CONTENT = Path(os.getenv("PELICAN_CONTENT", BASE_DIR / "runtime/pelican/"))
 PELICAN_OUTPUT = Path(os.getenv("PELICAN_OUTPUT", BASE_DIR / "runtime/www/"))
+# previews are kept apart from the output (which is served publicly)
+PELICAN_PREVIEW = Path(os.getenv("PELICAN_PREVIEW", BASE_DIR / "runtime/preview/"))
 
 # set to None or an empty string to disable caddy deployment
 CADDY_URL = os.getenv("VELICAN_CADDY", "http://localhost:2019")
+# seconds to wait for caddy's admin API
+CADDY_TIMEOUT = float(os.getenv("VELICAN_CADDY_TIMEOUT", "5"))
+# seconds browsers and proxies may use a page before they revalidate it (by its ETag)
+CADDY_HTML_MAX_AGE = int(os.getenv("VELICAN_CADDY_HTML_MAX_AGE", "300"))
+
+# stages (modules of velican2.core.stages) run in this order after a site was rendered
+VELICAN_PUBLISH_STAGES = ["search", "sitemap", "feeds", "fingerprint", ]
+# length of the term prefix the client-side search index is sharded by
+VELICAN_SEARCH_PREFIX = int(os.getenv("VELICAN_SEARCH_PREFIX", "2"))
+# seconds between checks of a running publish when clients watch its progress (and between writes of its log)
+VELICAN_PROGRESS_POLL = float(os.getenv("VELICAN_PROGRESS_POLL", "1"))
+# number of the newest posts in Atom/RSS feeds
+VELICAN_FEED_SIZE = int(os.getenv("VELICAN_FEED_SIZE", "20"))
+# number of theme repositories cloned/fetched at the same time
+VELICAN_THEME_JOBS = int(os.getenv("VELICAN_THEME_JOBS", "4"))
+# seconds a single git clone/fetch of a theme repository may take
+VELICAN_THEME_TIMEOUT = float(os.getenv("VELICAN_THEME_TIMEOUT", "120"))
+# maximal width and height (px) of thumbnails of theme screenshots
+VELICAN_THUMBNAIL_SIZE = int(os.getenv("VELICAN_THUMBNAIL_SIZE", "400"))
+# keep compiled Jinja templates of themes between builds (see velican2.pelican.bytecode)
+VELICAN_TEMPLATE_CACHE = os.getenv("VELICAN_TEMPLATE_CACHE", "True").lower() in ("1", "true", "yes")
+# number of parallel transfers (batches of changed files) of a deployment
+VELICAN_DEPLOY_WORKERS = int(os.getenv("VELICAN_DEPLOY_WORKERS", "8"))
+# command (with options) used by the ssh deployment to reach remote targets
+VELICAN_DEPLOY_SSH = os.getenv("VELICAN_DEPLOY_SSH", "ssh -o BatchMode=yes")
+# endpoint of the caching proxy changed URLs are purged from after a publish (empty - no purges, see velican2.core.purge)
+VELICAN_PURGE_URL = os.getenv("VELICAN_PURGE_URL", "")
+# Authorization header of purge requests (e.g. "Bearer <token>")
+VELICAN_PURGE_AUTHORIZATION = os.getenv("VELICAN_PURGE_AUTHORIZATION", "")
+# URLs purged by one request
+VELICAN_PURGE_BATCH = int(os.getenv("VELICAN_PURGE_BATCH", "100"))
+# attempts to purge a batch before the purge is given up (and repeated by the next publish)
+VELICAN_PURGE_ATTEMPTS = int(os.getenv("VELICAN_PURGE_ATTEMPTS", "5"))
+# seconds before the first retry of a batch, doubled with every failed attempt
+VELICAN_PURGE_BACKOFF = float(os.getenv("VELICAN_PURGE_BACKOFF", "1"))
+# seconds to wait for the purge endpoint
+VELICAN_PURGE_TIMEOUT = float(os.getenv("VELICAN_PURGE_TIMEOUT", "10"))
+# seconds of a scheduling window - items due in the same window are published by one build
+VELICAN_SCHEDULE_WINDOW = float(os.getenv("VELICAN_SCHEDULE_WINDOW", "60"))
+# longest sleep (seconds) of the scheduler before it looks for newly scheduled items
+VELICAN_SCHEDULE_RECHECK = float(os.getenv("VELICAN_SCHEDULE_RECHECK", "60"))
+# publishers (modules of velican2.core.publishers) new posts are announced with
+VELICAN_PUBLISHERS = ["facebook", "twitter", ]
+VELICAN_FACEBOOK_API = os.getenv("VELICAN_FACEBOOK_API", "https://graph.facebook.com/v19.0")
+VELICAN_TWITTER_API = os.getenv("VELICAN_TWITTER_API", "https://api.twitter.com")
+# number of threads sending announcements from the outbox
+VELICAN_OUTBOX_WORKERS = int(os.getenv("VELICAN_OUTBOX_WORKERS", "4"))
+# seconds to wait for a social network API
+VELICAN_OUTBOX_TIMEOUT = float(os.getenv("VELICAN_OUTBOX_TIMEOUT", "10"))
+# attempts to send an announcement before it is marked as failed
+VELICAN_OUTBOX_ATTEMPTS = int(os.getenv("VELICAN_OUTBOX_ATTEMPTS", "8"))
+# seconds before the first retry, doubled with every failed attempt
+VELICAN_OUTBOX_BACKOFF = float(os.getenv("VELICAN_OUTBOX_BACKOFF", "30"))
+# number of publishes built at the same time by one process (see velican2.core.background)
+VELICAN_PUBLISH_WORKERS = int(os.getenv("VELICAN_PUBLISH_WORKERS", "2"))
+# memory budget (MB) of a build run by its own process (0 - builds run in the web process, see velican2.core.builds)
+VELICAN_PUBLISH_MEMORY = int(os.getenv("VELICAN_PUBLISH_MEMORY", "2048"))
+# top allocating lines recorded on a publish (0 - allocations of builds are not traced, tracing slows them down)
+VELICAN_PUBLISH_TRACEMALLOC = int(os.getenv("VELICAN_PUBLISH_TRACEMALLOC", "0"))
+# processes writing the output of one large site (0 - one per CPU, see velican2.pelican.parallel);
+# one by default, measure the speed-up with benchmarks/render.py on the target machine before raising it
+VELICAN_RENDER_PROCESSES = int(os.getenv("VELICAN_RENDER_PROCESSES", "1"))
+# articles and pages a site needs to have its output written by VELICAN_RENDER_PROCESSES processes
+VELICAN_RENDER_PARALLEL_FROM = int(os.getenv("VELICAN_RENDER_PARALLEL_FROM", "2000"))
+# revisions of a post or page stored as deltas between two full snapshots (see velican2.core.revisions)
+VELICAN_REVISION_SNAPSHOT = int(os.getenv("VELICAN_REVISION_SNAPSHOT", "20"))
+# seconds between writes of traffic rollups (and checkpoints) by the access log ingestion
+VELICAN_LOG_FLUSH = float(os.getenv("VELICAN_LOG_FLUSH", "10"))
+# seconds after a change of a site (or an unsafe request of a client) its reads stay on the primary database
+VELICAN_REPLICA_LAG = float(os.getenv("VELICAN_REPLICA_LAG", "5"))
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -0,0 +1,37 @@
+'''
+Test runner of the project (`manage.py test`).
+
+Tests never call services running on the machine: caddy deployment is
+disabled (tests of velican2.caddy start a fake caddy of their own), so
+saving a site in a test does not depend on a local caddy.
+
+Tests never write into the working tree either: content, output, previews
+and themes (clones and compiled templates) of the run are kept in a
+temporary directory removed at its end.
+'''
+import tempfile
+
+from pathlib import Path
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class Runner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.directory = tempfile.TemporaryDirectory(prefix="velican-tests-")
+        root = Path(self.directory.name)
+        self.isolation = override_settings(
+            CADDY_URL="",
+            PELICAN_THEMES=root / "themes",
+            PELICAN_CONTENT=root / "pelican",
+            PELICAN_OUTPUT=root / "www",
+            PELICAN_PREVIEW=root / "preview",
+        )
+        self.isolation.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.isolation.disable()
+        self.directory.cleanup()
+        super().teardown_test_environment(**kwargs)
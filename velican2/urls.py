@@ -19,5 +19,6 @@ from django.urls import path, include
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('allauth.urls')),
+    path('themes/', include('velican2.pelican.urls')),
     path('', include('velican2.core.urls')),
 ]